@@ -0,0 +1,91 @@
+"""
+Albums tab cost: loading every album's images versus one listing query.
+
+The old listing read every Album, loaded all Image rows of each one through
+album.images to show a count, and ran get_images_by_album(limit=1) per album
+for its cover. get_album_listing reads the count and cover kept on each
+albums row in one query. The grouped count over the images index, which
+get_album_listing would need without the stored counts, is timed as well.
+
+Usage:
+    python -m benchmarks.album_listing --albums 10000 --images 1000000
+"""
+import os
+import time
+import argparse
+import tempfile
+
+from sqlalchemy import func, insert, select
+
+from database.db_manager import DatabaseManager
+from database.models import Album, Image
+
+
+def make_database(path, albums, images):
+    db = DatabaseManager(f"sqlite:///{path}")
+    db.session.execute(insert(Album.__table__), [{'name': f"Album {i:05d}", 'image_count': 0} for i in range(albums)])
+    db.session.commit()
+    album_ids = [album_id for album_id, in db.session.query(Album.id)]
+    chunk = 100000
+    for start in range(0, images, chunk):
+        db.add_images([
+            {'file_path': f"/photos/IMG_{i:07d}.jpg", 'timestamp': None, 'location': None, 'has_text': False,
+             'album_id': album_ids[i % len(album_ids)]}
+            for i in range(start, min(start + chunk, images))
+        ], chunk_size=chunk)
+    return db
+
+
+def per_album_queries(db):
+    listing = []
+    for album in db.get_albums():
+        cover = db.get_images_by_album(album.id, limit=1)
+        listing.append((album.id, album.name, len(album.images), cover[0].file_path if cover else None))
+    db.session.expire_all()
+    return listing
+
+
+def grouped_count(db):
+    query = (
+        select(Image.album_id, func.count(), func.min(Image.id))
+        .group_by(Image.album_id)
+    )
+    with db.engine.connect() as conn:
+        return conn.execute(query).all()
+
+
+def timed(function, *args, repeat=1):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--albums', type=int, default=10000)
+    parser.add_argument('--images', type=int, default=1000000)
+    parser.add_argument('--skip-old', action='store_true', help='do not time the per album queries')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db = make_database(os.path.join(folder, 'albums.db'), args.albums, args.images)
+        print(f"{args.albums} albums, {args.images} images\n")
+        print(f"{'listing':<30}{'ms':>10}")
+        runs = [
+            ('grouped count of images', grouped_count),
+            ('get_album_listing', DatabaseManager.get_album_listing),
+        ]
+        if not args.skip_old:
+            runs.insert(0, ('queries per album', per_album_queries))
+        for name, function in runs:
+            # The slow per album listing runs once, the queries report their best of three
+            listing, elapsed = timed(function, db, repeat=1 if function is per_album_queries else 3)
+            print(f"{name:<30}{1000 * elapsed:>10.1f}  {len(listing)} rows")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+List view reads while a bulk ingest writes, with the rollback journal and in WAL mode.
+
+A job thread adds --images images with add_images, committing chunks of
+--chunk, like an import. Meanwhile the main thread pages through the
+catalog with get_image_page and count_images, the reads behind the list
+views, and records how long each one took. With the rollback journal a
+reader has to wait while the writer commits and may give up once the busy
+timeout passes. In WAL mode readers do not wait for the writer.
+
+Usage:
+    python -m benchmarks.concurrent_reads --images 200000
+"""
+import os
+import time
+import argparse
+import tempfile
+import threading
+
+import numpy as np
+from sqlalchemy.exc import OperationalError
+
+from database.db_manager import DatabaseManager
+
+
+def ingest(db, images, chunk, done):
+    try:
+        album_id = db.get_default_album_id()
+        for start in range(0, images, chunk):
+            db.add_images([
+                {'file_path': f"/photos/IMG_{i:07d}.jpg", 'timestamp': None, 'location': None,
+                 'has_text': False, 'album_id': album_id}
+                for i in range(start, min(start + chunk, images))
+            ], chunk_size=chunk)
+    finally:
+        db.remove_session()
+        done.set()
+
+
+def read_while_writing(db, images, chunk):
+    done = threading.Event()
+    writer = threading.Thread(target=ingest, args=(db, images, chunk, done))
+    start = time.perf_counter()
+    writer.start()
+    latencies, errors = [], 0
+    while not done.is_set():
+        began = time.perf_counter()
+        try:
+            db.get_image_page(0, 200)
+            db.count_images()
+            latencies.append(time.perf_counter() - began)
+        except OperationalError:
+            errors += 1
+    writer.join()
+    return np.array(latencies) * 1000, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200000)
+    parser.add_argument('--chunk', type=int, default=500, help='images per committed chunk')
+    parser.add_argument('--busy-timeout', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{args.images} images added in chunks of {args.chunk}\n")
+    print(f"{'profile':<14}{'reads':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}{'failed':>8}{'ingest s':>10}")
+    # SQLite's own defaults, which the engine used before, then the WAL profile
+    for journal_mode, synchronous in (('delete', 'full'), ('wal', 'normal')):
+        with tempfile.TemporaryDirectory() as folder:
+            db = DatabaseManager(f"sqlite:///{os.path.join(folder, 'catalog.db')}", journal_mode=journal_mode,
+                                 synchronous=synchronous, busy_timeout=args.busy_timeout)
+            latencies, errors, elapsed = read_while_writing(db, args.images, args.chunk)
+            p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (0, 0)
+            worst = latencies.max() if len(latencies) else 0
+            print(f"{journal_mode + ', ' + synchronous:<14}{len(latencies):>8}{p50:>10.2f}{p99:>10.2f}{worst:>10.2f}{errors:>8}"
+                  f"{elapsed:>10.1f}")
+            db.close()
+
+
+if __name__ == '__main__':
+    main()
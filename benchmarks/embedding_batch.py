@@ -0,0 +1,65 @@
+"""
+Face embedding throughput of the recognition model at different batch sizes.
+
+Chips come from the photos in a folder when one is given, otherwise random
+chips of the model's input size are used.
+
+Usage:
+    python -m benchmarks.embedding_batch --folder /path/to/photos --sizes 1 8 32 64
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+from insightface.app import FaceAnalysis
+
+from benchmarks.face_pipeline import list_images
+from utils.face_pipeline import FacePipeline
+
+
+def collect_chips(pipeline, folder, limit, count):
+    chips = []
+    if folder:
+        for path in list_images(folder, limit):
+            img = cv2.imread(path)
+            if img is not None:
+                chips.extend(chip for _, chip in pipeline.prepare(img, path))
+    if not chips:
+        size = pipeline.recognition_model.input_size[0]
+        rng = np.random.default_rng(0)
+        chips = [rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8) for _ in range(count)]
+    return chips
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folder')
+    parser.add_argument('--limit', type=int, default=200, help='images read from the folder')
+    parser.add_argument('--chips', type=int, default=512, help='random chips when no folder is given')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    analyzer = FaceAnalysis(allowed_modules=['detection', 'recognition'])
+    analyzer.prepare(ctx_id=0, det_size=(640, 640))
+    pipeline = FacePipeline(analyzer)
+    chips = collect_chips(pipeline, args.folder, args.limit, args.chips)
+    pipeline.embed_chips(chips[:max(args.sizes)])  # warm up
+
+    print(f"{len(chips)} chips\n")
+    print(f"{'batch':>6}{'faces/s':>12}{'ms/face':>10}{'speedup':>10}")
+    baseline = None
+    for batch_size in args.sizes:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for i in range(0, len(chips), batch_size):
+                pipeline.embed_chips(chips[i:i + batch_size])
+        elapsed = (time.perf_counter() - start) / args.repeat
+        rate = len(chips) / elapsed
+        baseline = baseline or rate
+        print(f"{batch_size:>6}{rate:>12.1f}{1000 / rate:>10.2f}{rate / baseline:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Unknown persons from greedy matching during processing versus batch clustering.
+
+Face processing matches every new face against the gallery and creates an
+Unknown_ person when nothing is within the relaxed threshold, so a person
+whose first faces happen to be far apart is split into several Unknowns.
+The greedy pass is replayed here over synthetic embeddings in a random
+order. FaceClusterer then groups all unnamed faces at once and the persons
+of each group are merged. An incremental run over a second batch of faces
+shows the cost of grouping only new faces.
+
+Embeddings are unit vectors around one random centre per identity, with
+--noise gaussian noise per dimension.
+
+Usage:
+    python -m benchmarks.face_clustering --identities 1000 --faces 20
+"""
+import time
+import argparse
+
+import numpy as np
+
+from utils.face_clustering import FaceClusterer, UNKNOWN_PREFIX
+from utils.face_gallery import FaceGallery
+
+
+def make_faces(rng, centres, identities, noise):
+    embeddings = centres[identities] + rng.normal(scale=noise, size=(len(identities), centres.shape[1]))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32)
+
+
+def greedy(gallery, embeddings, face_ids, threshold):
+    """Match faces one at a time like process_images, the first unmatched face names a new person"""
+    for embedding, face_id in zip(embeddings, face_ids):
+        rows, distances = gallery.match(embedding)
+        if rows[0] >= 0 and distances[0] < threshold:
+            name = gallery.label_of(int(rows[0]))
+        else:
+            name = f"{UNKNOWN_PREFIX}{face_id:08x}"
+        gallery.add(embedding, name, int(face_id))
+
+
+def report(name, gallery, identities, elapsed):
+    labels = gallery.labels
+    pairs = np.unique(np.stack([identities, labels]), axis=1)
+    persons = np.unique(labels).size
+    per_identity = persons / np.unique(identities).size
+    mixed = int(np.count_nonzero(np.bincount(pairs[1]) > 1))
+    print(f"{name:<26}{persons:>9}{per_identity:>14.2f}{mixed:>8}{elapsed:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--identities', type=int, default=1000)
+    parser.add_argument('--faces', type=int, default=20, help='faces per identity')
+    parser.add_argument('--noise', type=float, default=0.025)
+    parser.add_argument('--threshold', type=float, default=0.72, help='relaxed matching threshold')
+    parser.add_argument('--exact-max-faces', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    centres = rng.normal(size=(args.identities * 2, 512))
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+    identities = rng.permutation(np.repeat(np.arange(args.identities), args.faces))
+    embeddings = make_faces(rng, centres, identities, args.noise)
+    gallery = FaceGallery(initial_capacity=2 * len(identities))
+
+    print(f"{args.identities} identities, {len(identities)} faces\n")
+    print(f"{'':<26}{'persons':>9}{'per identity':>14}{'mixed':>8}{'seconds':>10}")
+    start = time.perf_counter()
+    greedy(gallery, embeddings, np.arange(1, len(identities) + 1), args.threshold)
+    report('greedy, processing order', gallery, identities, time.perf_counter() - start)
+
+    clusterer = FaceClusterer(gallery, threshold=args.threshold, exact_max_faces=args.exact_max_faces)
+    start = time.perf_counter()
+    gallery.merge_labels(clusterer.cluster())
+    report('clustered', gallery, identities, time.perf_counter() - start)
+
+    # A second import: faces of known and of new identities
+    last_id = int(gallery.face_ids.max())
+    new_identities = rng.integers(0, args.identities * 2, len(identities) // 4)
+    new_embeddings = make_faces(rng, centres, new_identities, args.noise)
+    greedy(gallery, new_embeddings, np.arange(last_id + 1, last_id + 1 + len(new_identities)), args.threshold)
+    identities = np.concatenate([identities, new_identities])
+    report('greedy, second import', gallery, identities, 0.0)
+    start = time.perf_counter()
+    gallery.merge_labels(clusterer.cluster(after_face_id=last_id))
+    report('clustered incrementally', gallery, identities, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Recall and latency of the IVF face index against the exact gallery scan.
+
+Usage:
+    python -m benchmarks.face_index --faces 200000 --persons 20000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from utils.face_gallery import FaceGallery
+from utils.face_index import IVFFaceIndex
+
+
+def make_gallery(faces, persons, dim, noise, seed):
+    """Build a gallery of synthetic identities with noisy per-face embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(persons, dim)).astype(np.float32)
+    owners = rng.integers(0, persons, size=faces)
+    embeddings = centers[owners] + noise * rng.normal(size=(faces, dim)).astype(np.float32)
+    gallery = FaceGallery(dim=dim, initial_capacity=faces)
+    gallery.add_many(embeddings, [f"person_{i}" for i in owners], np.arange(faces))
+    query_owners = rng.integers(0, persons, size=1000)
+    queries = centers[query_owners] + noise * rng.normal(size=(len(query_owners), dim)).astype(np.float32)
+    return gallery, queries
+
+
+def time_per_query(search, queries, batch):
+    start = time.perf_counter()
+    results = [search(queries[i:i + batch]) for i in range(0, len(queries), batch)]
+    elapsed = time.perf_counter() - start
+    rows = np.concatenate([r[0] for r in results])
+    return rows, 1000.0 * elapsed / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faces', type=int, default=200000)
+    parser.add_argument('--persons', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--noise', type=float, default=0.3)
+    parser.add_argument('--batch', type=int, default=4, help='faces matched per call, like one photo')
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    gallery, queries = make_gallery(args.faces, args.persons, args.dim, args.noise, args.seed)
+
+    start = time.perf_counter()
+    index = IVFFaceIndex(gallery)
+    index.train()
+    print(f"Gallery: {args.faces} faces, {args.persons} persons, dim {args.dim}")
+    print(f"Index: {len(index.centroids)} lists, trained in {time.perf_counter() - start:.2f}s\n")
+
+    exact_rows, exact_ms = time_per_query(gallery.match, queries, args.batch)
+    exact_labels = gallery.labels[exact_rows]
+    print(f"{'mode':<12}{'ms/face':>10}{'speedup':>10}{'recall@1':>10}{'label agreement':>18}")
+    print(f"{'exact':<12}{exact_ms:>10.3f}{1.0:>10.1f}{1.0:>10.3f}{1.0:>18.3f}")
+
+    for n_probe in args.probes:
+        rows, ms = time_per_query(lambda q: index.search(q, n_probe=n_probe), queries, args.batch)
+        recall = float(np.mean(rows == exact_rows))
+        agreement = float(np.mean(gallery.labels[rows] == exact_labels))
+        print(f"{'ivf/' + str(n_probe):<12}{ms:>10.3f}{exact_ms / ms:>10.1f}{recall:>10.3f}{agreement:>18.3f}")
+
+
+if __name__ == '__main__':
+    main()
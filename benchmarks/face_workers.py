@@ -0,0 +1,45 @@
+"""
+Face processing throughput with different numbers of worker processes.
+
+Usage:
+    python -m benchmarks.face_workers /path/to/photos --limit 500 --workers 1 2 4 8 16
+"""
+import argparse
+import time
+
+from benchmarks.face_pipeline import list_images
+from utils.face_workers import FaceWorkerPool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('folder')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args()
+
+    paths = list_images(args.folder, args.limit)
+    print(f"{len(paths)} images\n")
+    print(f"{'workers':>8}{'images/s':>12}{'faces/s':>12}{'scaling':>10}")
+    baseline = None
+    for workers in args.workers:
+        pool = FaceWorkerPool(workers, batch_size=args.batch_size)
+        start = None
+        images = faces = 0
+        # The clock starts at the first result so model loading is not counted
+        for _, result in pool.run(enumerate(paths)):
+            if start is None:
+                start = time.perf_counter()
+                continue
+            images += 1
+            faces += len(result or [])
+        elapsed = time.perf_counter() - start if start else 0.0
+        rate = images / elapsed if elapsed else 0.0
+        baseline = baseline or rate
+        print(f"{workers:>8}{rate:>12.1f}{(faces / elapsed if elapsed else 0.0):>12.1f}"
+              f"{(rate / baseline if baseline else 0.0):>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
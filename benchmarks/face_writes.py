@@ -0,0 +1,91 @@
+"""
+Database transactions and time spent saving processed images.
+
+Compares saving every face with add_face followed by
+update_image_processed_status, one commit each, with the buffered writer
+used by face processing. Runs on a temporary SQLite database with random
+embeddings.
+
+Usage:
+    python -m benchmarks.face_writes --images 1000 --faces 3 --batch 50
+"""
+import os
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import event
+
+from database.db_manager import DatabaseManager
+from database.models import Image
+from utils.face_writer import FaceWriteBuffer
+
+
+def make_database(path, images):
+    db = DatabaseManager(f"sqlite:///{path}")
+    db.add_images({'file_path': f"/photos/{i}.jpg", 'timestamp': None, 'location': '',
+                   'has_text': 0, 'album_id': db.get_default_album_id()} for i in range(images))
+    image_ids = [image_id for image_id, in db.session.query(Image.id).order_by(Image.id)]
+
+    commits = [0]
+    event.listen(db.engine, 'commit', lambda conn: commits.__setitem__(0, commits[0] + 1))
+    return db, image_ids, commits
+
+
+def face_records(rng, count, dim):
+    return [{
+        'person_name': f"Unknown_{rng.integers(1 << 32):08x}",
+        'embedding': rng.standard_normal(dim).astype(np.float32),
+        'facial_area': '[10, 10, 90, 90]',
+        'landmarks': None,
+        'confidence': 0.99
+    } for _ in range(count)]
+
+
+def per_face_commits(db, image_ids, faces, dim):
+    rng = np.random.default_rng(0)
+    for image_id in image_ids:
+        records = face_records(rng, faces, dim)
+        for record in records:
+            db.add_face(image_id=image_id, **record)
+        db.update_image_processed_status(image_id, True, len(records))
+
+
+def buffered(db, image_ids, faces, dim, batch):
+    rng = np.random.default_rng(0)
+    writes = FaceWriteBuffer(db, max_images=batch, max_delay=float('inf'))
+    for image_id in image_ids:
+        records = face_records(rng, faces, dim)
+        writes.add(image_id, records, [-1] * len(records))
+        if writes.due:
+            writes.flush()
+    writes.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=1000)
+    parser.add_argument('--faces', type=int, default=3, help='faces per image')
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--batch', type=int, default=50, help='images per buffered transaction')
+    args = parser.parse_args()
+
+    runs = [
+        ('per face', lambda db, ids: per_face_commits(db, ids, args.faces, args.dim)),
+        (f"buffered {args.batch}", lambda db, ids: buffered(db, ids, args.faces, args.dim, args.batch)),
+    ]
+    print(f"{args.images} images, {args.faces} faces each\n")
+    print(f"{'writer':<14}{'commits':>10}{'per 1k img':>12}{'images/s':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        for i, (name, run) in enumerate(runs):
+            db, image_ids, commits = make_database(os.path.join(directory, f"{i}.db"), args.images)
+            start = time.perf_counter()
+            run(db, image_ids)
+            elapsed = time.perf_counter() - start
+            db.close()
+            print(f"{name:<14}{commits[0]:>10}{1000 * commits[0] / args.images:>12.0f}{args.images / elapsed:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
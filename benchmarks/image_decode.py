@@ -0,0 +1,92 @@
+"""
+Decode cost of full-resolution reads versus reduced-scale reads for face detection.
+
+The full read is the plain cv2.imread face processing used to do. Reduced
+reads go through utils.image_loader.read_image with several minimum sides;
+1024 keeps what RetinaFace itself resizes to, lower values trade small-face
+recall for speed. Peak memory is measured with tracemalloc, which sees the
+decoded arrays but not libjpeg's small row buffers.
+
+A synthetic 24 megapixel JPEG is generated when no folder is given.
+
+Usage:
+    python -m benchmarks.image_decode --folder /path/to/photos --min-side 1024 640
+    python -m benchmarks.image_decode --repeat 10
+"""
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from utils.image_loader import read_image
+from utils.library_scanner import iter_media_files
+
+
+def make_image(folder):
+    # Smooth gradients with noise compress like a photo, unlike pure noise
+    height, width = 4000, 6000
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    noise = np.random.default_rng(0).integers(0, 6, size=(height, width, 3))
+    path = os.path.join(folder, 'IMG_24MP.jpg')
+    cv2.imwrite(path, (base + noise).clip(0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return [path]
+
+
+def list_images(folder, limit):
+    paths = [entry.path for entry in iter_media_files(folder)
+             if entry.name.lower().endswith(('.jpg', '.jpeg'))]
+    return sorted(paths)[:limit]
+
+
+def measure(paths, repeat, read):
+    tracemalloc.start()
+    start = time.perf_counter()
+    shape = None
+    for _ in range(repeat):
+        for path in paths:
+            img, scale = read(path)
+            shape = img.shape
+            del img
+    elapsed = (time.perf_counter() - start) / (repeat * len(paths))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, shape, scale
+
+
+def run(paths, repeat, min_sides):
+    print(f"{len(paths)} files, {repeat} repeats\n")
+    print(f"{'read':<18}{'ms/image':>10}{'peak MB':>10}{'speedup':>10}  last shape, scale")
+    baseline = None
+    for min_side in [None] + min_sides:
+        if min_side is None:
+            label, read = 'cv2.imread', lambda path: (cv2.imread(path), 1.0)
+        else:
+            label, read = f"min side {min_side}", lambda path, m=min_side: read_image(path, m)
+        elapsed, peak, shape, scale = measure(paths, repeat, read)
+        baseline = baseline or elapsed
+        print(f"{label:<18}{1000 * elapsed:>10.1f}{peak / 1024 / 1024:>10.1f}{baseline / elapsed:>10.2f}"
+              f"  {shape[1]}x{shape[0]}, {scale:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folder')
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-side', type=int, nargs='+', default=[1024, 640])
+    args = parser.parse_args()
+
+    if args.folder:
+        run(list_images(args.folder, args.limit), args.repeat, args.min_side)
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        run(make_image(folder), args.repeat, args.min_side)
+
+
+if __name__ == '__main__':
+    main()
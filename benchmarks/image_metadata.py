@@ -0,0 +1,120 @@
+"""
+Metadata extraction throughput: full exifread parse versus header-only reads.
+
+The full parse is what folder processing used to do, one file at a time.
+Header-only reads go through IngestPipeline without a read budget, which
+is how it reads videos and oversized images, with several thread counts. --latency adds a delay
+to every read and seek call, as a stand-in for a spinning disk or network
+share; without it the files are usually served from the page cache, so drop
+caches first for cold SSD numbers.
+
+Synthetic JPEGs with EXIF are generated when no folder is given.
+
+Usage:
+    python -m benchmarks.image_metadata --folder /path/to/photos --threads 1 4 8 16
+    python -m benchmarks.image_metadata --latency 5
+"""
+import os
+import time
+import argparse
+import tempfile
+
+import exifread
+
+from benchmarks.face_pipeline import list_images
+from utils.ingest_pipeline import IngestPipeline
+from utils.library_scanner import FileFingerprint
+
+
+class SlowFile:
+    """File wrapper sleeping on every read and seek"""
+
+    def __init__(self, f, latency):
+        self._f = f
+        self._latency = latency
+
+    def read(self, *args):
+        time.sleep(self._latency)
+        return self._f.read(*args)
+
+    def seek(self, *args):
+        time.sleep(self._latency)
+        return self._f.seek(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+def make_images(folder, count):
+    from PIL import Image
+
+    exif = Image.Exif()
+    exif[0x0112] = 1
+    exif[0x0132] = '2021:06:01 12:00:00'
+    exif[0x8825] = {1: 'N', 2: (52.0, 22.0, 12.0), 3: 'E', 4: (4.0, 53.0, 24.0)}
+    image = Image.effect_noise((1600, 1200), 64).convert('RGB')
+    path = os.path.join(folder, 'base.jpg')
+    image.save(path, exif=exif, quality=90)
+    data = open(path, 'rb').read()
+    os.remove(path)
+    for i in range(count):
+        with open(os.path.join(folder, f"IMG_{i:05d}.jpg"), 'wb') as f:
+            f.write(data)
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder))
+
+
+def full_parse(paths, opener):
+    for path in paths:
+        with opener(path, 'rb') as f:
+            exifread.process_file(f)
+
+
+def run(paths, threads, latency):
+    opener = open
+    if latency:
+        opener = lambda path, mode: SlowFile(open(path, mode), latency / 1000)
+
+    print(f"{len(paths)} files, {latency} ms per read/seek\n")
+    print(f"{'reader':<22}{'files/s':>10}{'speedup':>10}")
+    start = time.perf_counter()
+    full_parse(paths, opener)
+    baseline = len(paths) / (time.perf_counter() - start)
+    print(f"{'full exifread':<22}{baseline:>10.1f}{1:>10.2f}")
+
+    items = []
+    for path in paths:
+        stat = os.stat(path)
+        items.append((path, path, FileFingerprint(stat.st_size, stat.st_mtime_ns, stat.st_ino)))
+    for count in threads:
+        pipeline = IngestPipeline(count, max_bytes=0, opener=opener)
+        start = time.perf_counter()
+        for _ in pipeline.run(items):
+            pass
+        rate = len(paths) / (time.perf_counter() - start)
+        print(f"{f'header, {count} threads':<22}{rate:>10.1f}{rate / baseline:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folder')
+    parser.add_argument('--limit', type=int, default=1000)
+    parser.add_argument('--count', type=int, default=300, help='synthetic images when no folder is given')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every read and seek')
+    args = parser.parse_args()
+
+    if args.folder:
+        run(list_images(args.folder, args.limit), args.threads, args.latency)
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        run(make_images(folder, args.count), args.threads, args.latency)
+
+
+if __name__ == '__main__':
+    main()
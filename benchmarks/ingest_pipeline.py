@@ -0,0 +1,147 @@
+"""
+Ingest throughput: separate passes per stage versus one read fanned out to all stages.
+
+The separate passes are what an import followed by face detection used to
+do: header reads for metadata, a thumbnail decode per file and a decode for
+face detection, each opening the file again. The pipeline reads every file
+once and hashes, parses, thumbnails and decodes it from memory. Both sides
+include face input decoding; detection itself is not run.
+
+--latency adds a delay to every read and seek call, as a stand-in for a
+network share; without it the files are usually served from the page cache
+and only the decode work saved shows. Every pass of the baseline reads
+through the same opener.
+
+Synthetic 12 megapixel JPEGs with EXIF are generated when no folder is given.
+
+Usage:
+    python -m benchmarks.ingest_pipeline --folder /path/to/photos --workers 8
+    python -m benchmarks.ingest_pipeline --count 100 --latency 20
+"""
+import os
+import time
+import argparse
+import tempfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils.image_loader import DecodedImageCache, decode_image
+from utils.ingest_pipeline import IngestPipeline
+from utils.library_scanner import iter_media_files, fingerprint
+from utils.thumbnail_cache import ThumbnailCache
+
+
+class SlowFile:
+    """File wrapper sleeping on every read and seek, like benchmarks.image_metadata without its imports"""
+
+    def __init__(self, f, latency):
+        self._f = f
+        self._latency = latency
+
+    def read(self, *args):
+        time.sleep(self._latency)
+        return self._f.read(*args)
+
+    def seek(self, *args):
+        time.sleep(self._latency)
+        return self._f.seek(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._f.close()
+
+
+def make_images(folder, count):
+    from PIL import Image
+
+    height, width = 3000, 4000
+    y, x = np.mgrid[0:height, 0:width]
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    pixels = pixels + np.random.default_rng(0).integers(0, 6, size=(height, width, 3))
+    image = Image.fromarray(pixels.clip(0, 255).astype(np.uint8))
+    exif = Image.Exif()
+    exif[0x0112] = 1
+    exif[0x0132] = '2021:06:01 12:00:00'
+    path = os.path.join(folder, 'base.jpg')
+    image.save(path, exif=exif, quality=90)
+    data = open(path, 'rb').read()
+    os.remove(path)
+    for i in range(count):
+        with open(os.path.join(folder, f"IMG_{i:05d}.jpg"), 'wb') as f:
+            f.write(data)
+    return list_images(folder, count)
+
+
+def list_images(folder, limit):
+    entries = [entry for entry in iter_media_files(folder) if ThumbnailCache.supports(entry.path)]
+    return sorted((entry.path, fingerprint(entry)) for entry in entries)[:limit]
+
+
+def separate_passes(files, cache_folder, workers, min_side, opener):
+    def read(path):
+        with opener(path, 'rb') as f:
+            return f.read()
+
+    # Without a read budget the pipeline only reads headers, like the old metadata pass
+    headers = IngestPipeline(workers, max_bytes=0, opener=opener)
+    for _ in headers.run((path, path, file_fingerprint) for path, file_fingerprint in files):
+        pass
+    cache = ThumbnailCache(cache_folder)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda item: cache.ensure(*item, data=read(item[0])), files))
+        list(pool.map(lambda item: decode_image(read(item[0]), min_side), files))
+
+
+def single_read(files, cache_folder, workers, min_side, opener):
+    pipeline = IngestPipeline(workers, thumbnail_cache=ThumbnailCache(cache_folder), opener=opener)
+    decoded = DecodedImageCache()
+    for _ in pipeline.run(((path, path, file_fingerprint) for path, file_fingerprint in files), decoded, min_side):
+        pass
+    return pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folder')
+    parser.add_argument('--limit', type=int, default=200)
+    parser.add_argument('--count', type=int, default=40, help='synthetic images when no folder is given')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--min-side', type=int, default=1024, help='shorter side of the face detection decode')
+    parser.add_argument('--latency', type=float, default=0.0, help='milliseconds added to every read and seek')
+    args = parser.parse_args()
+
+    opener = open
+    if args.latency:
+        opener = lambda path, mode: SlowFile(open(path, mode), args.latency / 1000)
+
+    with tempfile.TemporaryDirectory() as folder:
+        files = list_images(args.folder, args.limit) if args.folder else make_images(folder, args.count)
+        print(f"{len(files)} files, {args.workers} workers, face decode min side {args.min_side}, "
+              f"{args.latency} ms per read/seek\n")
+
+        start = time.perf_counter()
+        separate_passes(files, os.path.join(folder, 'separate'), args.workers, args.min_side, opener)
+        baseline = time.perf_counter() - start
+        print(f"{'separate passes':<18}{len(files) / baseline:>10.1f} files/s  3 reads per file")
+
+        start = time.perf_counter()
+        pipeline = single_read(files, os.path.join(folder, 'single'), args.workers, args.min_side, opener)
+        elapsed = time.perf_counter() - start
+        print(f"{'single read':<18}{len(files) / elapsed:>10.1f} files/s  1 read per file, "
+              f"{baseline / elapsed:.2f}x\n")
+
+        print("Per-stage thread time (ms/file):")
+        for stage in pipeline.STAGES:
+            if pipeline.counts[stage]:
+                print(f"  {stage:<12}{1000 * pipeline.timings[stage] / pipeline.counts[stage]:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Full scan versus rescan time of the library scanner.
+
+Walks a folder tree once with nothing known, then again with the
+fingerprints of the first walk, which is what an unchanged library costs on
+every later scan. A synthetic tree of empty files is generated when no
+folder is given.
+
+Usage:
+    python -m benchmarks.library_scan --files 200000
+    python -m benchmarks.library_scan --folder /path/to/photos
+"""
+import os
+import argparse
+import tempfile
+import time
+
+from utils.library_scanner import LibraryScanner, KnownFile
+
+
+def make_tree(root, files, per_folder):
+    for i in range(files):
+        folder = os.path.join(root, f"{i // per_folder // 100:03d}", f"{i // per_folder:05d}")
+        if i % per_folder == 0:
+            os.makedirs(folder, exist_ok=True)
+        open(os.path.join(folder, f"IMG_{i:07d}.jpg"), 'w').close()
+
+
+def run(folder):
+    scanner = LibraryScanner()
+
+    start = time.perf_counter()
+    first = scanner.scan([folder], {})
+    full = time.perf_counter() - start
+    known = {path: KnownFile(i, fingerprint) for i, (path, fingerprint) in enumerate(first.new)}
+
+    start = time.perf_counter()
+    again = scanner.scan([folder], known)
+    rescan = time.perf_counter() - start
+
+    print(f"{first.total} files")
+    print(f"full scan  {full:8.2f} s  {first.total / full:12.0f} files/s")
+    print(f"rescan     {rescan:8.2f} s  {again.total / rescan:12.0f} files/s  {again!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folder')
+    parser.add_argument('--files', type=int, default=100000, help='files in the synthetic tree')
+    parser.add_argument('--per-folder', type=int, default=500)
+    args = parser.parse_args()
+
+    if args.folder:
+        run(args.folder)
+        return
+    with tempfile.TemporaryDirectory() as root:
+        make_tree(root, args.files, args.per_folder)
+        run(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+People tab cost: one image query per person versus one query with face thumbnails.
+
+The old listing ran get_images_by_person(name, limit=1) for every person
+and showed a thumbnail of that whole photo, decoded from the original when
+it was not cached. The new listing reads every person's best face in one
+get_people_faces query and shows its face thumbnail, stored by face
+processing. Faces processed before face thumbnails existed are cropped from
+the original once; that cost is shown as well.
+
+A database of synthetic people is generated with --faces faces each, in
+images that are hard links to one 12 megapixel JPEG.
+
+Usage:
+    python -m benchmarks.people_listing --people 5000
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from PIL import Image as PILImage
+
+from database.db_manager import DatabaseManager
+from database.models import Face, Image
+from utils.thumbnail_cache import ThumbnailCache, face_box
+
+FACE_AREA = [1800, 1200, 2200, 1700]
+
+
+def make_images(folder, count):
+    original = os.path.join(folder, 'original.jpg')
+    PILImage.effect_noise((4000, 3000), 64).convert('RGB').save(original, quality=90)
+    paths = [os.path.join(folder, f"IMG_{i:05d}.jpg") for i in range(count)]
+    for path in paths:
+        os.link(original, path)
+    return paths
+
+
+def make_database(path, people, faces, image_paths):
+    db = DatabaseManager(f"sqlite:///{path}")
+    images = [Image(file_path=image_path) for image_path in image_paths]
+    db.session.add_all(images)
+    db.session.flush()
+    rng = np.random.default_rng(0)
+    db.session.add_all(
+        Face(image_id=images[rng.integers(len(images))].id, person_name=f"Person_{person:06d}",
+             facial_area=json.dumps(FACE_AREA), confidence=float(rng.random()))
+        for person in range(people) for _ in range(faces)
+    )
+    db.session.commit()
+    # Faces are written by name like an older database and moved to persons
+    db.migrate_person_names()
+    return db
+
+
+def per_person_queries(db):
+    names = [person[0] for person in db.get_people() if person[0]]
+    return [db.get_images_by_person(name, limit=1)[0].file_path for name in names]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--people', type=int, default=5000)
+    parser.add_argument('--faces', type=int, default=5, help='faces per person')
+    parser.add_argument('--icons', type=int, default=20, help='icons decoded for the per-icon timings')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        image_paths = make_images(folder, args.people * args.faces // 4 + 1)
+        db = make_database(os.path.join(folder, 'people.db'), args.people, args.faces, image_paths)
+        print(f"{args.people} people, {args.people * args.faces} faces\n")
+
+        old_paths, old = timed(per_person_queries, db)
+        people, new = timed(db.get_people_faces)
+        print(f"{'listing':<30}{'ms':>10}")
+        print(f"{'query per person':<30}{1000 * old:>10.1f}")
+        print(f"{'get_people_faces':<30}{1000 * new:>10.1f}  {old / new:.0f}x\n")
+
+        cache = ThumbnailCache(os.path.join(folder, 'thumbnails'))
+        with PILImage.open(image_paths[0]) as original:
+            pixels = np.asarray(original.crop(face_box(FACE_AREA, *original.size)))
+        for person in people[:args.icons]:
+            cache.put_face(person.face_id, json.loads(person.facial_area), pixels)
+
+        cold = ThumbnailCache(os.path.join(folder, 'cold'))
+        fallback = ThumbnailCache(os.path.join(folder, 'fallback'))
+        icons = [
+            ('whole photo, from original', lambda i: cold.get(old_paths[i], 200, create=True)),
+            ('face, cropped from original', lambda i: fallback.get_face(
+                people[i].face_id, json.loads(people[i].facial_area), people[i].file_path)),
+            ('face, stored by processing', lambda i: cache.get_face(
+                people[i].face_id, json.loads(people[i].facial_area), people[i].file_path)),
+        ]
+        print(f"{'icon':<30}{'ms/icon':>10}")
+        for name, load in icons:
+            count = min(args.icons, len(people))
+            _, elapsed = timed(lambda: [load(i) for i in range(count)])
+            print(f"{name:<30}{1000 * elapsed / count:>10.2f}")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Renaming and merging people: rewriting every face versus the persons table.
+
+The old rename loaded every Face of the person as an ORM object and wrote its
+person_name back, one UPDATE per face, so the time grew with the person's
+face count. It is replayed here on the legacy column. The persons table
+renames with one row update and merges with one bulk UPDATE of the faces'
+person_id.
+
+Usage:
+    python -m benchmarks.person_rename --faces 10000
+"""
+import os
+import time
+import argparse
+import tempfile
+from functools import partial
+
+from database.db_manager import DatabaseManager
+from database.models import Face, Image, Person
+
+
+def make_database(path, faces):
+    db = DatabaseManager(f"sqlite:///{path}")
+    image = Image(file_path='/photos/IMG_00000.jpg')
+    db.session.add(image)
+    db.session.flush()
+    db.session.add_all(Person(name=name, face_count=0) for name in ('Unknown_a', 'Unknown_b'))
+    db.session.flush()
+    ids = dict(db.session.query(Person.name, Person.id).all())
+    db.session.add_all(Face(image_id=image.id, person_id=ids[name], person_name=name, confidence=i / faces)
+                       for name in ('Unknown_a', 'Unknown_b') for i in range(faces))
+    db.session.commit()
+    db._refresh_persons(ids.values())
+    db.session.commit()
+    return db
+
+
+def rewrite_faces(db, old_name, new_name):
+    faces = db.session.query(Face).filter(Face.person_name == old_name).all()
+    for face in faces:
+        face.person_name = new_name
+    db.session.commit()
+    return len(faces)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--faces', type=int, default=10000, help='faces of each of the two people')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db = make_database(os.path.join(folder, 'people.db'), args.faces)
+        print(f"Two people with {args.faces} faces each\n")
+        print(f"{'operation':<32}{'ms':>10}")
+        runs = [
+            ('rename, rewrite every face', partial(rewrite_faces, db), 'Unknown_a', 'Alice'),
+            ('rename, persons row', db.update_person_name, 'Unknown_a', 'Alice'),
+            ('merge, persons table', db.merge_persons, 'Unknown_b', 'Alice'),
+        ]
+        for name, function, *names in runs:
+            count, elapsed = timed(function, *names)
+            print(f"{name:<32}{1000 * elapsed:>10.1f}  {count} faces")
+        print(f"\nAlice has {db.get_face_count_by_person()['Alice']} faces")
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
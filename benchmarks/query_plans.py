@@ -0,0 +1,151 @@
+"""
+Query plans and timings of the catalog's hot queries.
+
+Every hot query is run through its real DatabaseManager method while the
+SQL it sends is captured. Each captured SELECT is then explained with
+EXPLAIN QUERY PLAN. A query whose plan scans the images or faces table
+instead of searching an index fails the check, and the script exits
+non-zero. The same queries are timed again with the indexes of migration 6
+dropped, for comparison.
+
+The catalog is synthetic: --images images in 10 albums, half of them
+processed, with faces of --people people.
+
+Usage:
+    python -m benchmarks.query_plans --images 100000
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+from sqlalchemy import event, insert, text
+
+from database.db_manager import DatabaseManager
+from database.migrations import drop_index
+from database.models import Album, Face, Image, Person
+
+INDEXES = (
+    (Image.__table__, 'ix_images_processed_id'),
+    (Image.__table__, 'ix_images_album_id_id'),
+    (Image.__table__, 'ix_images_timestamp'),
+    (Face.__table__, 'ix_faces_image_id'),
+    (Face.__table__, 'ix_faces_person_id_image_id'),
+)
+# SQLite 3.36 and later print "SCAN images", older versions "SCAN TABLE images"
+FULL_SCAN = re.compile(r'\bSCAN (TABLE )?(images|faces)\b(?! USING)')
+
+
+def hot_queries(album_id, person_name):
+    return [
+        ('get_images_by_person', lambda db: db.get_images_by_person(person_name)),
+        ('get_image_page, person', lambda db: db.get_image_page(0, 200, person_name=person_name)),
+        ('count_images, person', lambda db: db.count_images(person_name=person_name)),
+        ('get_images_by_album', lambda db: db.get_images_by_album(album_id, limit=200)),
+        ('get_image_page, album', lambda db: db.get_image_page(1000, 200, album_id=album_id)),
+        ('get_unprocessed_images', lambda db: db.get_unprocessed_images(200)),
+        ('iter_unprocessed_images', lambda db: next(db.iter_unprocessed_images(chunk_size=200), None)),
+        ('count_unprocessed_images', lambda db: db.count_unprocessed_images()),
+        ('get_people_faces', lambda db: db.get_people_faces()),
+        ('get_album_listing', lambda db: db.get_album_listing()),
+    ]
+
+
+def make_database(path, images, people):
+    db = DatabaseManager(f"sqlite:///{path}")
+    rng = np.random.default_rng(0)
+    db.session.add_all(Album(name=f"Album {i}") for i in range(10))
+    db.session.commit()
+    album_ids = [album.id for album in db.get_albums()]
+    db.session.execute(insert(Image.__table__), [
+        {'file_path': f"/photos/IMG_{i:07d}.jpg", 'album_id': album_ids[i % len(album_ids)],
+         'processed': i < images // 2, 'face_count': 0}
+        for i in range(images)
+    ])
+    db.session.execute(insert(Person.__table__), [{'name': f"Person_{i:05d}", 'face_count': 0} for i in range(people)])
+    person_ids = [person_id for person_id, in db.session.query(Person.id)]
+    face_count = images // 2
+    db.session.execute(insert(Face.__table__), [
+        {'image_id': int(image_id), 'person_id': person_ids[int(person)], 'confidence': float(confidence)}
+        for image_id, person, confidence in zip(rng.integers(1, images // 2, face_count),
+                                                rng.integers(0, people, face_count), rng.random(face_count))
+    ])
+    db.session.commit()
+    db._refresh_persons(person_ids)
+    db.session.commit()
+    with db.engine.begin() as conn:
+        conn.execute(text('ANALYZE'))
+    return db, album_ids[0]
+
+
+def capture(db, run):
+    statements = []
+
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', before)
+    try:
+        run(db)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before)
+    return statements
+
+
+def explain(db, statement, parameters):
+    with db.engine.connect() as conn:
+        return [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)]
+
+
+def timed(db, run, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        run(db)
+    return 1000 * (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=100000)
+    parser.add_argument('--people', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db, album_id = make_database(os.path.join(folder, 'catalog.db'), args.images, args.people)
+        queries = hot_queries(album_id, 'Person_00001')
+        print(f"{args.images} images, {args.people} people\n")
+
+        failures = []
+        indexed = {}
+        for name, run in queries:
+            print(name)
+            for statement, parameters in capture(db, run):
+                for line in explain(db, statement, parameters):
+                    scan = FULL_SCAN.search(line)
+                    print(f"  {'FULL SCAN ' if scan else ''}{line}")
+                    if scan:
+                        failures.append(name)
+            indexed[name] = timed(db, run)
+
+        for table, name in INDEXES:
+            drop_index(db.engine, table, name)
+        with db.engine.begin() as conn:
+            conn.execute(text('ANALYZE'))
+
+        print(f"\n{'query':<28}{'no index ms':>12}{'indexed ms':>12}")
+        for name, run in queries:
+            print(f"{name:<28}{timed(db, run):>12.2f}{indexed[name]:>12.2f}")
+        db.close()
+
+    if failures:
+        print(f"\nFull table scans in: {', '.join(sorted(set(failures)))}")
+        sys.exit(1)
+    print("\nEvery hot query searches an index")
+
+
+if __name__ == '__main__':
+    main()
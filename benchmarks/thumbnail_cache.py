@@ -0,0 +1,95 @@
+"""
+Thumbnail throughput: decoding originals versus the thumbnail cache.
+
+The direct decode is what the tabs used to do on every refresh, a full
+decode of the original followed by a resize. The cache is filled once with
+ensure_many, as during import, and then read back from disk (a cold start
+with an empty memory layer) and from memory (reopening a tab).
+
+Synthetic 12 megapixel JPEGs are generated when no folder is given.
+
+Usage:
+    python -m benchmarks.thumbnail_cache --folder /path/to/photos --threads 4
+    python -m benchmarks.thumbnail_cache --count 200 --format webp
+"""
+import io
+import os
+import time
+import argparse
+import tempfile
+
+from PIL import Image
+
+from utils.library_scanner import iter_media_files
+from utils.thumbnail_cache import ThumbnailCache
+
+
+def make_images(folder, count):
+    image = Image.effect_noise((4000, 3000), 64).convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=90)
+    data = buffer.getvalue()
+    for i in range(count):
+        with open(os.path.join(folder, f"IMG_{i:05d}.jpg"), 'wb') as f:
+            f.write(data)
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder))
+
+
+def list_images(folder, limit):
+    paths = [entry.path for entry in iter_media_files(folder) if ThumbnailCache.supports(entry.path)]
+    return sorted(paths)[:limit]
+
+
+def direct_decode(paths, size):
+    for path in paths:
+        with Image.open(path) as image:
+            image.convert('RGB').resize((size, size * image.height // image.width), Image.LANCZOS)
+
+
+def timed(label, count, func, baseline=None):
+    start = time.perf_counter()
+    func()
+    rate = count / (time.perf_counter() - start)
+    print(f"{label:<24}{rate:>12.1f}{rate / (baseline or rate):>10.2f}")
+    return rate
+
+
+def run(paths, threads, image_format):
+    with tempfile.TemporaryDirectory() as folder:
+        cache = ThumbnailCache(folder, image_format=image_format)
+        print(f"{len(paths)} files, {cache.format} thumbnails\n")
+        print(f"{'method':<24}{'images/s':>12}{'speedup':>10}")
+
+        baseline = timed('direct decode, 200px', len(paths), lambda: direct_decode(paths, 200))
+        timed(f"fill, {threads} threads", len(paths),
+              lambda: list(cache.ensure_many(((path, None) for path in paths), threads)), baseline)
+        cache.clear_memory()
+        timed('disk cache, 200px', len(paths),
+              lambda: [cache.get(path, 200, create=False) for path in paths], baseline)
+        timed('memory cache, 200px', len(paths),
+              lambda: [cache.get(path, 200, create=False) for path in paths], baseline)
+
+        disk = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(folder) for name in names)
+        print(f"\n{cache.decodes} decodes, {cache.disk_hits} disk hits, {cache.memory_hits} memory hits, "
+              f"{disk / len(paths) / 1024:.1f} KB per image on disk")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--folder')
+    parser.add_argument('--limit', type=int, default=500)
+    parser.add_argument('--count', type=int, default=100, help='synthetic images when no folder is given')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--format', default='jpeg', choices=['jpeg', 'webp'])
+    args = parser.parse_args()
+
+    if args.folder:
+        run(list_images(args.folder, args.limit), args.threads, args.format)
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        run(make_images(folder, args.count), args.threads, args.format)
+
+
+if __name__ == '__main__':
+    main()
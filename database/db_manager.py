@@ -1,23 +1,142 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from database.models import Base, Album, Image, Face
+import os
+import json
+import logging
+from collections import Counter
+import numpy as np
+from sqlalchemy import select, insert, update, delete, bindparam, func, case, or_, literal
+from sqlalchemy.orm import scoped_session, sessionmaker
+from database.models import Base, Album, Image, Face, Person, JobCheckpoint
+from database.embeddings import encode_embedding, decode_embedding, decode_embeddings
+from database.engine import create_database_engine
+from database.migrations import migrate
 from utils.config_manager import ConfigManager
 
+logger = logging.getLogger('DatabaseManager')
+
 class DatabaseManager:
-    def __init__(self, db_url=None):
+    """
+    Catalog queries and writes, usable from the GUI thread and job threads.
+    
+    Every thread gets its own session from self.session, so a job never
+    shares ORM state or a connection with the GUI. On SQLite the engine
+    runs in WAL mode: any number of threads read while one writes, and a
+    second writer waits for the first to commit. Writes therefore commit
+    in chunks, and a thread that is done with the database calls
+    remove_session() to close its session.
+    """
+    def __init__(self, db_url=None, embedding_dtype='float32', **engine_settings):
         # Get database URL from config if not provided
         if not db_url:
             config = ConfigManager()
             db_url = config.get_database_url()
+            engine_settings = {**config.get_sqlite_settings(), **engine_settings}
         
-        self.engine = create_engine(db_url)
+        self.embedding_dtype = embedding_dtype
+        self.engine = create_database_engine(db_url, **engine_settings)
+        # New tables only, columns and indexes of existing ones come from the migrations
         Base.metadata.create_all(self.engine)
-        Session = sessionmaker(bind=self.engine)
-        self.session = Session()
+        self._sessions = scoped_session(sessionmaker(bind=self.engine))
+        
+        # Add columns and indexes and convert data left by older versions
+        migrate(self)
         
         # Create default album if it doesn't exist
         self._create_default_album()
     
+    def migrate_face_encodings(self, chunk_size=1000):
+        """
+        Convert legacy JSON face encodings to binary embeddings in place.
+        
+        Rows are converted in chunks, each committed on its own, so an
+        interrupted migration simply continues on the next start.
+        
+        Args:
+            chunk_size: Number of faces converted per transaction
+            
+        Returns:
+            Number of faces converted
+        """
+        statement = (
+            update(Face.__table__)
+            .where(Face.__table__.c.id == bindparam('face_id'))
+            .values(embedding=bindparam('blob'), face_encoding=None)
+        )
+        converted = 0
+        last_id = 0
+        while True:
+            rows = (
+                self.session.query(Face.id, Face.face_encoding)
+                .filter(Face.id > last_id, Face.embedding.is_(None), Face.face_encoding.isnot(None))
+                .order_by(Face.id)
+                .limit(chunk_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            
+            params = []
+            for face_id, face_encoding in rows:
+                try:
+                    blob = encode_embedding(json.loads(face_encoding), self.embedding_dtype)
+                    params.append({'face_id': face_id, 'blob': blob})
+                except Exception as e:
+                    logger.warning(f"Failed to convert face encoding for {face_id}: {str(e)}")
+            
+            if params:
+                self.session.execute(statement, params)
+            self.session.commit()
+            converted += len(params)
+        
+        if converted:
+            logger.info(f"Converted {converted} face encodings to binary embeddings")
+        return converted
+    
+    def migrate_person_names(self, chunk_size=1000):
+        """
+        Move the person names stored on every face into the persons table.
+        
+        A Person is created for every distinct name, then faces are pointed
+        at their person in chunks, each committed on its own, so an
+        interrupted migration simply continues on the next start. Face counts
+        and covers are computed once all faces are moved; persons still
+        counting no faces mean that step was interrupted.
+        
+        Args:
+            chunk_size: Number of faces moved per transaction
+            
+        Returns:
+            Number of faces moved
+        """
+        faces, persons = Face.__table__, Person.__table__
+        pending = (faces.c.person_id.is_(None), faces.c.person_name.isnot(None), faces.c.person_name != '')
+        if (self.session.execute(select(faces.c.id).where(*pending).limit(1)).first() is None
+                and self.session.execute(select(persons.c.id).where(persons.c.face_count == 0).limit(1)).first() is None):
+            return 0
+        
+        names = select(faces.c.person_name).where(*pending).distinct().subquery()
+        self.session.execute(insert(persons).from_select(
+            ['name', 'face_count'],
+            select(names.c.person_name, literal(0)).where(names.c.person_name.not_in(select(persons.c.name)))
+        ))
+        self.session.commit()
+        
+        person_id = select(persons.c.id).where(persons.c.name == faces.c.person_name).scalar_subquery()
+        moved = 0
+        while True:
+            chunk = select(faces.c.id).where(*pending).order_by(faces.c.id).limit(chunk_size)
+            result = self.session.execute(
+                update(faces).where(faces.c.id.in_(chunk)).values(person_id=person_id, person_name=None))
+            self.session.commit()
+            if not result.rowcount:
+                break
+            moved += result.rowcount
+        
+        self._refresh_persons(self.session.scalars(select(persons.c.id)).all())
+        self.session.commit()
+        logger.info(f"Moved the person names of {moved} faces to the persons table")
+        return moved
+    
     def _create_default_album(self):
         default_album = self.session.query(Album).filter(Album.name == "Default").first()
         if not default_album:
@@ -43,43 +162,467 @@ class DatabaseManager:
             album_id=album_id
         )
         self.session.add(new_image)
+        self.session.flush()
+        self._count_album_images({album_id: 1})
         self.session.commit()
         return new_image
     
-    def get_images_by_album(self, album_id, limit=50):
-        return self.session.query(Image).filter(Image.album_id == album_id).limit(limit).all()
+    def add_images(self, records, chunk_size=500):
+        """
+        Add many images, skipping paths that are already in the database.
+        
+        Each chunk costs one query to find the known paths and one
+        multi-row insert, and all chunks are committed together with the
+        image counts of their albums.
+        
+        Args:
+            records: Iterable of dicts with file_path, timestamp, location,
+                has_text and album_id keys, and optionally width, height,
+                orientation, content_hash and file fingerprint keys; all records of a
+                call must have the same keys
+            chunk_size: Number of paths looked up and inserted per statement
+            
+        Returns:
+            Number of images added
+        """
+        images = Image.__table__
+        statement = insert(images)
+        records = list(records)
+        added = 0
+        album_counts = Counter()
+        try:
+            for start in range(0, len(records), chunk_size):
+                chunk = records[start:start + chunk_size]
+                paths = [record['file_path'] for record in chunk]
+                known = set(self.session.scalars(select(images.c.file_path).where(images.c.file_path.in_(paths))))
+                
+                new_records = []
+                for record in chunk:
+                    if record['file_path'] not in known:
+                        # Also drops duplicates within the batch
+                        known.add(record['file_path'])
+                        new_records.append(record)
+                
+                if new_records:
+                    self.session.execute(statement, new_records)
+                    added += len(new_records)
+                    album_counts.update(record['album_id'] for record in new_records)
+            self._count_album_images(album_counts)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return added
     
-    def get_people(self):
-        return self.session.query(Face.person_name).distinct().all()
+    def get_known_files(self, folders=(), paths=(), chunk_size=500):
+        """
+        Get the stored fingerprints of images under some folders or at some paths.
+        
+        Args:
+            folders: Folder paths, matched with their subfolders
+            paths: Individual file paths
+            chunk_size: Number of file paths looked up per query
+            
+        Returns:
+            List of (image_id, file_path, file_size, file_mtime, file_inode)
+            rows; the fingerprint columns are None for images added before
+            fingerprints were stored
+        """
+        images = Image.__table__
+        columns = (images.c.id, images.c.file_path, images.c.file_size, images.c.file_mtime, images.c.file_inode)
+        queries = [
+            select(*columns).where(images.c.file_path.startswith(os.path.join(folder, ''), autoescape=True))
+            for folder in folders
+        ]
+        paths = list(paths)
+        queries += [
+            select(*columns).where(images.c.file_path.in_(paths[start:start + chunk_size]))
+            for start in range(0, len(paths), chunk_size)
+        ]
+        rows = []
+        seen = set()
+        for query in queries:
+            for row in self.session.execute(query):
+                if row.id not in seen:
+                    seen.add(row.id)
+                    rows.append(tuple(row))
+        return rows
+    
+    def update_file_fingerprints(self, fingerprints):
+        """
+        Store new fingerprints of files whose content did not change.
+        
+        Args:
+            fingerprints: List of dicts with image_id, file_size, file_mtime and
+                file_inode keys
+        """
+        if not fingerprints:
+            return
+        self._update_images(fingerprints)
+    
+    def move_images(self, moves):
+        """
+        Give images their new paths after their files were moved or renamed.
+        
+        Args:
+            moves: List of dicts with image_id, file_path, file_size,
+                file_mtime and file_inode keys
+        """
+        if not moves:
+            return
+        self._update_images(moves)
+    
+    def reset_images(self, changes, chunk_size=500):
+        """
+        Forget the faces of images whose file content changed.
+        
+        The images are marked unprocessed with their new metadata and
+        fingerprint, so face processing picks them up again.
+        
+        Args:
+            changes: List of dicts with image_id, timestamp, location, width,
+                height, orientation, content_hash, file_size, file_mtime and
+                file_inode keys
+            chunk_size: Number of images per statement
+            
+        Returns:
+            Ids of the deleted faces
+        """
+        if not changes:
+            return []
+        image_ids = [change['image_id'] for change in changes]
+        try:
+            face_ids = self._delete_faces_of(image_ids, chunk_size)
+            self._update_images(changes, {'processed': False, 'face_count': 0}, commit=False)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return face_ids
     
-    def get_images_by_person(self, person_name, limit=50):
-        return self.session.query(Image).join(Face).filter(Face.person_name == person_name).limit(limit).all()
+    def delete_images(self, image_ids, chunk_size=500):
+        """
+        Delete images whose files are gone, together with their faces.
+        
+        Args:
+            image_ids: Ids of the images to delete
+            chunk_size: Number of images per statement
+            
+        Returns:
+            Ids of the deleted faces
+        """
+        if not image_ids:
+            return []
+        images = Image.__table__
+        try:
+            face_ids = self._delete_faces_of(image_ids, chunk_size)
+            album_counts = Counter()
+            for start in range(0, len(image_ids), chunk_size):
+                chunk = image_ids[start:start + chunk_size]
+                for album_id, count in self.session.execute(
+                        select(images.c.album_id, func.count()).where(images.c.id.in_(chunk)).group_by(images.c.album_id)):
+                    album_counts[album_id] -= count
+                self.session.execute(delete(images).where(images.c.id.in_(chunk)))
+            self._count_album_images(album_counts)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        # Drop deleted images the session may still hold
+        self.session.expire_all()
+        return face_ids
     
-    def add_face(self, image_id, person_name, face_encoding):
-        face = Face(
-            image_id=image_id,
-            person_name=person_name,
-            face_encoding=face_encoding
+    def _delete_faces_of(self, image_ids, chunk_size):
+        """Delete the faces of some images without committing, returns their ids"""
+        faces = Face.__table__
+        face_ids = []
+        person_ids = set()
+        for start in range(0, len(image_ids), chunk_size):
+            chunk = image_ids[start:start + chunk_size]
+            for face_id, person_id in self.session.execute(
+                    select(faces.c.id, faces.c.person_id).where(faces.c.image_id.in_(chunk))):
+                face_ids.append(face_id)
+                person_ids.add(person_id)
+            self.session.execute(delete(faces).where(faces.c.image_id.in_(chunk)))
+        self._refresh_persons(person_ids, chunk_size)
+        return face_ids
+    
+    def _person_ids(self, names, chunk_size=500):
+        """Get the Person ids of some names, creating missing persons, without committing"""
+        persons = Person.__table__
+        names = list({name for name in names if name})
+        ids = {}
+        for start in range(0, len(names), chunk_size):
+            chunk = names[start:start + chunk_size]
+            ids.update(self.session.execute(select(persons.c.name, persons.c.id).where(persons.c.name.in_(chunk))).all())
+        missing = [name for name in names if name not in ids]
+        if missing:
+            self.session.execute(insert(persons), [{'name': name, 'face_count': 0} for name in missing])
+            for start in range(0, len(missing), chunk_size):
+                chunk = missing[start:start + chunk_size]
+                ids.update(self.session.execute(select(persons.c.name, persons.c.id).where(persons.c.name.in_(chunk))).all())
+        return ids
+    
+    def _count_new_faces(self, new_faces):
+        """Add new Face rows to their persons' counts and covers without committing"""
+        added = {}
+        for face in new_faces:
+            if face.person_id is None:
+                continue
+            confidence = face.confidence if face.confidence is not None else -1.0
+            count, best = added.get(face.person_id, (0, None))
+            if best is None or confidence > best[0]:
+                best = (confidence, face.id)
+            added[face.person_id] = (count + 1, best)
+        if not added:
+            return
+        
+        persons, faces = Person.__table__, Face.__table__
+        cover_confidence = select(faces.c.confidence).where(faces.c.id == persons.c.cover_face_id).scalar_subquery()
+        # A new face becomes the cover when it is more confident than the current one
+        better = or_(persons.c.cover_face_id.is_(None), func.coalesce(cover_confidence, -1.0) < bindparam('confidence'))
+        statement = (
+            update(persons)
+            .where(persons.c.id == bindparam('person_id'))
+            .values(face_count=func.coalesce(persons.c.face_count, 0) + bindparam('added'),
+                    cover_face_id=case((better, bindparam('face_id')), else_=persons.c.cover_face_id))
         )
-        self.session.add(face)
+        self.session.execute(statement, [
+            {'person_id': person_id, 'added': count, 'confidence': best[0], 'face_id': best[1]}
+            for person_id, (count, best) in added.items()
+        ])
+    
+    def _refresh_persons(self, person_ids, chunk_size=500):
+        """Recount the faces and pick the covers of some persons, dropping those left without faces"""
+        persons, faces = Person.__table__, Face.__table__
+        person_ids = [person_id for person_id in set(person_ids) if person_id is not None]
+        count = select(func.count(faces.c.id)).where(faces.c.person_id == persons.c.id).scalar_subquery()
+        cover = (
+            select(faces.c.id).where(faces.c.person_id == persons.c.id)
+            .order_by(faces.c.confidence.desc(), faces.c.id).limit(1)
+            .scalar_subquery()
+        )
+        for start in range(0, len(person_ids), chunk_size):
+            chunk = person_ids[start:start + chunk_size]
+            self.session.execute(update(persons).where(persons.c.id.in_(chunk)).values(face_count=count, cover_face_id=cover))
+            self.session.execute(delete(persons).where(persons.c.id.in_(chunk), persons.c.face_count == 0))
+    
+    def _count_album_images(self, album_counts):
+        """Add changes of albums' image counts, {album_id: change}, and pick their covers without committing"""
+        albums, images = Album.__table__, Image.__table__
+        params = [{'album': album_id, 'change': change}
+                  for album_id, change in album_counts.items() if album_id is not None and change]
+        if not params:
+            return
+        # The first image on the (album_id, id) index, one seek per album
+        cover = select(func.min(images.c.id)).where(images.c.album_id == albums.c.id).scalar_subquery()
+        statement = (
+            update(albums)
+            .where(albums.c.id == bindparam('album'))
+            .values(image_count=func.coalesce(albums.c.image_count, 0) + bindparam('change'), cover_image_id=cover)
+        )
+        self.session.execute(statement, params)
+    
+    def recount_albums(self):
+        """
+        Count the images and pick the covers of every album.
+        
+        The counts are kept up to date as images are added and deleted, so
+        this is only needed once for databases that did not store them.
+        """
+        albums, images = Album.__table__, Image.__table__
+        count = select(func.count()).where(images.c.album_id == albums.c.id).scalar_subquery()
+        cover = select(func.min(images.c.id)).where(images.c.album_id == albums.c.id).scalar_subquery()
+        self.session.execute(update(albums).values(image_count=count, cover_image_id=cover))
         self.session.commit()
-        return face
+    
+    def _update_images(self, params, values=None, commit=True):
+        """
+        Update many images by id with one executemany statement.
+        
+        Args:
+            params: List of dicts with an image_id key and the new column values
+            values: Column values shared by every image
+            commit: Commit the transaction
+        """
+        images = Image.__table__
+        statement = update(images).where(images.c.id == bindparam('image_id'))
+        if values:
+            statement = statement.values(**values)
+        try:
+            self.session.execute(statement, params)
+            if commit:
+                self.session.commit()
+        except Exception:
+            if commit:
+                self.session.rollback()
+            raise
+    
+    def get_album(self, album_id):
+        return self.session.get(Album, album_id)
+    
+    def get_images_by_album(self, album_id, limit=None):
+        query = self.session.query(Image).filter(Image.album_id == album_id).order_by(Image.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+    
+    def get_album_listing(self):
+        """
+        Get every album with its image count and cover image, in one query.
+
+        Counts and covers are kept on the albums rows, so listing costs one
+        row per album however many images there are. Like get_image_page,
+        the rows are read on a short-lived connection.
+
+        Returns:
+            Rows with album_id, name, image_count, and file_path, file_size,
+            file_mtime and file_inode of the cover (None for empty albums),
+            ordered by album id
+        """
+        query = (
+            select(Album.id.label('album_id'), Album.name, func.coalesce(Album.image_count, 0).label('image_count'),
+                   Image.file_path, Image.file_size, Image.file_mtime, Image.file_inode)
+            .outerjoin(Image, Image.id == Album.cover_image_id)
+            .order_by(Album.id)
+        )
+        with self.engine.connect() as conn:
+            return conn.execute(query).all()
+    
+    def get_people(self):
+        return self.session.query(Person.name).filter(Person.face_count > 0).order_by(Person.name).all()
+
+    def get_people_faces(self):
+        """
+        Get every person with the face that represents them, in one query.
+
+        The face is the person's cover, their most confident detection, kept
+        on the persons row so listing costs one row per person. Like
+        get_image_page, the rows are read on a short-lived connection.
+
+        Returns:
+            Rows with person_name, person_id, face_count, face_id,
+            facial_area and file_path, ordered by name
+        """
+        query = (
+            select(Person.name.label('person_name'), Person.id.label('person_id'), Person.face_count,
+                   Face.id.label('face_id'), Face.facial_area, Image.file_path)
+            .join(Face, Face.id == Person.cover_face_id)
+            .join(Image, Face.image_id == Image.id)
+            .where(Person.face_count > 0)
+            .order_by(Person.name)
+        )
+        with self.engine.connect() as conn:
+            return conn.execute(query).all()
+
+    def get_images_by_person(self, person_name, limit=None):
+        query = self.session.query(Image).filter(self._person_filter(person_name)).order_by(Image.id)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+    
+    @staticmethod
+    def _person_filter(person_name):
+        # An image with two faces of one person is still listed once
+        person_id = select(Person.id).where(Person.name == person_name).scalar_subquery()
+        return Image.id.in_(select(Face.image_id).where(Face.person_id == person_id))
+    
+    def _image_filter(self, query, album_id=None, person_name=None):
+        if album_id is not None:
+            query = query.where(Image.album_id == album_id)
+        if person_name is not None:
+            query = query.where(self._person_filter(person_name))
+        return query
+    
+    def get_image_page(self, after_id=0, limit=200, album_id=None, person_name=None):
+        """
+        Get one page of images in id order.
+        
+        Pages are read with a keyset query on id, so every page costs the same
+        however deep the caller has scrolled. Like iter_unprocessed_images,
+        each page is read on its own short-lived connection and returns plain
+        rows that are not kept in the session.
+        
+        Args:
+            after_id: Start after this image id, the last id of the previous page
+            limit: Number of images per page
+            album_id: Only images of this album
+            person_name: Only images with a face of this person
+            
+        Returns:
+            Rows with id, file_path, file_size, file_mtime and file_inode
+        """
+        query = self._image_filter(
+            select(Image.id, Image.file_path, Image.file_size, Image.file_mtime, Image.file_inode)
+            .where(Image.id > after_id),
+            album_id, person_name
+        ).order_by(Image.id).limit(limit)
+        with self.engine.connect() as conn:
+            return conn.execute(query).all()
+    
+    def count_images(self, album_id=None, person_name=None):
+        """
+        Count images, optionally of one album or person.
+        
+        Returns:
+            Number of images
+        """
+        query = self._image_filter(select(func.count(Image.id)), album_id, person_name)
+        with self.engine.connect() as conn:
+            return conn.execute(query).scalar()
+    
+    def get_sidecar_path(self, suffix):
+        """
+        Get the path of a file stored next to the SQLite database.
+        
+        Args:
+            suffix: Suffix appended to the database file name
+            
+        Returns:
+            Path string, or None for server databases
+        """
+        if self.engine.url.get_backend_name() != 'sqlite':
+            return None
+        database = self.engine.url.database
+        if not database or database == ':memory:':
+            return None
+        return os.path.abspath(database) + suffix
+    
+    def get_face_watermark(self):
+        """
+        Get a cheap fingerprint of the faces table.
+        
+        Returns:
+            Tuple of (max face id, face row count)
+        """
+        max_id, count = self.session.query(func.max(Face.id), func.count(Face.id)).one()
+        return (max_id or 0, count)
     
     def get_default_album_id(self):
         default_album = self.session.query(Album).filter(Album.name == "Default").first()
         return default_album.id if default_album else None
     
+    @property
+    def session(self):
+        """Session of the calling thread, opened on first use"""
+        return self._sessions()
+    
+    def remove_session(self):
+        """Close the calling thread's session, a job thread calls this when it finishes"""
+        self._sessions.remove()
+    
     def close(self):
-        self.session.close()
+        self._sessions.remove()
+        self.engine.dispose()
     
-    def add_face(self, image_id, person_name, face_encoding, facial_area=None, landmarks=None, confidence=None):
+    def add_face(self, image_id, person_name, embedding, facial_area=None, landmarks=None, confidence=None):
         """
         Add a face to the database with enhanced metadata.
         
         Args:
             image_id: ID of the image where the face was detected
             person_name: Name of the person
-            face_encoding: JSON string of face encoding
+            embedding: Face embedding array, stored in binary form
             facial_area: JSON string of facial area coordinates
             landmarks: JSON string of facial landmarks
             confidence: Detection confidence score
@@ -87,18 +630,74 @@ class DatabaseManager:
         Returns:
             The newly created Face object
         """
-        face = Face(
-            image_id=image_id,
-            person_name=person_name,
-            face_encoding=face_encoding,
-            facial_area=facial_area,
-            landmarks=landmarks,
-            confidence=confidence
-        )
-        self.session.add(face)
-        self.session.commit()
+        try:
+            face = Face(
+                image_id=image_id,
+                person_id=self._person_ids([person_name]).get(person_name),
+                embedding=encode_embedding(embedding, self.embedding_dtype),
+                facial_area=facial_area,
+                landmarks=landmarks,
+                confidence=confidence
+            )
+            self.session.add(face)
+            self.session.flush()
+            self._count_new_faces([face])
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
         return face
 
+    def save_processed_images(self, images):
+        """
+        Save the faces of several images and mark the images processed.
+        
+        Everything is written in one transaction, so an image is either
+        stored with all its faces and the processed flag or not at all.
+        
+        Args:
+            images: List of (image_id, faces) where faces is a list of dicts
+                with person_name, embedding, facial_area, landmarks and
+                confidence keys
+                
+        Returns:
+            List with the new Face ids of every image, in input order
+        """
+        statement = (
+            update(Image.__table__)
+            .where(Image.__table__.c.id == bindparam('image_id'))
+            .values(processed=True, face_count=bindparam('count'))
+        )
+        try:
+            person_ids = self._person_ids(face['person_name'] for _, faces in images for face in faces)
+            new_faces = []
+            for image_id, faces in images:
+                rows = [
+                    Face(
+                        image_id=image_id,
+                        person_id=person_ids.get(face['person_name']),
+                        embedding=encode_embedding(face['embedding'], self.embedding_dtype),
+                        facial_area=face.get('facial_area'),
+                        landmarks=face.get('landmarks'),
+                        confidence=face.get('confidence')
+                    )
+                    for face in faces
+                ]
+                self.session.add_all(rows)
+                new_faces.append(rows)
+            self.session.flush()
+            # Read the ids before commit expires the objects
+            face_ids = [[face.id for face in rows] for rows in new_faces]
+            self._count_new_faces([face for rows in new_faces for face in rows])
+            
+            self.session.execute(statement, [{'image_id': image_id, 'count': len(faces)}
+                                             for image_id, faces in images])
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        return face_ids
+
     def update_image_processed_status(self, image_id, processed=True, face_count=0):
         """
         Update the processed status and face count of an image.
@@ -128,38 +727,233 @@ class DatabaseManager:
         Returns:
             List of Image objects
         """
-        return self.session.query(Image).filter(Image.processed == False).limit(limit).all()
+        return self.session.query(Image).filter(Image.processed == False).order_by(Image.id).limit(limit).all()
+
+    def count_unprocessed_images(self, after_id=0, image_ids=None, chunk_size=500):
+        """
+        Count images that haven't been processed yet.
+        
+        Args:
+            after_id: Only count images with a larger id
+            image_ids: Only count these images, None for all
+            chunk_size: Number of image ids looked up per query
+            
+        Returns:
+            Number of unprocessed images
+        """
+        if image_ids is None:
+            return (
+                self.session.query(func.count(Image.id))
+                .filter(Image.processed == False, Image.id > after_id)
+                .scalar()
+            )
+        image_ids = sorted(image_id for image_id in set(image_ids) if image_id > after_id)
+        return sum(
+            self.session.query(func.count(Image.id))
+            .filter(Image.processed == False, Image.id.in_(image_ids[start:start + chunk_size]))
+            .scalar()
+            for start in range(0, len(image_ids), chunk_size)
+        )
+
+    def iter_unprocessed_images(self, after_id=0, chunk_size=500, image_ids=None):
+        """
+        Stream unprocessed images in id order.
+        
+        Images are fetched a page at a time with a keyset query on
+        (processed, id), so memory use does not depend on the number of
+        pending images. Every page is read on its own short-lived connection,
+        so no cursor stays open while the caller writes and the stream may be
+        consumed on another thread than the session.
+        
+        Args:
+            after_id: Start after this image id, e.g. a saved checkpoint
+            chunk_size: Number of images fetched per query
+            image_ids: Only stream these images, e.g. files just imported,
+                None for all
+            
+        Yields:
+            Rows with id and file_path attributes
+        """
+        if image_ids is not None:
+            image_ids = sorted(image_id for image_id in set(image_ids) if image_id > after_id)
+            for start in range(0, len(image_ids), chunk_size):
+                query = (
+                    select(Image.id, Image.file_path)
+                    .where(Image.processed == False, Image.id.in_(image_ids[start:start + chunk_size]))
+                    .order_by(Image.id)
+                )
+                with self.engine.connect() as conn:
+                    rows = conn.execute(query).all()
+                yield from rows
+            return
+        
+        last_id = after_id
+        while True:
+            query = (
+                select(Image.id, Image.file_path)
+                .where(Image.processed == False, Image.id > last_id)
+                .order_by(Image.id)
+                .limit(chunk_size)
+            )
+            with self.engine.connect() as conn:
+                rows = conn.execute(query).all()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1].id
+
+    def get_job_checkpoint(self, name):
+        """
+        Get the last id a job has finished with.
+        
+        Args:
+            name: Job name
+            
+        Returns:
+            Saved id, 0 if the job has no checkpoint
+        """
+        checkpoint = self.session.get(JobCheckpoint, name)
+        return checkpoint.last_id if checkpoint else 0
+
+    def set_job_checkpoint(self, name, last_id):
+        """
+        Save the last id a job has finished with, 0 to clear it.
+        
+        Args:
+            name: Job name
+            last_id: Every row up to this id has been handled
+        """
+        checkpoint = self.session.get(JobCheckpoint, name)
+        if checkpoint is None:
+            checkpoint = JobCheckpoint(name=name)
+            self.session.add(checkpoint)
+        checkpoint.last_id = last_id
+        self.session.commit()
+
+    def _get_person(self, name):
+        """Get (id, face_count, cover_face_id, cover confidence) of a person, None if unknown"""
+        persons, faces = Person.__table__, Face.__table__
+        return self.session.execute(
+            select(persons.c.id, persons.c.face_count, persons.c.cover_face_id, faces.c.confidence)
+            .outerjoin(faces, faces.c.id == persons.c.cover_face_id)
+            .where(persons.c.name == name)
+        ).first()
 
     def update_person_name(self, old_name, new_name):
         """
-        Update a person's name across all faces.
+        Rename a person, merging them into new_name if that person exists.
+        
+        A plain rename updates the person's row only, however many faces
+        they have.
         
         Args:
             old_name: Current name
             new_name: New name
             
         Returns:
-            Number of faces updated
+            Number of faces of the person
         """
-        faces = self.session.query(Face).filter(Face.person_name == old_name).all()
-        for face in faces:
-            face.person_name = new_name
-        self.session.commit()
-        return len(faces)
+        source = self._get_person(old_name)
+        if source is None or old_name == new_name:
+            return 0
+        if self._get_person(new_name) is not None:
+            return self.merge_persons(old_name, new_name)
+        
+        persons = Person.__table__
+        try:
+            self.session.execute(update(persons).where(persons.c.id == source.id).values(name=new_name))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        self.session.expire_all()
+        return source.face_count or 0
 
     def merge_persons(self, source_name, target_name):
         """
         Merge two person identities.
         
+        The source's faces are moved with a single UPDATE of their person_id,
+        counts and covers are combined from the two persons rows and the
+        source person is deleted.
+        
         Args:
             source_name: Person to merge from
             target_name: Person to merge into
             
         Returns:
-            Number of faces updated
+            Number of faces moved
         """
-        return self.update_person_name(source_name, target_name)
+        source = self._get_person(source_name)
+        if source is None or source_name == target_name:
+            return 0
+        target = self._get_person(target_name)
+        if target is None:
+            return self.update_person_name(source_name, target_name)
+        
+        persons, faces = Person.__table__, Face.__table__
+        # The more confident of the two covers stays
+        covers = [person for person in (target, source) if person.cover_face_id is not None]
+        cover = max(covers, key=lambda person: person.confidence if person.confidence is not None else -1.0,
+                    default=target)
+        try:
+            self.session.execute(update(faces).where(faces.c.person_id == source.id).values(person_id=target.id))
+            self.session.execute(
+                update(persons).where(persons.c.id == target.id)
+                .values(face_count=(target.face_count or 0) + (source.face_count or 0),
+                        cover_face_id=cover.cover_face_id)
+            )
+            self.session.execute(delete(persons).where(persons.c.id == source.id))
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        self.session.expire_all()
+        return source.face_count or 0
 
+    def merge_many_persons(self, merges, chunk_size=500):
+        """
+        Merge many persons into others in one transaction.
+        
+        The faces of every source are moved with one executemany UPDATE of
+        their person_id, then the targets are recounted and the emptied
+        sources deleted.
+        
+        Args:
+            merges: Dict mapping source names to target names; targets must
+                not be merged themselves
+            chunk_size: Number of names looked up per query
+            
+        Returns:
+            Number of faces moved
+        """
+        persons, faces = Person.__table__, Face.__table__
+        names = list(set(merges) | set(merges.values()))
+        ids = {}
+        for start in range(0, len(names), chunk_size):
+            chunk = names[start:start + chunk_size]
+            ids.update((row.name, row) for row in self.session.execute(
+                select(persons.c.name, persons.c.id, persons.c.face_count).where(persons.c.name.in_(chunk))))
+        pairs = [(ids[source], ids[target]) for source, target in merges.items()
+                 if source != target and source in ids and target in ids]
+        if not pairs:
+            return 0
+        
+        statement = (
+            update(faces)
+            .where(faces.c.person_id == bindparam('source'))
+            .values(person_id=bindparam('target'))
+        )
+        try:
+            self.session.execute(statement, [{'source': source.id, 'target': target.id} for source, target in pairs])
+            self._refresh_persons([person.id for pair in pairs for person in pair], chunk_size)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        self.session.expire_all()
+        return sum(source.face_count or 0 for source, _ in pairs)
+    
     def get_face_count_by_person(self):
         """
         Get the number of faces for each person.
@@ -167,10 +961,36 @@ class DatabaseManager:
         Returns:
             Dictionary mapping person names to face counts
         """
-        from sqlalchemy import func
-        results = self.session.query(
-            Face.person_name, 
-            func.count(Face.id).label('face_count')
-        ).group_by(Face.person_name).all()
+        return dict(self.session.query(Person.name, Person.face_count).all())
+
+    def load_face_embeddings(self):
+        """
+        Load the embeddings of all named faces in one query.
+        
+        Returns:
+            Tuple of (face_ids, person_names, embeddings) where embeddings is an
+            (n, dim) float32 matrix; faces whose dimension differs from the
+            majority are skipped
+        """
+        rows = (
+            self.session.query(Face.id, Person.name, Face.embedding)
+            .join(Person, Face.person_id == Person.id)
+            .filter(Face.embedding.isnot(None))
+            .order_by(Face.id)
+            .all()
+        )
+        if not rows:
+            return np.empty(0, dtype=np.int64), [], np.empty((0, 0), dtype=np.float32)
+        
+        face_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        names = [row[1] for row in rows]
+        embeddings = decode_embeddings([row[2] for row in rows])
+        if embeddings is not None:
+            return face_ids, names, embeddings
         
-        return {person: count for person, count in results}
\ No newline at end of file
+        # Mixed dimensions, e.g. after switching recognition models
+        decoded = [decode_embedding(row[2]) for row in rows]
+        dim = Counter(e.size for e in decoded).most_common(1)[0][0]
+        keep = [i for i, e in enumerate(decoded) if e.size == dim]
+        logger.warning(f"Skipping {len(rows) - len(keep)} face embeddings with a dimension other than {dim}")
+        return face_ids[keep], [names[i] for i in keep], np.stack([decoded[i] for i in keep])
@@ -0,0 +1,81 @@
+import struct
+from typing import Optional, Sequence
+
+import numpy as np
+
+# Every stored embedding starts with an 8 byte header:
+# magic (4 bytes), dtype code (1 byte), padding (1 byte), dimension (uint16)
+HEADER = struct.Struct('<4sBxH')
+MAGIC = b'PXEM'
+
+DTYPE_CODES = {
+    'float32': 1,
+    'float16': 2,
+}
+CODE_DTYPES = {code: np.dtype(name).newbyteorder('<') for name, code in DTYPE_CODES.items()}
+
+
+def encode_embedding(embedding, dtype: str = 'float32') -> bytes:
+    """
+    Serialize a face embedding to bytes with a dimension/dtype header.
+
+    Args:
+        embedding: 1-D array-like embedding
+        dtype: Storage dtype, 'float32' or 'float16'
+
+    Returns:
+        Header followed by the raw little-endian values
+    """
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    values = np.asarray(embedding, dtype=CODE_DTYPES[DTYPE_CODES[dtype]]).reshape(-1)
+    return HEADER.pack(MAGIC, DTYPE_CODES[dtype], values.size) + values.tobytes()
+
+
+def decode_embedding(blob: bytes) -> np.ndarray:
+    """
+    Deserialize one stored embedding.
+
+    float32 values are returned as a read-only view of the blob, float16
+    values are widened to float32.
+
+    Args:
+        blob: Bytes produced by encode_embedding
+
+    Returns:
+        1-D float32 array
+    """
+    magic, code, dim = HEADER.unpack_from(blob)
+    if magic != MAGIC or code not in CODE_DTYPES:
+        raise ValueError("Not an encoded embedding")
+    values = np.frombuffer(blob, dtype=CODE_DTYPES[code], count=dim, offset=HEADER.size)
+    return values if code == DTYPE_CODES['float32'] else values.astype(np.float32)
+
+
+def decode_embeddings(blobs: Sequence[bytes]) -> Optional[np.ndarray]:
+    """
+    Deserialize many embeddings into one (n, dim) float32 matrix.
+
+    When every blob shares the same header, the blobs are joined once and
+    viewed as a structured array, so no per-row parsing happens.
+
+    Args:
+        blobs: Bytes produced by encode_embedding
+
+    Returns:
+        Matrix of embeddings, or None if the blobs have mixed dimensions
+    """
+    if not blobs:
+        return np.empty((0, 0), dtype=np.float32)
+
+    header = bytes(blobs[0][:HEADER.size])
+    magic, code, dim = HEADER.unpack(header)
+    if magic != MAGIC or code not in CODE_DTYPES:
+        raise ValueError("Not an encoded embedding")
+    row_size = HEADER.size + dim * CODE_DTYPES[code].itemsize
+    if any(len(blob) != row_size or blob[:HEADER.size] != header for blob in blobs):
+        return None
+
+    row_type = np.dtype([('header', 'V%d' % HEADER.size), ('values', CODE_DTYPES[code], (dim,))])
+    values = np.frombuffer(b''.join(blobs), dtype=row_type)['values']
+    return values if code == DTYPE_CODES['float32'] else values.astype(np.float32)
@@ -0,0 +1,62 @@
+import logging
+
+from sqlalchemy import create_engine, event
+
+logger = logging.getLogger('DatabaseEngine')
+
+JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist', 'memory', 'off')
+SYNCHRONOUS_MODES = ('off', 'normal', 'full', 'extra')
+
+
+def create_database_engine(db_url: str, journal_mode: str = 'wal', synchronous: str = 'normal',
+                           mmap_size: int = 256 * 1024 * 1024, cache_size: int = 64 * 1024 * 1024,
+                           busy_timeout: float = 5.0):
+    """
+    Create the engine, with the SQLite profile applied to every connection.
+
+    In WAL mode readers see the last committed state and are never blocked
+    by the single writer, so the list views keep reading while an ingest
+    commits its chunks. A second writer waits up to busy_timeout for the
+    write lock instead of failing at once. synchronous=NORMAL only syncs at
+    checkpoints, which in WAL mode can lose the last commits on power loss
+    but never corrupts the database. Other databases get a plain engine.
+
+    Args:
+        db_url: SQLAlchemy database URL
+        journal_mode: SQLite journal mode, 'wal' unless the file system cannot share memory
+        synchronous: SQLite synchronous level
+        mmap_size: Bytes of the database file read through memory mapping, 0 disables it
+        cache_size: Bytes of page cache per connection
+        busy_timeout: Seconds a connection waits for a lock held by another one
+    """
+    engine = create_engine(db_url)
+    if engine.dialect.name != 'sqlite':
+        return engine
+
+    journal_mode, synchronous = journal_mode.lower(), synchronous.lower()
+    if journal_mode not in JOURNAL_MODES:
+        raise ValueError(f"Unsupported SQLite journal mode: {journal_mode}")
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unsupported SQLite synchronous level: {synchronous}")
+    pragmas = [
+        f'PRAGMA busy_timeout = {int(busy_timeout * 1000)}',
+        f'PRAGMA synchronous = {synchronous.upper()}',
+        f'PRAGMA mmap_size = {int(mmap_size)}',
+        # Negative sizes are in KiB rather than pages
+        f'PRAGMA cache_size = {-int(cache_size // 1024)}',
+    ]
+
+    @event.listens_for(engine, 'connect')
+    def configure(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            # The journal mode is stored in the file, the other settings are per connection
+            mode = cursor.execute(f'PRAGMA journal_mode = {journal_mode.upper()}').fetchone()[0]
+            if mode != journal_mode and engine.url.database not in (None, '', ':memory:'):
+                logger.warning(f"SQLite journal mode is {mode}, {journal_mode} was requested")
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    return engine
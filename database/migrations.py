@@ -0,0 +1,138 @@
+import logging
+from datetime import datetime
+from typing import Callable, List, Sequence, Tuple
+
+from sqlalchemy import inspect, select, text, update
+
+from database.models import Album, Face, Image, SchemaVersion
+
+logger = logging.getLogger('Migrations')
+
+
+def add_column(engine, column) -> bool:
+    """
+    Add a column that create_all cannot add to an existing table.
+
+    Rows already in the table get the column's scalar default, so flags
+    such as images.processed are False rather than NULL on old databases.
+
+    Returns:
+        Whether the column was added
+    """
+    table = column.table
+    existing = {c['name'] for c in inspect(engine).get_columns(table.name)}
+    if column.name in existing:
+        return False
+    column_type = column.type.compile(dialect=engine.dialect)
+    with engine.begin() as conn:
+        conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+        if column.default is not None and column.default.is_scalar:
+            conn.execute(update(table).where(column.is_(None)).values({column.name: column.default.arg}))
+    logger.info(f"Added column {table.name}.{column.name}")
+    return True
+
+
+def create_index(engine, table, name: str) -> None:
+    """Create an index declared on a model, if the database does not have it yet"""
+    index = next(index for index in table.indexes if index.name == name)
+    index.create(engine, checkfirst=True)
+
+
+def drop_index(engine, table, name: str) -> None:
+    """Drop an index that is no longer declared, if the database still has it"""
+    if name not in {index['name'] for index in inspect(engine).get_indexes(table.name)}:
+        return
+    # MySQL names the table, SQLite and PostgreSQL do not accept it
+    on = f' ON {table.name}' if engine.dialect.name == 'mysql' else ''
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP INDEX {name}{on}'))
+    logger.info(f"Dropped index {name}")
+
+
+def _early_columns(db) -> None:
+    faces, images = Face.__table__, Image.__table__
+    for column in ('embedding', 'facial_area', 'landmarks', 'confidence'):
+        add_column(db.engine, faces.c[column])
+    for column in ('processed', 'face_count'):
+        add_column(db.engine, images.c[column])
+
+
+def _binary_embeddings(db) -> None:
+    db.migrate_face_encodings()
+
+
+def _file_fingerprints(db) -> None:
+    for column in ('file_size', 'file_mtime', 'file_inode', 'width', 'height', 'orientation'):
+        add_column(db.engine, Image.__table__.c[column])
+
+
+def _content_hashes(db) -> None:
+    add_column(db.engine, Image.__table__.c.content_hash)
+
+
+def _persons(db) -> None:
+    add_column(db.engine, Face.__table__.c.person_id)
+    db.migrate_person_names()
+
+
+def _query_indexes(db) -> None:
+    faces, images = Face.__table__, Image.__table__
+    for name in ('ix_images_processed_id', 'ix_images_album_id_id', 'ix_images_timestamp'):
+        create_index(db.engine, images, name)
+    for name in ('ix_faces_image_id', 'ix_faces_person_id_image_id'):
+        create_index(db.engine, faces, name)
+    # Superseded by the composite index, which also serves person lookups
+    drop_index(db.engine, faces, 'ix_faces_person_id')
+
+
+def _album_counts(db) -> None:
+    for column in ('image_count', 'cover_image_id'):
+        add_column(db.engine, Album.__table__.c[column])
+    db.recount_albums()
+
+
+# Applied in order, each exactly once per database. Every step is idempotent,
+# so a step interrupted before it was recorded is simply run again. Released
+# steps are never changed, schema changes get a new version at the end.
+MIGRATIONS: Sequence[Tuple[int, str, Callable]] = (
+    (1, 'Face details, processed flag and face count columns', _early_columns),
+    (2, 'Binary face embeddings', _binary_embeddings),
+    (3, 'File fingerprints and pixel sizes of images', _file_fingerprints),
+    (4, 'Content hashes of images', _content_hashes),
+    (5, 'Persons table referenced by faces', _persons),
+    (6, 'Indexes for the person, album, processing and date queries', _query_indexes),
+    (7, 'Image counts and covers of albums', _album_counts),
+)
+
+
+def migrate(db, migrations: Sequence[Tuple[int, str, Callable]] = MIGRATIONS) -> List[int]:
+    """
+    Bring a database up to the current schema.
+
+    The versions already applied are stored in the schema_versions table,
+    which create_all adds to databases of any age. A new database gets
+    every table, column and index from create_all and runs each step as a
+    cheap no-op; an old one gets what it is missing.
+
+    Args:
+        db: DatabaseManager with engine and session
+        migrations: Sequence of (version, description, function of db)
+
+    Returns:
+        Versions applied by this call
+    """
+    applied = set(db.session.scalars(select(SchemaVersion.version)))
+    ran = []
+    for version, description, step in sorted(migrations, key=lambda migration: migration[0]):
+        if version in applied:
+            continue
+        logger.info(f"Applying schema version {version}: {description}")
+        try:
+            step(db)
+        except Exception:
+            db.session.rollback()
+            raise
+        db.session.add(SchemaVersion(version=version, description=description, applied_at=datetime.now()))
+        db.session.commit()
+        ran.append(version)
+    return ran
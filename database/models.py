@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Float, Text, LargeBinary, BigInteger, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -15,21 +15,64 @@ class Image(Base):
     album_id = Column(Integer, ForeignKey('albums.id'))
     processed = Column(Boolean, default=False)
     face_count = Column(Integer, default=0)  # New field to track number of faces
+    file_size = Column(BigInteger)    # Fingerprint of the file when it was last scanned
+    file_mtime = Column(BigInteger)   # Modification time in nanoseconds
+    file_inode = Column(BigInteger)
+    content_hash = Column(String)     # BLAKE2b of the file content, hex, read at ingest
+    width = Column(Integer)           # Pixel size as stored, before orientation
+    height = Column(Integer)
+    orientation = Column(Integer)     # EXIF orientation, 1 is upright
     faces = relationship("Face", back_populates="image", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index('ix_images_processed_id', 'processed', 'id'),  # Keyset scans over unprocessed images
+        Index('ix_images_album_id_id', 'album_id', 'id'),    # Album pages in id order
+        Index('ix_images_timestamp', 'timestamp'),           # Date order and ranges
+    )
+
+class Person(Base):
+    __tablename__ = 'persons'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)
+    face_count = Column(Integer, default=0)  # Kept up to date with every face write
+    cover_face_id = Column(Integer)          # Most confident face, shown for the person
+    faces = relationship("Face", back_populates="person")
+
 class Face(Base):
     __tablename__ = 'faces'
     id = Column(Integer, primary_key=True)
     image_id = Column(Integer, ForeignKey('images.id'))
-    person_name = Column(String)
-    face_encoding = Column(String)  # Keep as String for backward compatibility
+    person_id = Column(Integer, ForeignKey('persons.id'))
+    person_name = Column(String)    # Legacy name, cleared once migrated to person_id
+    face_encoding = Column(String)  # Legacy JSON encoding, cleared once migrated to embedding
+    embedding = Column(LargeBinary) # Binary embedding with dimension/dtype header
     facial_area = Column(String)    # New field for facial area coordinates (JSON string)
     landmarks = Column(String)      # New field for facial landmarks (JSON string)
     confidence = Column(Float)      # New field for detection confidence
     image = relationship("Image", back_populates="faces")
+    person = relationship("Person", back_populates="faces")
+
+    __table_args__ = (
+        Index('ix_faces_image_id', 'image_id'),                         # Faces of an image, resets and deletes
+        Index('ix_faces_person_id_image_id', 'person_id', 'image_id'),  # Images of a person, merges and counts
+    )
 
 class Album(Base):
     __tablename__ = 'albums'
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    images = relationship("Image", cascade="all, delete-orphan")
\ No newline at end of file
+    image_count = Column(Integer, default=0)  # Kept up to date with every image insert and delete
+    cover_image_id = Column(Integer)          # First image, shown for the album
+    images = relationship("Image", cascade="all, delete-orphan")
+
+class JobCheckpoint(Base):
+    __tablename__ = 'job_checkpoints'
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, default=0)  # Every row up to this id has been handled
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_versions'
+    version = Column(Integer, primary_key=True)  # Applied step of database.migrations
+    description = Column(String)
+    applied_at = Column(DateTime, default=datetime.now)
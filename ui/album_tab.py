@@ -1,88 +1,77 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListWidget, QListWidgetItem, QPushButton
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QListView, QLabel, QPushButton
 from PyQt5.QtCore import Qt, QSize
-from PyQt5.QtGui import QPixmap, QIcon
+from ui.list_models import ListEntry, EntryListModel, ImagePageModel
+from ui.thumbnails import image_fingerprint
 import os
 
 class AlbumTab(QWidget):
+    ROW_SIZE = QSize(180, 180)
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent = parent
+        self.album_id = None
         self.initUI()
     
     def initUI(self):
         layout = QVBoxLayout(self)
-        self.albums_list = QListWidget()
-        self.albums_list.itemDoubleClicked.connect(self.handle_album_double_click)
+        
+        # Back button and title, shown while an album is open
+        header_layout = QHBoxLayout()
+        self.back_btn = QPushButton("← Back to Albums")
+        self.back_btn.clicked.connect(self.load_albums)
+        header_layout.addWidget(self.back_btn)
+        self.title_label = QLabel()
+        font = self.title_label.font()
+        font.setBold(True)
+        self.title_label.setFont(font)
+        header_layout.addWidget(self.title_label, 1)
+        layout.addLayout(header_layout)
+        self.show_header(None)
+        
+        self.albums_list = QListView()
+        # Only rows on screen are measured and painted
+        self.albums_list.setUniformItemSizes(True)
+        self.albums_list.setIconSize(QSize(512, 512))
+        self.albums_list.doubleClicked.connect(self.handle_album_double_click)
         layout.addWidget(self.albums_list)
+        self.thumbnails = self.parent.create_thumbnail_loader(self.albums_list, 200)
         self.setLayout(layout)
     
+    def show_header(self, title):
+        self.back_btn.setVisible(title is not None)
+        self.title_label.setVisible(title is not None)
+        self.title_label.setText(title or "")
+    
     def load_albums(self):
-        self.albums_list.clear()
-        self.albums_list.setIconSize(QSize(512, 512))
+        self.album_id = None
+        self.show_header(None)
+        entries = []
         if hasattr(self.parent, 'db_manager'):
-            albums = self.parent.db_manager.get_albums()
-            for album in albums:
-                item = QListWidgetItem(f"{album.name} ({len(album.images)} images)")
-                item.setData(Qt.UserRole, album.id)
-                image = self.parent.db_manager.get_images_by_album(album.id, limit=1)
-                if image:
-                    try:
-                        pixmap = QPixmap(image[0].file_path)
-                        if not pixmap.isNull():
-                            pixmap = pixmap.scaled(QSize(200, 200), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                            item.setIcon(QIcon(pixmap))
-                            item.setSizeHint(QSize(180, 180))
-                    except:
-                        item.setIcon(QIcon.fromTheme("image-x-generic"))
-
-                self.albums_list.addItem(item)
+            # One query for every album, each shown by the thumbnail of its first image
+            for album in self.parent.db_manager.get_album_listing():
+                entry = ListEntry(f"{album.name} ({album.image_count} images)", album.album_id)
+                if album.file_path:
+                    entry = entry._replace(file_path=album.file_path, fingerprint=image_fingerprint(album))
+                entries.append(entry)
+        self.thumbnails.set_model(EntryListModel(self.thumbnails, self.ROW_SIZE, entries))
     
-    def handle_album_double_click(self, item):
-        album_id = item.data(Qt.UserRole)
-        if album_id is not None:
-            self.show_album_contents(album_id)
+    def handle_album_double_click(self, index):
+        # Rows of an open album hold file paths
+        if self.album_id is None:
+            album_id = index.data(Qt.UserRole)
+            if album_id is not None:
+                self.show_album_contents(album_id)
     
     def show_album_contents(self, album_id):
-        self.albums_list.clear()
-        
-        # Get album info
-        albums = self.parent.db_manager.get_albums()
-        album = next((a for a in albums if a.id == album_id), None)
+        album = self.parent.db_manager.get_album(album_id)
         
         if not album:
             return
         
-        # Add back button
-        back_item = QListWidgetItem("← Back to Albums")
-        font = back_item.font()
-        font.setBold(True)
-        back_item.setFont(font)
-        back_item.setData(Qt.UserRole, "back")
-        self.albums_list.addItem(back_item)
-        self.albums_list.setIconSize(QSize(512, 512))
-        
-        # Add album title
-        title_item = QListWidgetItem(f"Album: {album.name}")
-        font = title_item.font()
-        font.setBold(True)
-        title_item.setFont(font)
-        self.albums_list.addItem(title_item)
+        self.album_id = album_id
+        self.show_header(f"Album: {album.name}")
         
-        # Add images
-        for image in album.images:
-            item = QListWidgetItem()
-            # item.setText(os.path.basename(image.file_path))
-            item.setData(Qt.UserRole, image.file_path)
-            
-            # Try to create thumbnail
-            try:
-                pixmap = QPixmap(image.file_path)
-                if not pixmap.isNull():
-                    pixmap = pixmap.scaled(QSize(200, 200), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                    item.setIcon(QIcon(pixmap))
-                    item.setSizeHint(QSize(180, 180))
-            except:
-                item.setIcon(QIcon.fromTheme("image-x-generic"))
-                
-            self.albums_list.addItem(item)
-            
\ No newline at end of file
+        # Images are read from the database a page at a time as the list is scrolled
+        self.thumbnails.set_model(ImagePageModel(self.parent.db_manager, self.thumbnails, self.ROW_SIZE,
+                                                 album_id=album_id))
\ No newline at end of file
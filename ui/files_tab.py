@@ -1,9 +1,13 @@
 import os
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListWidget, QListWidgetItem
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListView
 from PyQt5.QtCore import Qt, QSize
-from PyQt5.QtGui import QPixmap, QIcon
+from PyQt5.QtGui import QIcon
+from ui.list_models import ListEntry, EntryListModel, ImagePageModel
+from utils.library_scanner import iter_media_files, fingerprint, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
 
 class FilesTab(QWidget):
+    ROW_SIZE = QSize(80, 70)
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent = parent
@@ -11,80 +15,64 @@ class FilesTab(QWidget):
     
     def initUI(self):
         layout = QVBoxLayout(self)
-        self.image_list = QListWidget()
-        self.image_list.itemDoubleClicked.connect(self.handle_item_double_click)
+        self.image_list = QListView()
+        # Only rows on screen are measured and painted
+        self.image_list.setUniformItemSizes(True)
+        self.image_list.setIconSize(QSize(64, 64))
+        self.image_list.doubleClicked.connect(self.handle_item_double_click)
         layout.addWidget(self.image_list)
+        self.thumbnails = self.parent.create_thumbnail_loader(self.image_list, 64)
+        self.clear_list()
         self.setLayout(layout)
     
     def clear_list(self):
-        self.image_list.clear()
+        self.thumbnails.set_model(EntryListModel(self.thumbnails, self.ROW_SIZE))
     
     def update_folder_list(self, folders):
-        self.image_list.clear()
+        # Folders are walked as the list is scrolled
+        self.thumbnails.set_model(EntryListModel(self.thumbnails, self.ROW_SIZE,
+                                                 source=self.iter_folder_entries(folders)))
+        if hasattr(self.parent, 'statusBar'):
+            self.parent.statusBar.showMessage(f"Showing media files from {len(folders)} folder(s)")
+    
+    def iter_folder_entries(self, folders):
         for folder in folders:
-            folder_item = QListWidgetItem(f"Selected Folder: {folder}")
-            font = folder_item.font()
-            font.setBold(True)
-            folder_item.setFont(font)
-            self.image_list.addItem(folder_item)
+            yield ListEntry(f"Selected Folder: {folder}", bold=True)
             try:
-                self.load_media_from_folder(folder)
+                yield from self.iter_media_entries(folder)
             except Exception as e:
-                self.image_list.addItem(f"    Error accessing folder: {str(e)}")
+                yield ListEntry(f"    Error accessing folder: {str(e)}")
     
-    def load_media_from_folder(self, folder_path):
+    def iter_media_entries(self, folder_path):
         if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
             return
-            
-        # Define supported formats
-        img_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-        video_extensions = ('.mp4', '.mov', '.avi')
         
-        # Get all media files
-        files = []
-        for file in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, file)
-            if os.path.isfile(file_path):
-                ext = os.path.splitext(file)[1].lower()
-                if ext in img_extensions or ext in video_extensions:
-                    files.append(file_path)
+        img_extensions = IMAGE_EXTENSIONS
+        video_extensions = VIDEO_EXTENSIONS
         
-        # Update status
-        if hasattr(self.parent, 'statusBar'):
-            self.parent.statusBar.showMessage(f"Loading {len(files)} media files...")
-        
-        # Display files in list widget with thumbnails
-        for file_path in files:
+        # Get all media files, including subfolders
+        for entry in iter_media_files(folder_path):
+            file_path = entry.path
             ext = os.path.splitext(file_path)[1].lower()
+            text = os.path.relpath(file_path, folder_path)
             
-            item = QListWidgetItem()
-            item.setText(os.path.basename(file_path))
-            item.setData(Qt.UserRole, file_path)  # Store full path
-            
-            # Create thumbnail for images
+            # Thumbnails of images are loaded in the background
             if ext in img_extensions:
                 try:
-                    pixmap = QPixmap(file_path)
-                    if not pixmap.isNull():
-                        pixmap = pixmap.scaled(QSize(64, 64), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                        item.setIcon(QIcon(pixmap))
-                        item.setSizeHint(QSize(80, 70))
-                except:
-                    # Use default icon if thumbnail creation fails
-                    item.setIcon(QIcon.fromTheme("image-x-generic"))
+                    file_fingerprint = fingerprint(entry)
+                except OSError:
+                    file_fingerprint = None
+                yield ListEntry(text, file_path, file_path, file_fingerprint)
             
             # Use icon for videos
             elif ext in video_extensions:
-                item.setIcon(QIcon.fromTheme("video-x-generic"))
-                item.setSizeHint(QSize(80, 70))
-                
-            self.image_list.addItem(item)
-        
-        if hasattr(self.parent, 'statusBar'):
-            self.parent.statusBar.showMessage(f"Loaded {len(files)} media files from {os.path.basename(folder_path)}")
+                yield ListEntry(text, file_path, icon=QIcon.fromTheme("video-x-generic"))
+            
+            else:
+                yield ListEntry(text, file_path)
     
-    def handle_item_double_click(self, item):
-        file_path = item.data(Qt.UserRole)
+    def handle_item_double_click(self, index):
+        file_path = index.data(Qt.UserRole)
         if file_path and os.path.isfile(file_path):
             # Open file with default application
             import subprocess
@@ -97,28 +85,10 @@ class FilesTab(QWidget):
             else:  # Linux
                 subprocess.run(['xdg-open', file_path])
     
-    def show_search_results(self, results, query):
-        self.image_list.clear()
-        
-        result_item = QListWidgetItem(f"Search Results for: '{query}'")
-        font = result_item.font()
-        font.setBold(True)
-        result_item.setFont(font)
-        self.image_list.addItem(result_item)
-        
-        for image in results:
-            item = QListWidgetItem()
-            item.setText(os.path.basename(image.file_path))
-            item.setData(Qt.UserRole, image.file_path)
-            
-            # Create thumbnail
-            try:
-                pixmap = QPixmap(image.file_path)
-                if not pixmap.isNull():
-                    pixmap = pixmap.scaled(QSize(64, 64), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                    item.setIcon(QIcon(pixmap))
-                    item.setSizeHint(QSize(80, 70))
-            except:
-                item.setIcon(QIcon.fromTheme("image-x-generic"))
-                
-            self.image_list.addItem(item)
\ No newline at end of file
+    def show_search_results(self, query):
+        """Show the images of a person, returns the number of matches"""
+        model = ImagePageModel(
+            self.parent.db_manager, self.thumbnails, self.ROW_SIZE, person_name=query,
+            headers=[ListEntry(f"Search Results for: '{query}'", bold=True)], show_names=True)
+        self.thumbnails.set_model(model)
+        return model.count()
\ No newline at end of file
@@ -0,0 +1,197 @@
+import os
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, NamedTuple, Optional
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, Qt, QSize
+from PyQt5.QtGui import QIcon
+from ui.thumbnails import image_fingerprint
+
+
+class ListEntry(NamedTuple):
+    """One row of a list view"""
+    text: str = ''
+    data: Any = None          # Returned for Qt.UserRole
+    file_path: Optional[str] = None  # Image shown as the row's thumbnail
+    fingerprint: Any = None
+    icon: Optional[QIcon] = None     # Fixed icon of rows without an image
+    bold: bool = False
+    face: Any = None                 # (face id, facial area) shown instead of the whole image
+
+
+class ThumbnailListModel(QAbstractListModel):
+    """
+    Base of the tab models, rows come from entry() and thumbnails from a ThumbnailLoader.
+
+    The views use uniform item sizes, so only the rows on screen are ever
+    asked for their data.
+    """
+
+    def __init__(self, thumbnails, size_hint, parent=None):
+        """
+        Args:
+            thumbnails: ThumbnailLoader of the view showing this model
+            size_hint: QSize of every row
+        """
+        super().__init__(parent)
+        self.thumbnails = thumbnails
+        self.size_hint = size_hint
+
+    def entry(self, row) -> Optional[ListEntry]:
+        """Return the ListEntry shown in a row, None for rows without one; subclasses provide the rows"""
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        entry = self.entry(index.row())
+        if entry is None:
+            return None
+        if role == Qt.DisplayRole:
+            return entry.text or None
+        if role == Qt.UserRole:
+            return entry.data
+        if role == Qt.DecorationRole:
+            if entry.file_path:
+                return self.thumbnails.icon(index.row(), entry.file_path, entry.fingerprint, entry.face)
+            return entry.icon
+        if role == Qt.FontRole and entry.bold:
+            font = self.thumbnails.view.font()
+            font.setBold(True)
+            return font
+        if role == Qt.SizeHintRole:
+            return self.size_hint
+        return None
+
+
+class EntryListModel(ThumbnailListModel):
+    """
+    Rows held in memory, optionally pulled from an iterator a page at a time.
+
+    With a source the view fetches more rows as it is scrolled to the end,
+    so a slow listing such as a folder walk shows its first rows right away.
+    """
+    PAGE_SIZE = 500
+
+    def __init__(self, thumbnails, size_hint, entries=(), source=None, parent=None):
+        """
+        Args:
+            thumbnails: ThumbnailLoader of the view showing this model
+            size_hint: QSize of every row
+            entries: Rows shown right away
+            source: Optional iterator of further ListEntry rows
+        """
+        super().__init__(thumbnails, size_hint, parent)
+        self._entries = list(entries)
+        self._source = source
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._entries)
+
+    def entry(self, row):
+        return self._entries[row] if 0 <= row < len(self._entries) else None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self._source is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._source is None:
+            return
+        entries = list(islice(self._source, self.PAGE_SIZE))
+        if len(entries) < self.PAGE_SIZE:
+            self._source = None
+        if entries:
+            self.beginInsertRows(QModelIndex(), len(self._entries), len(self._entries) + len(entries) - 1)
+            self._entries.extend(entries)
+            self.endInsertRows()
+
+
+class ImagePageModel(ThumbnailListModel):
+    """
+    Images of the catalog, read from the database in keyset pages.
+
+    The view fetches one more page whenever it is scrolled to the end. Only
+    the start id of every page and the rows of the last MAX_PAGES pages used
+    are kept, older pages are read again when scrolled back to. Memory use
+    therefore does not grow with the number of rows scrolled through.
+
+    Rows are counted when their page is first read. Images deleted later
+    leave empty rows at the end of their page until the model is reset.
+    """
+    PAGE_SIZE = 200
+    MAX_PAGES = 20
+
+    def __init__(self, db_manager, thumbnails, size_hint, album_id=None, person_name=None,
+                 headers=(), show_names=False, parent=None):
+        """
+        Args:
+            db_manager: DatabaseManager
+            thumbnails: ThumbnailLoader of the view showing this model
+            size_hint: QSize of every row
+            album_id: Only images of this album
+            person_name: Only images with a face of this person
+            headers: ListEntry rows shown above the images
+            show_names: Show file names under the thumbnails
+        """
+        super().__init__(thumbnails, size_hint, parent)
+        self.db_manager = db_manager
+        self.album_id = album_id
+        self.person_name = person_name
+        self.headers = list(headers)
+        self.show_names = show_names
+        self._page_starts = [0]      # after_id of every page read so far and of the next one
+        self._pages = OrderedDict()  # page number -> rows, least recently used first
+        self._rows = 0
+        self._exhausted = False
+
+    def count(self):
+        """Total number of images, not only the rows fetched so far"""
+        return self.db_manager.count_images(self.album_id, self.person_name)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers) + self._rows
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self._exhausted:
+            return
+        page = len(self._page_starts) - 1
+        rows = self._page(page)
+        if len(rows) < self.PAGE_SIZE:
+            self._exhausted = True
+        if rows:
+            first = len(self.headers) + self._rows
+            self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+            self._rows += len(rows)
+            self._page_starts.append(rows[-1].id)
+            self.endInsertRows()
+
+    def _page(self, page):
+        rows = self._pages.get(page)
+        if rows is not None:
+            self._pages.move_to_end(page)
+            return rows
+        rows = self.db_manager.get_image_page(self._page_starts[page], self.PAGE_SIZE,
+                                              self.album_id, self.person_name)
+        self._pages[page] = rows
+        while len(self._pages) > self.MAX_PAGES:
+            self._pages.popitem(last=False)
+        return rows
+
+    def entry(self, row):
+        if row < len(self.headers):
+            return self.headers[row] if row >= 0 else None
+        page, offset = divmod(row - len(self.headers), self.PAGE_SIZE)
+        if page >= len(self._page_starts) - 1:
+            return None
+        rows = self._page(page)
+        if offset >= len(rows):
+            return None
+        image = rows[offset]
+        return ListEntry(
+            text=os.path.basename(image.file_path) if self.show_names else '',
+            data=image.file_path,
+            file_path=image.file_path,
+            fingerprint=image_fingerprint(image)
+        )
@@ -1,33 +1,64 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import (QMainWindow, QFileDialog, QVBoxLayout, QWidget, 
                             QMenuBar, QMenu, QAction, QStatusBar, QHBoxLayout, 
                             QLabel, QTabWidget, QLineEdit, QPushButton)
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from database.db_manager import DatabaseManager
 from ui.files_tab import FilesTab
 from ui.album_tab import AlbumTab
 from ui.people_tab import PeopleTab
+from ui.thumbnails import ThumbnailLoader
+from ui.workers import JobRunner
 from utils.image_processor import ImageProcessor
 from utils.face_recognition import FaceRecognitionProcessor
 from utils.config_manager import ConfigManager
+from utils.folder_watcher import FolderWatcher
+from utils.thumbnail_cache import ThumbnailCache
 
 class PhotoManagerApp(QMainWindow):
+    # Emitted from the folder watcher thread with settled paths
+    watched_files_changed = pyqtSignal(list)
+    # Emitted from the folder watcher thread when watching stopped on an error
+    watch_failed = pyqtSignal(str)
+    
+    # Imports at least this large use the face worker processes
+    WATCH_WORKER_MIN_FILES = 100
+    
     def __init__(self):
         super().__init__()
         self.selected_folders = []
+        self.folder_watcher = None
+        self.watch_pending = set()
+        self.watched_files_changed.connect(self.on_watched_files_changed)
+        self.watch_failed.connect(self.on_watch_failed)
         self.config_manager = ConfigManager()
         self.db_manager = None
         self.initDatabase()
         # self.db_manager = DatabaseManager()
-        self.image_processor = ImageProcessor(self.db_manager)
-        self.face_processor = FaceRecognitionProcessor(self.db_manager)
+        # Shared by all tabs and filled while files are imported and faces processed
+        self.thumbnail_cache = ThumbnailCache(**self.config_manager.get_thumbnail_settings())
+        self.face_processor = FaceRecognitionProcessor(
+            self.db_manager, thumbnail_cache=self.thumbnail_cache,
+            **self.config_manager.get_face_recognition_settings())
+        # Loads thumbnails for the list views, off the GUI thread
+        self.thumbnail_loader_workers = self.config_manager.get_thumbnail_loader_workers()
+        self.thumbnail_pool = ThreadPoolExecutor(max_workers=self.thumbnail_loader_workers,
+                                                 thread_name_prefix='thumbnail-loader')
+        self.image_processor = ImageProcessor(self.db_manager, self.face_processor.remove_faces,
+                                              thumbnail_cache=self.thumbnail_cache,
+                                              **self.config_manager.get_library_settings())
+        self.job_runner = JobRunner(self)
+        self.job_runner.started.connect(self.on_job_started)
+        self.job_runner.stopped.connect(self.on_job_stopped)
         self.initUI()
 
     def initDatabase(self):
         try:
             # Get database URL from configuration
             db_url = self.config_manager.get_database_url()
-            self.db_manager = DatabaseManager(db_url)
+            self.db_manager = DatabaseManager(db_url, self.config_manager.get_embedding_dtype(),
+                                              **self.config_manager.get_sqlite_settings())
         except Exception: 
             self.statusBar.showMessage(f"Exeption {Exception}")
 
@@ -80,6 +111,24 @@ class PhotoManagerApp(QMainWindow):
         self.face_process_btn.setEnabled(False)
         folder_layout.addWidget(self.face_process_btn)
         
+        # Background job controls
+        self.pause_btn = QPushButton("Pause")
+        self.pause_btn.clicked.connect(self.toggle_pause_job)
+        self.pause_btn.setEnabled(False)
+        folder_layout.addWidget(self.pause_btn)
+        
+        self.cancel_btn = QPushButton("Cancel")
+        self.cancel_btn.clicked.connect(self.job_runner.cancel)
+        self.cancel_btn.setEnabled(False)
+        folder_layout.addWidget(self.cancel_btn)
+        
+        # Import new files as they land in the selected folders
+        self.watch_btn = QPushButton("Watch Folders")
+        self.watch_btn.setCheckable(True)
+        self.watch_btn.toggled.connect(self.toggle_watch)
+        self.watch_btn.setEnabled(False)
+        folder_layout.addWidget(self.watch_btn)
+        
         self.layout.addLayout(folder_layout)
         
         # Create tab widget
@@ -103,6 +152,11 @@ class PhotoManagerApp(QMainWindow):
         self.albums_tab.load_albums()
         self.people_tab.load_people()
     
+    def create_thumbnail_loader(self, view, size):
+        """Background thumbnail loading for a tab's list view"""
+        return ThumbnailLoader(self.thumbnail_cache, self.thumbnail_pool, view, size,
+                               self.thumbnail_loader_workers)
+    
     def create_menu_bar(self):
         menubar = self.menuBar()
         
@@ -116,16 +170,21 @@ class PhotoManagerApp(QMainWindow):
         file_menu.addAction(select_folder_action)
         
         # Process action
-        process_action = QAction("Process Files", self)
-        process_action.setShortcut("Ctrl+P")
-        process_action.triggered.connect(self.process_files)
-        file_menu.addAction(process_action)
+        self.process_action = QAction("Process Files", self)
+        self.process_action.setShortcut("Ctrl+P")
+        self.process_action.triggered.connect(self.process_files)
+        file_menu.addAction(self.process_action)
         
         # Face processing action
-        face_action = QAction("Detect Faces", self)
-        face_action.setShortcut("Ctrl+F")
-        face_action.triggered.connect(self.process_faces)
-        file_menu.addAction(face_action)
+        self.face_action = QAction("Detect Faces", self)
+        self.face_action.setShortcut("Ctrl+F")
+        self.face_action.triggered.connect(self.process_faces)
+        file_menu.addAction(self.face_action)
+        
+        # Merge unknown persons that are the same person
+        self.cluster_action = QAction("Group Unknown Faces", self)
+        self.cluster_action.triggered.connect(self.cluster_faces)
+        file_menu.addAction(self.cluster_action)
         
         file_menu.addSeparator()
         
@@ -156,17 +215,54 @@ class PhotoManagerApp(QMainWindow):
         if folder:
             self.selected_folders.append(folder)
             self.files_tab.update_folder_list(self.selected_folders)
-            self.process_btn.setEnabled(True)
-            self.face_process_btn.setEnabled(True)
+            # Folders may be picked while a job runs, its buttons come back when it stops
+            idle = not self.job_runner.is_running
+            self.process_btn.setEnabled(idle)
+            self.face_process_btn.setEnabled(idle)
+            self.watch_btn.setEnabled(True)
             self.statusBar.showMessage(f"{len(self.selected_folders)} folder(s) selected")
+            if self.folder_watcher:
+                self.start_watching()
     
     def process_files(self):
         if not self.selected_folders:
             self.statusBar.showMessage("No folders selected")
             return
         
-        self.statusBar.showMessage("Processing files...")
-        processed, added = self.image_processor.process_folders(self.selected_folders)
+        folders = list(self.selected_folders)
+        if self.start_database_job(
+            "Processing files",
+            lambda control: self.image_processor.process_folders(folders, control),
+            self.on_files_processed
+        ):
+            self.statusBar.showMessage("Processing files...")
+    
+    def start_database_job(self, name, job, on_finished):
+        """
+        Run a job that reads and writes the catalog on the job thread.
+        
+        The job uses its own session, closed when it ends. The GUI session
+        forgets what it loaded before the job's writes, so the slots reload it.
+        Returns False and tells the user if another job is still running.
+        """
+        def run(control):
+            try:
+                return job(control)
+            finally:
+                self.db_manager.remove_session()
+        
+        def finished(result):
+            self.db_manager.session.expire_all()
+            on_finished(result)
+        
+        started = self.job_runner.start(name, run, on_progress=self.show_job_progress,
+                                        on_finished=finished, on_failed=self.on_job_failed)
+        if not started:
+            self.statusBar.showMessage(f"{self.job_runner.name} is still running, wait for it or cancel it first")
+        return started
+    
+    def on_files_processed(self, result):
+        processed, added = result
         
         # Update UI
         self.albums_tab.load_albums()
@@ -178,14 +274,160 @@ class PhotoManagerApp(QMainWindow):
             self.statusBar.showMessage("No folders selected")
             return
         
-        self.statusBar.showMessage("Processing faces...")
-        processed, detected = self.face_processor.process_images()
+        if self.start_database_job(
+            "Processing faces",
+            lambda control: self.face_processor.process_images(control=control),
+            self.on_faces_processed
+        ):
+            self.statusBar.showMessage("Processing faces...")
+    
+    def on_faces_processed(self, result):
+        processed, detected = result
         
         # Update UI
         self.people_tab.load_people()
         
         self.statusBar.showMessage(f"Processed {processed} images. Detected {detected} faces.")
     
+    def cluster_faces(self):
+        if self.start_database_job(
+            "Grouping unknown faces",
+            lambda control: self.face_processor.cluster_unknown_faces(control=control),
+            self.on_faces_clustered
+        ):
+            self.statusBar.showMessage("Grouping unknown faces...")
+    
+    def on_faces_clustered(self, result):
+        merged, moved = result
+        
+        # Update UI
+        self.people_tab.load_people()
+        
+        self.statusBar.showMessage(f"Merged {merged} unknown people ({moved} faces).")
+    
+    def toggle_watch(self, checked):
+        if checked:
+            self.start_watching()
+        else:
+            self.stop_watching()
+            self.statusBar.showMessage("Stopped watching folders")
+    
+    def start_watching(self):
+        self.stop_watching()
+        if not self.selected_folders:
+            self.watch_btn.setChecked(False)
+            return
+        
+        self.folder_watcher = FolderWatcher(self.selected_folders, self.watched_files_changed.emit,
+                                            on_error=self.watch_failed.emit,
+                                            **self.config_manager.get_watch_settings())
+        try:
+            self.folder_watcher.start()
+        except Exception as e:
+            self.folder_watcher = None
+            self.watch_btn.setChecked(False)
+            self.statusBar.showMessage(f"Cannot watch folders: {str(e)}")
+            return
+        self.statusBar.showMessage(
+            f"Watching {len(self.selected_folders)} folder(s) for new files ({self.folder_watcher.backend})")
+    
+    def stop_watching(self):
+        if self.folder_watcher:
+            self.folder_watcher.stop()
+            self.folder_watcher = None
+        self.watch_pending.clear()
+    
+    def on_watch_failed(self, error):
+        # Unchecking stops the watcher
+        self.watch_btn.setChecked(False)
+        self.statusBar.showMessage(f"Stopped watching folders: {error}")
+    
+    def on_watched_files_changed(self, paths):
+        if not self.folder_watcher:
+            return
+        self.watch_pending.update(paths)
+        self.import_watched_files()
+    
+    def import_watched_files(self):
+        # Changes that arrive while another job runs wait for it to finish
+        if not self.watch_pending or self.job_runner.is_running:
+            return
+        paths = sorted(self.watch_pending)
+        self.watch_pending.clear()
+        self.start_database_job(
+            "Importing new files",
+            lambda control: self.import_changed_files(paths, control),
+            self.on_changed_files_imported
+        )
+    
+    def import_changed_files(self, paths, control):
+        """Add changed files and detect their faces, runs on the job thread"""
+        # Small imports are detected in this process, so ingest keeps the images it decodes for them
+        face_min_side = self.face_processor.decode_min_side if len(paths) < self.WATCH_WORKER_MIN_FILES else None
+        decoded_images = self.image_processor.decoded_images
+        try:
+            total, added, image_ids = self.image_processor.process_paths(paths, control, face_min_side)
+            if control.is_cancelled or not image_ids:
+                return total, added, 0
+            # Only the imported files, the backlog is left to a full face processing run
+            workers = None if len(image_ids) >= self.WATCH_WORKER_MIN_FILES else 0
+            _, detected = self.face_processor.process_images(control=control, workers=workers,
+                                                             decoded_images=decoded_images,
+                                                             image_ids=image_ids)
+        finally:
+            decoded_images.clear()
+        return total, added, detected
+    
+    def on_changed_files_imported(self, result):
+        total, added, detected = result
+        self.albums_tab.load_albums()
+        self.people_tab.load_people()
+        self.statusBar.showMessage(f"Imported {added} new file(s) of {total} changed. Detected {detected} faces.")
+    
+    def on_job_failed(self, error):
+        # Reload what the job wrote before it failed
+        self.db_manager.session.expire_all()
+        self.statusBar.showMessage(f"{self.job_runner.name} failed: {error}")
+    
+    def show_job_progress(self, progress):
+        message = f"{self.job_runner.name}: {progress.done}"
+        if progress.total:
+            message += f"/{progress.total}"
+        message += f" ({progress.rate:.1f}/s"
+        if progress.eta is not None:
+            minutes, seconds = divmod(int(progress.eta), 60)
+            hours, minutes = divmod(minutes, 60)
+            message += f", ETA {hours:d}:{minutes:02d}:{seconds:02d}"
+        message += ")"
+        if progress.message:
+            message += f" - {progress.message}"
+        if self.job_runner.worker and self.job_runner.worker.control.is_paused:
+            message += " [paused]"
+        self.statusBar.showMessage(message)
+    
+    def toggle_pause_job(self):
+        paused = self.job_runner.toggle_pause()
+        self.pause_btn.setText("Resume" if paused else "Pause")
+    
+    def on_job_started(self, name):
+        # Browsing and search keep reading the catalog, only one job runs at a time
+        for widget in (self.process_btn, self.face_process_btn,
+                       self.process_action, self.face_action, self.cluster_action):
+            widget.setEnabled(False)
+        self.pause_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(True)
+    
+    def on_job_stopped(self, name):
+        has_folders = bool(self.selected_folders)
+        self.process_btn.setEnabled(has_folders)
+        self.face_process_btn.setEnabled(has_folders)
+        for action in (self.process_action, self.face_action, self.cluster_action):
+            action.setEnabled(True)
+        self.pause_btn.setEnabled(False)
+        self.pause_btn.setText("Pause")
+        self.cancel_btn.setEnabled(False)
+        self.import_watched_files()
+    
     def search_images(self):
         query = self.search_box.text().strip()
         if not query:
@@ -194,24 +436,26 @@ class PhotoManagerApp(QMainWindow):
         
         self.statusBar.showMessage(f"Searching for '{query}'...")
         
-        # Search in database
-        results = self.db_manager.get_images_by_person(query)
-        
-        # Show results
-        self.files_tab.show_search_results(results, query)
+        # Show results, read from the database as they are scrolled
+        count = self.files_tab.show_search_results(query)
         
-        self.statusBar.showMessage(f"Found {len(results)} images matching '{query}'")
+        self.statusBar.showMessage(f"Found {count} images matching '{query}'")
     
     def clear_selection(self):
         self.selected_folders = []
         self.files_tab.clear_list()
         self.process_btn.setEnabled(False)
         self.face_process_btn.setEnabled(False)
+        self.watch_btn.setChecked(False)
+        self.watch_btn.setEnabled(False)
         self.statusBar.showMessage("Selection cleared")
     
     def show_about(self):
         self.statusBar.showMessage("PixSort - Photo & Video Manager v1.0")
     
     def closeEvent(self, event):
+        self.stop_watching()
+        self.job_runner.wait()
+        self.thumbnail_pool.shutdown(wait=True, cancel_futures=True)
         self.db_manager.close()
         event.accept()
\ No newline at end of file
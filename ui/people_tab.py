@@ -1,84 +1,71 @@
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QListWidget, QListWidgetItem
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QListView, QLabel, QPushButton
 from PyQt5.QtCore import Qt, QSize
-from PyQt5.QtGui import QPixmap, QIcon
+from ui.list_models import ListEntry, EntryListModel, ImagePageModel
+import json
 import os
 
 class PeopleTab(QWidget):
+    ROW_SIZE = QSize(180, 180)
+    
     def __init__(self, parent=None):
         super().__init__(parent)
         self.parent = parent
+        self.person_name = None
         self.initUI()
     
     def initUI(self):
         layout = QVBoxLayout(self)
-        self.people_list = QListWidget()
-        self.people_list.itemDoubleClicked.connect(self.handle_person_double_click)
+        
+        # Back button and title, shown while a person is open
+        header_layout = QHBoxLayout()
+        self.back_btn = QPushButton("← Back to People")
+        self.back_btn.clicked.connect(self.load_people)
+        header_layout.addWidget(self.back_btn)
+        self.title_label = QLabel()
+        font = self.title_label.font()
+        font.setBold(True)
+        self.title_label.setFont(font)
+        header_layout.addWidget(self.title_label, 1)
+        layout.addLayout(header_layout)
+        self.show_header(None)
+        
+        self.people_list = QListView()
+        # Only rows on screen are measured and painted
+        self.people_list.setUniformItemSizes(True)
+        self.people_list.setIconSize(QSize(512, 512))
+        self.people_list.doubleClicked.connect(self.handle_person_double_click)
         layout.addWidget(self.people_list)
+        self.thumbnails = self.parent.create_thumbnail_loader(self.people_list, 200)
         self.setLayout(layout)
     
+    def show_header(self, title):
+        self.back_btn.setVisible(title is not None)
+        self.title_label.setVisible(title is not None)
+        self.title_label.setText(title or "")
+    
     def load_people(self):
-        self.people_list.clear()
-        self.people_list.setIconSize(QSize(512, 512))
+        self.person_name = None
+        self.show_header(None)
+        entries = []
         if hasattr(self.parent, 'db_manager'):
-            people = self.parent.db_manager.get_people()
-            for person in people:
-                person_name = person[0]  # Since we're using .distinct() which returns tuples
-                
-                if person_name:  # Ignore empty names
-                    item = QListWidgetItem(person_name)
-                    item.setData(Qt.UserRole, person_name)
-                    image = self.parent.db_manager.get_images_by_person(person_name, limit=1)
-                    if image:
-                        pixmap = QPixmap(image[0].file_path)
-                        pixmap = pixmap.scaled(QSize(200, 200), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                        item.setIcon(QIcon(pixmap))
-                        item.setSizeHint(QSize(180, 180))
-                    self.people_list.addItem(item)
-                    
+            # One query for everyone, each shown by the thumbnail of their best face
+            for person in self.parent.db_manager.get_people_faces():
+                face = (person.face_id, json.loads(person.facial_area)) if person.facial_area else None
+                entries.append(ListEntry(person.person_name, person.person_name,
+                                         file_path=person.file_path, face=face))
+        self.thumbnails.set_model(EntryListModel(self.thumbnails, self.ROW_SIZE, entries))
     
-    def handle_person_double_click(self, item):
-        person_name = item.data(Qt.UserRole)
-        if person_name and person_name != "back":
-            self.show_person_images(person_name)
-        elif person_name == "back":
-            self.load_people()
+    def handle_person_double_click(self, index):
+        # Rows of an open person hold file paths
+        if self.person_name is None:
+            person_name = index.data(Qt.UserRole)
+            if person_name:
+                self.show_person_images(person_name)
     
     def show_person_images(self, person_name):
-        self.people_list.clear()
-        
-        # Add back button
-        back_item = QListWidgetItem("← Back to People")
-        font = back_item.font()
-        font.setBold(True)
-        back_item.setFont(font)
-        back_item.setData(Qt.UserRole, "back")
-        self.people_list.addItem(back_item)
-        self.people_list.setIconSize(QSize(512, 512))
-        
-        # Add person title
-        title_item = QListWidgetItem(f"Person: {person_name}")
-        font = title_item.font()
-        font.setBold(True)
-        title_item.setFont(font)
-        self.people_list.addItem(title_item)
-        
-        # Get images for this person
-        images = self.parent.db_manager.get_images_by_person(person_name)
+        self.person_name = person_name
+        self.show_header(f"Person: {person_name}")
         
-        # Add images
-        for image in images:
-            item = QListWidgetItem()
-            # item.setText(os.path.basename(image.file_path))
-            item.setData(Qt.UserRole, image.file_path)
-            
-            # Try to create thumbnail
-            try:
-                pixmap = QPixmap(image.file_path)
-                if not pixmap.isNull():
-                    pixmap = pixmap.scaled(QSize(200, 200), Qt.KeepAspectRatio, Qt.SmoothTransformation)
-                    item.setIcon(QIcon(pixmap))
-                    item.setSizeHint(QSize(180, 180))
-            except:
-                item.setIcon(QIcon.fromTheme("image-x-generic"))
-                
-            self.people_list.addItem(item)
\ No newline at end of file
+        # Images are read from the database a page at a time as the list is scrolled
+        self.thumbnails.set_model(ImagePageModel(self.parent.db_manager, self.thumbnails, self.ROW_SIZE,
+                                                 person_name=person_name))
\ No newline at end of file
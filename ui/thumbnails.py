@@ -0,0 +1,143 @@
+from collections import OrderedDict
+from PyQt5.QtCore import QObject, QTimer, Qt, pyqtSignal
+from PyQt5.QtGui import QPixmap, QImage, QIcon
+from utils.library_scanner import FileFingerprint
+
+
+def image_fingerprint(image):
+    """Fingerprint stored with an Image row, saves a stat call per thumbnail"""
+    return FileFingerprint(image.file_size, image.file_mtime, image.file_inode or 0)
+
+
+class ThumbnailLoader(QObject):
+    """
+    Loads the thumbnails of a list view's rows in the background.
+
+    The model asks for a row's icon while the view paints it and gets a
+    placeholder until the thumbnail is ready. Thumbnails are loaded on a
+    thread pool, at most max_running at a time for this view. Queued rows
+    that are scrolled out of view before their turn are dropped; painting
+    them again asks for them again. Icons of the last max_icons rows are
+    kept, the rest are loaded again from the thumbnail cache.
+    """
+    # (generation, row, QImage or None), emitted from the pool threads
+    loaded = pyqtSignal(int, int, object)
+
+    def __init__(self, cache, pool, view, size, max_running=4, max_icons=1000):
+        """
+        Args:
+            cache: ThumbnailCache
+            pool: Executor running the loads, may be shared between views
+            view: QListView showing the model
+            size: One of the cache SIZES
+            max_running: Loads of this view submitted to the pool at once
+            max_icons: Number of loaded icons kept in memory
+        """
+        super().__init__(view)
+        self.cache = cache
+        self.pool = pool
+        self.view = view
+        self.size = size
+        self.max_running = max_running
+        self.max_icons = max_icons
+        self.placeholder = QIcon.fromTheme("image-x-generic")
+
+        self._generation = 0
+        self._icons = OrderedDict()    # row -> QIcon, least recently used first
+        self._pending = OrderedDict()  # row -> (file path, fingerprint, face), in request order
+        self._running = {}             # row -> Future
+
+        # Batches the requests of one paint into one scheduling pass
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._pump)
+
+        self.loaded.connect(self._on_loaded)
+        view.verticalScrollBar().valueChanged.connect(self._schedule)
+
+    def set_model(self, model):
+        """Show a model in the view, its rows are new so all icons are dropped"""
+        self.clear()
+        self.view.setModel(model)
+        model.modelReset.connect(self.clear)
+
+    def icon(self, row, file_path, fingerprint=None, face=None):
+        """
+        Get the icon of a row, called by the model.
+
+        Args:
+            row: Row in the view's model
+            file_path: Original image
+            fingerprint: Size and modification time of the file if known
+            face: Optional (face id, facial area) to show that face's
+                thumbnail instead of the whole image
+
+        Returns:
+            QIcon, the placeholder while the thumbnail is loading
+        """
+        icon = self._icons.get(row)
+        if icon is not None:
+            self._icons.move_to_end(row)
+            return icon
+        if row not in self._running:
+            self._pending[row] = (file_path, fingerprint, face)
+            self._schedule()
+        return self.placeholder
+
+    def _schedule(self, *args):
+        # QTimer.start(int) would take a scroll position as its interval
+        self._timer.start()
+
+    def clear(self):
+        """Drop all icons and queued loads, results of running ones are ignored"""
+        self._generation += 1
+        self._icons.clear()
+        self._pending.clear()
+        for future in self._running.values():
+            future.cancel()
+        self._running.clear()
+
+    def _is_visible(self, model, row, viewport):
+        rect = self.view.visualRect(model.index(row, 0))
+        return rect.isValid() and rect.intersects(viewport)
+
+    def _pump(self):
+        model = self.view.model()
+        if not self._pending or model is None:
+            return
+        viewport = self.view.viewport().rect()
+        for row in [row for row in self._pending if not self._is_visible(model, row, viewport)]:
+            del self._pending[row]
+        while self._pending and len(self._running) < self.max_running:
+            row, request = self._pending.popitem(last=False)
+            self._running[row] = self.pool.submit(self._load, self._generation, row, *request)
+
+    def _load(self, generation, row, file_path, fingerprint, face):
+        """Runs on a pool thread, QImage unlike QPixmap may be used off the GUI thread"""
+        image = None
+        try:
+            if face is not None:
+                data = self.cache.get_face(*face, file_path)
+            else:
+                data = self.cache.get(file_path, self.size, fingerprint)
+            if data:
+                image = QImage()
+                if not image.loadFromData(data):
+                    image = None
+        finally:
+            self.loaded.emit(generation, row, image)
+
+    def _on_loaded(self, generation, row, image):
+        if generation != self._generation:
+            return
+        self._running.pop(row, None)
+        # Failed rows keep the placeholder instead of being retried on every paint
+        self._icons[row] = QIcon(QPixmap.fromImage(image)) if image is not None else self.placeholder
+        while len(self._icons) > self.max_icons:
+            self._icons.popitem(last=False)
+        model = self.view.model()
+        if model is not None and row < model.rowCount():
+            index = model.index(row, 0)
+            model.dataChanged.emit(index, index, [Qt.DecorationRole])
+        self._pump()
@@ -0,0 +1,111 @@
+from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+from utils.jobs import JobControl
+
+
+class JobWorker(QObject):
+    """Runs a job function on a background thread and reports back through signals"""
+    progress = pyqtSignal(object)   # JobProgress
+    finished = pyqtSignal(object)   # Return value of the job
+    failed = pyqtSignal(str)
+
+    def __init__(self, job):
+        """
+        Args:
+            job: Callable taking a JobControl and returning the job result
+        """
+        super().__init__()
+        self.job = job
+        # The callback runs on the worker thread, the signal hands it to the GUI thread
+        self.control = JobControl(progress_callback=self.progress.emit)
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.control.start()
+            result = self.job(self.control)
+            self.finished.emit(result)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class JobRunner(QObject):
+    """Starts jobs on their own QThread and keeps them alive until they finish"""
+    started = pyqtSignal(str)
+    stopped = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.thread = None
+        self.worker = None
+        self.name = None
+
+    @property
+    def is_running(self):
+        return self.thread is not None
+
+    def start(self, name, job, on_progress=None, on_finished=None, on_failed=None):
+        """
+        Run a job in the background.
+
+        Args:
+            name: Short job name shown in the UI
+            job: Callable taking a JobControl and returning the job result
+            on_progress: Slot receiving JobProgress reports
+            on_finished: Slot receiving the job result
+            on_failed: Slot receiving an error message
+
+        Returns:
+            False if another job is still running
+        """
+        if self.is_running:
+            return False
+
+        self.name = name
+        self.thread = QThread(self)
+        self.worker = JobWorker(job)
+        self.worker.moveToThread(self.thread)
+
+        self.thread.started.connect(self.worker.run)
+        if on_progress:
+            self.worker.progress.connect(on_progress)
+        if on_finished:
+            self.worker.finished.connect(on_finished)
+        if on_failed:
+            self.worker.failed.connect(on_failed)
+        self.worker.finished.connect(self.thread.quit)
+        self.worker.failed.connect(self.thread.quit)
+        self.thread.finished.connect(self._cleanup)
+
+        self.thread.start()
+        self.started.emit(name)
+        return True
+
+    def cancel(self):
+        if self.worker:
+            self.worker.control.cancel()
+
+    def toggle_pause(self):
+        """Pause or resume the running job, returns True if it is now paused"""
+        if not self.worker:
+            return False
+        control = self.worker.control
+        if control.is_paused:
+            control.resume()
+        else:
+            control.pause()
+        return control.is_paused
+
+    def wait(self):
+        """Cancel the running job and block until its thread has stopped"""
+        if self.thread:
+            self.cancel()
+            self.thread.wait()
+
+    def _cleanup(self):
+        name = self.name
+        self.worker.deleteLater()
+        self.thread.deleteLater()
+        self.worker = None
+        self.thread = None
+        self.name = None
+        self.stopped.emit(name)
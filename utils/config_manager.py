@@ -27,6 +27,52 @@ class ConfigManager:
             'Password': 'password'
         }
         
+        self.config['SQLITE'] = {
+            'JournalMode': 'wal',
+            'Synchronous': 'normal',
+            'MmapSizeMB': '256',
+            'CacheSizeMB': '64',
+            'BusyTimeout': '5.0'
+        }
+        
+        self.config['FACE_RECOGNITION'] = {
+            'IndexMode': 'auto',
+            'IndexMinFaces': '100000',
+            'IndexProbes': '8',
+            'EmbeddingDtype': 'float32',
+            'PipelineMode': 'single_pass',
+            'EmbedBatchSize': '32',
+            'EmbedBatchTimeout': '0.5',
+            'Workers': '0',
+            'WriteBatchSize': '50',
+            'WriteBatchDelay': '2.0',
+            'DecodeMinSide': '1024',
+            'ClusterNeighbours': '10',
+            'ClusterExactMaxFaces': '20000'
+        }
+        
+        self.config['LIBRARY'] = {
+            'MetadataWorkers': '8',
+            'ThumbnailWorkers': '4',
+            'IngestBufferMB': '256',
+            'DecodedBufferMB': '256'
+        }
+        
+        self.config['WATCH'] = {
+            'Backend': 'auto',
+            'SettleTime': '2.0',
+            'PollInterval': '10.0'
+        }
+        
+        self.config['THUMBNAILS'] = {
+            'Folder': '.thumbnails',
+            'MemoryBudgetMB': '64',
+            'DiskBudgetMB': '1024',
+            'Format': 'jpeg',
+            'Quality': '80',
+            'LoaderWorkers': '4'
+        }
+        
         # Save the default config
         self.save_config()
     
@@ -35,6 +81,68 @@ class ConfigManager:
         with open(self.config_file, 'w') as f:
             self.config.write(f)
     
+    def get_sqlite_settings(self):
+        """Get the SQLite engine profile with defaults for older config files"""
+        return {
+            'journal_mode': self.config.get('SQLITE', 'JournalMode', fallback='wal').lower(),
+            'synchronous': self.config.get('SQLITE', 'Synchronous', fallback='normal').lower(),
+            'mmap_size': self.config.getint('SQLITE', 'MmapSizeMB', fallback=256) * 1024 * 1024,
+            'cache_size': self.config.getint('SQLITE', 'CacheSizeMB', fallback=64) * 1024 * 1024,
+            'busy_timeout': self.config.getfloat('SQLITE', 'BusyTimeout', fallback=5.0)
+        }
+    
+    def get_face_recognition_settings(self):
+        """Get face recognition settings with defaults for older config files"""
+        return {
+            'index_mode': self.config.get('FACE_RECOGNITION', 'IndexMode', fallback='auto').lower(),
+            'index_min_faces': self.config.getint('FACE_RECOGNITION', 'IndexMinFaces', fallback=100000),
+            'index_probes': self.config.getint('FACE_RECOGNITION', 'IndexProbes', fallback=8),
+            'pipeline_mode': self.config.get('FACE_RECOGNITION', 'PipelineMode', fallback='single_pass').lower(),
+            'embed_batch_size': self.config.getint('FACE_RECOGNITION', 'EmbedBatchSize', fallback=32),
+            'embed_batch_timeout': self.config.getfloat('FACE_RECOGNITION', 'EmbedBatchTimeout', fallback=0.5),
+            'workers': self.config.getint('FACE_RECOGNITION', 'Workers', fallback=0),
+            'write_batch_size': self.config.getint('FACE_RECOGNITION', 'WriteBatchSize', fallback=50),
+            'write_batch_delay': self.config.getfloat('FACE_RECOGNITION', 'WriteBatchDelay', fallback=2.0),
+            'decode_min_side': self.config.getint('FACE_RECOGNITION', 'DecodeMinSide', fallback=1024),
+            'cluster_neighbours': self.config.getint('FACE_RECOGNITION', 'ClusterNeighbours', fallback=10),
+            'cluster_exact_max_faces': self.config.getint('FACE_RECOGNITION', 'ClusterExactMaxFaces', fallback=20000)
+        }
+    
+    def get_library_settings(self):
+        """Get library scanning settings with defaults for older config files"""
+        return {
+            'metadata_workers': self.config.getint('LIBRARY', 'MetadataWorkers', fallback=8),
+            'thumbnail_workers': self.config.getint('LIBRARY', 'ThumbnailWorkers', fallback=4),
+            'ingest_buffer': self.config.getint('LIBRARY', 'IngestBufferMB', fallback=256) * 1024 * 1024,
+            'decoded_buffer': self.config.getint('LIBRARY', 'DecodedBufferMB', fallback=256) * 1024 * 1024
+        }
+    
+    def get_watch_settings(self):
+        """Get folder watching settings with defaults for older config files"""
+        return {
+            'backend': self.config.get('WATCH', 'Backend', fallback='auto').lower(),
+            'settle_time': self.config.getfloat('WATCH', 'SettleTime', fallback=2.0),
+            'poll_interval': self.config.getfloat('WATCH', 'PollInterval', fallback=10.0)
+        }
+    
+    def get_thumbnail_settings(self):
+        """Get thumbnail cache settings with defaults for older config files"""
+        return {
+            'folder': self.config.get('THUMBNAILS', 'Folder', fallback='.thumbnails'),
+            'memory_budget': self.config.getint('THUMBNAILS', 'MemoryBudgetMB', fallback=64) * 1024 * 1024,
+            'disk_budget': self.config.getint('THUMBNAILS', 'DiskBudgetMB', fallback=1024) * 1024 * 1024,
+            'image_format': self.config.get('THUMBNAILS', 'Format', fallback='jpeg').lower(),
+            'quality': self.config.getint('THUMBNAILS', 'Quality', fallback=80)
+        }
+    
+    def get_thumbnail_loader_workers(self):
+        """Get the number of threads loading thumbnails for the list views"""
+        return self.config.getint('THUMBNAILS', 'LoaderWorkers', fallback=4)
+    
+    def get_embedding_dtype(self):
+        """Get the storage dtype of face embeddings ('float32' or 'float16')"""
+        return self.config.get('FACE_RECOGNITION', 'EmbeddingDtype', fallback='float32').lower()
+    
     def get_database_url(self):
         """Generate database URL based on configuration"""
         db_type = self.config.get('DATABASE', 'Type', fallback='sqlite')
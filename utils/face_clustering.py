@@ -0,0 +1,260 @@
+import logging
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from utils.face_gallery import FaceGallery
+from utils.face_index import IVFFaceIndex
+
+logger = logging.getLogger('FaceClustering')
+
+# Prefix of the names given to persons found by face processing
+UNKNOWN_PREFIX = 'Unknown_'
+
+
+class FaceClusterer:
+    """
+    Offline grouping of the faces of unnamed persons.
+
+    Face processing names a new person after the first face it cannot match,
+    so one person often ends up split over many Unknown_ persons depending
+    on the order images were processed in. The clusterer looks at all
+    unnamed faces at once: it builds a kNN graph of faces closer than the
+    threshold and groups it with Chinese Whispers. Each unnamed person then
+    joins the group most of their faces are in, and the persons of a group
+    are merged into the one with the most faces, whose name stays.
+
+    The graph is built in blocks of at most BLOCK_ELEMENTS distances. Small
+    sets compare every face with every other, large ones only compare faces
+    within neighbouring partitions of an IVF index, so the time and memory
+    stay bounded for millions of faces.
+
+    An incremental run only lets faces added since the last run change
+    groups. The faces clustered before keep their person, so new faces join
+    an existing person or form new groups among themselves.
+    """
+
+    # Entries of one block of the distance matrix, 64 MB of float32
+    BLOCK_ELEMENTS = 1 << 24
+    # Share of the nodes updated together in one Chinese Whispers step
+    WHISPER_BATCHES = 8
+
+    def __init__(self, gallery: FaceGallery, threshold: float = 0.6, neighbours: int = 10,
+                 exact_max_faces: int = 20000, face_index: Optional[IVFFaceIndex] = None,
+                 n_probe: int = 8, iterations: int = 20, seed: int = 0):
+        """
+        Initialize a clusterer.
+
+        Args:
+            gallery: Gallery holding the faces and their person names
+            threshold: Largest embedding distance of two faces of one person
+            neighbours: Nearest faces linked to every face in the graph
+            exact_max_faces: Unnamed faces up to which every pair is compared
+            face_index: Trained index over the gallery used for larger sets,
+                one is trained on the unnamed faces if None
+            n_probe: Index partitions compared with each partition
+            iterations: Maximum number of Chinese Whispers rounds
+            seed: Random seed of the update order
+        """
+        self.gallery = gallery
+        self.threshold = threshold
+        self.neighbours = max(1, neighbours)
+        self.exact_max_faces = exact_max_faces
+        self.face_index = face_index
+        self.n_probe = n_probe
+        self.iterations = iterations
+        self.seed = seed
+
+    def unknown_rows(self) -> np.ndarray:
+        """Gallery rows of the stored faces of unnamed persons"""
+        names, _ = self.gallery.label_table()
+        unknown = np.array([name.startswith(UNKNOWN_PREFIX) for name in names] + [False], dtype=bool)
+        labels = self.gallery.labels
+        # Removed rows have label -1, which picks the trailing False
+        return np.flatnonzero(unknown[labels] & (self.gallery.face_ids >= 0))
+
+    def _blocks(self, rows: np.ndarray):
+        """Yield (query rows, candidate rows) blocks covering the neighbourhoods of all rows"""
+        if len(rows) <= self.exact_max_faces:
+            yield rows, rows
+            return
+        index = self.face_index
+        if index is None:
+            index = IVFFaceIndex(self.gallery, n_probe=self.n_probe)
+            index.train(rows=rows)
+        members = np.zeros(len(self.gallery), dtype=bool)
+        members[rows] = True
+        for partition, neighbourhood in index.partitions(self.n_probe):
+            yield partition[members[partition]], neighbourhood[members[neighbourhood]]
+
+    def build_graph(self, rows: np.ndarray, free: np.ndarray, progress: Optional[Callable[[int], bool]] = None
+                    ) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Link faces to their nearest faces within the threshold.
+
+        Args:
+            rows: Sorted gallery rows of the faces to cluster
+            free: Mask over rows of the faces whose neighbours are searched
+            progress: Called with the number of faces searched so far,
+                returns False to stop
+
+        Returns:
+            Tuple of (sources, targets, weights) with positions in rows; both
+            directions of every link are included, weights are in (0, 1].
+            None if progress stopped the search
+        """
+        # Positions in rows, 12 bytes per link with the weight
+        position = np.full(len(self.gallery), -1, dtype=np.int32)
+        position[rows] = np.arange(len(rows), dtype=np.int32)
+        embeddings = self.gallery.embeddings
+        sq_norms = self.gallery.squared_norms
+        threshold_sq = self.threshold ** 2
+        sources, targets, distances = [], [], []
+        searched = 0
+
+        for queries, candidates in self._blocks(rows):
+            queries = queries[free[position[queries]]]
+            if queries.size == 0 or candidates.size < 2:
+                continue
+            candidate_vectors = embeddings[candidates]
+            candidate_sq = sq_norms[candidates]
+            k = min(self.neighbours, candidates.size - 1)
+            step = max(1, self.BLOCK_ELEMENTS // candidates.size)
+            for start in range(0, queries.size, step):
+                block = queries[start:start + step]
+                vectors = embeddings[block]
+                sq = vectors @ candidate_vectors.T
+                sq *= -2.0
+                sq += candidate_sq[None, :]
+                sq += np.einsum('ij,ij->i', vectors, vectors)[:, None]
+                # A face is not its own neighbour
+                sq[block[:, None] == candidates[None, :]] = np.inf
+                nearest = np.argpartition(sq, k - 1, axis=1)[:, :k]
+                nearest_sq = np.take_along_axis(sq, nearest, axis=1)
+                linked = nearest_sq < threshold_sq
+                sources.append(position[np.repeat(block, k).reshape(-1, k)[linked]])
+                targets.append(position[candidates[nearest[linked]]])
+                distances.append(np.sqrt(np.maximum(nearest_sq[linked], 0.0)))
+                searched += block.size
+                if progress and not progress(searched):
+                    return None
+
+        if not sources:
+            empty = np.empty(0, dtype=np.int32)
+            return empty, empty, np.empty(0, dtype=np.float32)
+        sources, targets = np.concatenate(sources), np.concatenate(targets)
+        weights = (1.0 - np.concatenate(distances) / self.threshold).astype(np.float32)
+        # Links found from both ends count twice, which favours mutual neighbours
+        return np.concatenate([sources, targets]), np.concatenate([targets, sources]), np.concatenate([weights, weights])
+
+    def chinese_whispers(self, labels: np.ndarray, free: np.ndarray, sources: np.ndarray,
+                         targets: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """
+        Propagate labels over the graph until they settle.
+
+        Every free node takes the label with the largest summed link weight
+        among its neighbours. Nodes are visited in a seeded random order and
+        updated WHISPER_BATCHES batches per round, each batch at once, so the
+        result is the same on every run. Ties go to the smaller label.
+
+        Args:
+            labels: Initial label of every node, changed in place
+            free: Mask of the nodes that may change label
+            sources, targets, weights: Links from build_graph
+
+        Returns:
+            The labels
+        """
+        rng = np.random.default_rng(self.seed)
+        nodes = np.unique(sources[free[sources]])
+        if nodes.size == 0:
+            return labels
+        label_count = int(labels.max()) + 1 if labels.size else 0
+        in_batch = np.zeros(len(labels), dtype=bool)
+
+        for iteration in range(self.iterations):
+            order = rng.permutation(nodes)
+            changed = 0
+            for batch in np.array_split(order, min(self.WHISPER_BATCHES, max(1, order.size))):
+                in_batch[batch] = True
+                links = in_batch[sources]
+                in_batch[batch] = False
+                node, label = sources[links], labels[targets[links]]
+                keys, inverse = np.unique(node.astype(np.int64) * label_count + label, return_inverse=True)
+                scores = np.bincount(inverse, weights=weights[links])
+                key_nodes, key_labels = keys // label_count, keys % label_count
+                # Best score first within every node, then the smaller label
+                ranked = np.lexsort((key_labels, -scores, key_nodes))
+                first = ranked[np.r_[True, key_nodes[ranked[1:]] != key_nodes[ranked[:-1]]]]
+                winners, best = key_nodes[first], key_labels[first]
+                changed += int(np.count_nonzero(labels[winners] != best))
+                labels[winners] = best
+            logger.info(f"Chinese Whispers round {iteration + 1}: {changed} of {nodes.size} faces changed group")
+            if changed == 0:
+                break
+        return labels
+
+    def cluster(self, after_face_id: int = 0,
+                progress: Optional[Callable[[int, int], bool]] = None) -> Dict[str, str]:
+        """
+        Group the unnamed faces and decide which persons to merge.
+
+        Args:
+            after_face_id: Only faces with a larger Face id may change group,
+                0 to cluster every unnamed face
+            progress: Called with (faces searched, faces to search) while the
+                graph is built, returns False to stop
+
+        Returns:
+            Dict mapping the names of persons to merge to the names they are
+            merged into, empty if progress stopped the run
+        """
+        rows = self.unknown_rows()
+        if rows.size == 0:
+            return {}
+        free = self.gallery.face_ids[rows] > after_face_id
+        total = int(np.count_nonzero(free))
+        if total == 0:
+            return {}
+        logger.info(f"Clustering {total} of {rows.size} unnamed faces")
+        graph = self.build_graph(rows, free, (lambda searched: progress(searched, total)) if progress else None)
+        if graph is None:
+            return {}
+        sources, targets, weights = graph
+
+        person_codes = self.gallery.labels[rows].astype(np.int64)
+        # Free faces start alone, the others are settled on their person's group
+        labels = np.where(free, np.arange(rows.size), rows.size + person_codes)
+        labels = self.chinese_whispers(labels, free, sources, targets, weights)
+        return self._merges(rows, free, person_codes, labels)
+
+    def _merges(self, rows: np.ndarray, free: np.ndarray, person_codes: np.ndarray,
+                labels: np.ndarray) -> Dict[str, str]:
+        """Merge every person whose faces are all free into the group most of their faces are in"""
+        counts = np.bincount(person_codes)
+        # A person with settled faces stays, so it is never both merged and merged into
+        candidates = np.setdiff1d(person_codes[free], person_codes[~free])
+        if candidates.size == 0:
+            return {}
+        considered = np.isin(person_codes, candidates)
+        # Faces per (person, group), the most common group of each person wins
+        keys, votes = np.unique(np.stack([person_codes[considered], labels[considered]]), axis=1,
+                                return_counts=True)
+        ranked = np.lexsort((keys[1], -votes, keys[0]))
+        first = ranked[np.r_[True, keys[0][ranked[1:]] != keys[0][ranked[:-1]]]]
+        groups: Dict[int, list] = {}
+        for code, label in zip(keys[0][first].tolist(), keys[1][first].tolist()):
+            groups.setdefault(label, []).append(code)
+
+        merges = {}
+        for label, codes in groups.items():
+            if label >= rows.size:
+                # The group of a person clustered before keeps that person
+                target = label - rows.size
+            else:
+                target = max(codes, key=lambda code: (counts[code], -code))
+            target_name = self.gallery.label_name(target)
+            for code in codes:
+                if code != target:
+                    merges[self.gallery.label_name(code)] = target_name
+        return merges
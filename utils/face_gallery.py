@@ -0,0 +1,366 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger('FaceGallery')
+
+
+class FaceGallery:
+    """
+    In-memory store of known face embeddings.
+
+    All embeddings live in one contiguous float32 matrix with parallel arrays
+    for the label code and the database Face id of every row, so matching a
+    whole image against the gallery is a single matrix product instead of a
+    Python loop over every stored face.
+    """
+
+    # Number of gallery rows scored per block in match(), keeps the temporary
+    # distance matrix small for very large galleries
+    MATCH_BLOCK_ROWS = 65536
+
+    def __init__(self, dim: Optional[int] = None, initial_capacity: int = 1024,
+                 allocator: Optional[Callable[[int, int], Tuple[np.ndarray, ...]]] = None):
+        """
+        Initialize an empty gallery.
+
+        Args:
+            dim: Embedding dimension, inferred from the first added face if None
+            initial_capacity: Number of rows to preallocate
+            allocator: Optional callable (capacity, dim) returning empty
+                (embeddings, sq_norms, labels, face_ids) arrays, used to place
+                the backing storage somewhere other than the heap
+        """
+        self.dim = dim
+        self._allocator = allocator
+        self._capacity = 0
+        self._size = 0
+        self._initial_capacity = max(1, initial_capacity)
+        self._embeddings = np.empty((0, dim or 0), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._labels = np.empty(0, dtype=np.int32)
+        self._face_ids = np.empty(0, dtype=np.int64)
+        self._label_names: List[str] = []
+        self._label_codes: Dict[str, int] = {}
+
+    @classmethod
+    def from_arrays(cls, embeddings: np.ndarray, sq_norms: np.ndarray, labels: np.ndarray,
+                    face_ids: np.ndarray, size: int, label_names: List[str], label_codes: Dict[str, int],
+                    allocator: Optional[Callable[[int, int], Tuple[np.ndarray, ...]]] = None) -> 'FaceGallery':
+        """
+        Adopt existing backing arrays, e.g. memory-mapped files, without copying.
+
+        Args:
+            embeddings: (capacity, dim) float32 array whose first `size` rows are used
+            sq_norms: (capacity,) float32 squared norms
+            labels: (capacity,) int32 label codes
+            face_ids: (capacity,) int64 Face ids
+            size: Number of rows in use
+            label_names: Label name of every code
+            label_codes: Mapping of live label names to codes
+            allocator: Allocator used when the gallery outgrows the arrays
+
+        Returns:
+            A gallery backed by the given arrays
+        """
+        gallery = cls(dim=embeddings.shape[1], allocator=allocator)
+        gallery._embeddings = embeddings
+        gallery._sq_norms = sq_norms
+        gallery._labels = labels
+        gallery._face_ids = face_ids
+        gallery._capacity = embeddings.shape[0]
+        gallery._size = size
+        gallery._label_names = list(label_names)
+        gallery._label_codes = dict(label_codes)
+        return gallery
+
+    def label_table(self) -> Tuple[List[str], Dict[str, int]]:
+        """Return copies of the code-to-name list and the live name-to-code mapping"""
+        return list(self._label_names), dict(self._label_codes)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, label: str) -> bool:
+        return label in self._label_codes
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """View of the (n, dim) embedding matrix"""
+        return self._embeddings[:self._size]
+
+    @property
+    def labels(self) -> np.ndarray:
+        """View of the per-row label codes"""
+        return self._labels[:self._size]
+
+    @property
+    def face_ids(self) -> np.ndarray:
+        """View of the per-row Face ids (-1 for faces not stored in the database)"""
+        return self._face_ids[:self._size]
+
+    @property
+    def squared_norms(self) -> np.ndarray:
+        """View of the cached squared norm of every row (inf for removed rows)"""
+        return self._sq_norms[:self._size]
+
+    def alive_rows(self) -> np.ndarray:
+        """Return the indices of rows that have not been removed"""
+        return np.flatnonzero(self.labels >= 0)
+
+    def label_name(self, code: int) -> str:
+        """Return the label name for a label code"""
+        return self._label_names[code]
+
+    def label_of(self, row: int) -> str:
+        """Return the label name of a gallery row"""
+        return self._label_names[self._labels[row]]
+
+    def label_names(self) -> List[str]:
+        """Return the names of all labels currently in use"""
+        return list(self._label_codes)
+
+    def person_count(self) -> int:
+        """Return the number of distinct labels in the gallery"""
+        labels = self.labels
+        return int(np.unique(labels[labels >= 0]).size)
+
+    def _code_for(self, label: str) -> int:
+        code = self._label_codes.get(label)
+        if code is None:
+            code = len(self._label_names)
+            self._label_names.append(label)
+            self._label_codes[label] = code
+        return code
+
+    def attach_storage(self, allocator: Callable[[int, int], Tuple[np.ndarray, ...]]) -> None:
+        """
+        Move the gallery into arrays provided by an allocator.
+
+        Args:
+            allocator: Callable (capacity, dim) returning empty
+                (embeddings, sq_norms, labels, face_ids) arrays
+        """
+        self._allocator = allocator
+        self._resize(max(self._initial_capacity, 2 * self._size))
+
+    def flush(self) -> None:
+        """Write back backing arrays that are memory-mapped files"""
+        for array in (self._embeddings, self._sq_norms, self._labels, self._face_ids):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def _reserve(self, extra: int) -> None:
+        """Grow the backing arrays geometrically so appends are amortized O(1)"""
+        required = self._size + extra
+        if required <= self._capacity:
+            return
+
+        capacity = max(self._capacity, self._initial_capacity)
+        while capacity < required:
+            capacity *= 2
+        self._resize(capacity)
+
+    def _resize(self, capacity: int) -> None:
+        if self._allocator is not None:
+            embeddings, sq_norms, labels, face_ids = self._allocator(capacity, self.dim)
+        else:
+            embeddings = np.empty((capacity, self.dim), dtype=np.float32)
+            sq_norms = np.empty(capacity, dtype=np.float32)
+            labels = np.empty(capacity, dtype=np.int32)
+            face_ids = np.empty(capacity, dtype=np.int64)
+        embeddings[:self._size] = self._embeddings[:self._size]
+        sq_norms[:self._size] = self._sq_norms[:self._size]
+        labels[:self._size] = self._labels[:self._size]
+        face_ids[:self._size] = self._face_ids[:self._size]
+
+        self._embeddings = embeddings
+        self._sq_norms = sq_norms
+        self._labels = labels
+        self._face_ids = face_ids
+        self._capacity = capacity
+
+    def _as_matrix(self, encodings) -> np.ndarray:
+        matrix = np.asarray(encodings, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix.reshape(1, -1)
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+            self._embeddings = np.empty((0, self.dim), dtype=np.float32)
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"Expected embeddings of dimension {self.dim}, got {matrix.shape[1]}")
+        return matrix
+
+    def add(self, encoding: np.ndarray, label: str, face_id: int = -1) -> int:
+        """
+        Append a single face to the gallery.
+
+        Args:
+            encoding: Face embedding
+            label: Person name
+            face_id: Database id of the Face row, -1 if not stored
+
+        Returns:
+            Row index of the new face
+        """
+        return int(self.add_many(encoding, [label], [face_id])[0])
+
+    def add_many(self, encodings, labels: Sequence[str],
+                 face_ids: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Append several faces to the gallery.
+
+        Args:
+            encodings: Array-like of shape (n, dim)
+            labels: Person name for each face
+            face_ids: Database Face id for each face, -1 if not stored
+
+        Returns:
+            Array of the new row indices
+        """
+        matrix = self._as_matrix(encodings)
+        count = matrix.shape[0]
+        if len(labels) != count:
+            raise ValueError("Number of labels does not match number of embeddings")
+
+        self._reserve(count)
+        start, end = self._size, self._size + count
+        self._embeddings[start:end] = matrix
+        self._sq_norms[start:end] = np.einsum('ij,ij->i', matrix, matrix)
+        self._labels[start:end] = [self._code_for(label) for label in labels]
+        self._face_ids[start:end] = -1 if face_ids is None else face_ids
+        self._size = end
+        return np.arange(start, end)
+
+    def set_face_ids(self, rows: Iterable[int], face_ids: Iterable[int]) -> None:
+        """Record the database Face ids of rows that were added before being stored"""
+        self._face_ids[np.asarray(list(rows), dtype=np.int64)] = list(face_ids)
+
+    def remove_face_ids(self, face_ids: Iterable[int]) -> np.ndarray:
+        """
+        Remove the rows of the given database faces.
+
+        Rows are tombstoned rather than compacted so row indices held by an
+        index stay valid; a removed row has no label and an infinite norm, so
+        it can never be the closest match.
+
+        Args:
+            face_ids: Database Face ids to remove
+
+        Returns:
+            Array of the removed row indices
+        """
+        face_ids = np.asarray(list(face_ids), dtype=np.int64)
+        mask = np.isin(self.face_ids, face_ids) & (self.labels >= 0)
+        rows = np.flatnonzero(mask)
+        self.remove_rows(rows)
+        return rows
+
+    def remove_rows(self, rows: Iterable[int]) -> None:
+        """Tombstone rows directly, e.g. faces whose database write failed"""
+        rows = np.asarray(list(rows), dtype=np.int64)
+        self._labels[rows] = -1
+        self._sq_norms[rows] = np.inf
+
+    def match(self, queries) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the closest gallery face for each query embedding.
+
+        Distances are euclidean and computed for all queries at once using
+        ||q - g||^2 = ||q||^2 + ||g||^2 - 2 q.g over blocks of gallery rows.
+
+        Args:
+            queries: Array-like of shape (m, dim)
+
+        Returns:
+            Tuple of (best_rows, best_distances); rows are -1 and distances inf
+            when the gallery is empty
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        count = queries.shape[0]
+        best_rows = np.full(count, -1, dtype=np.int64)
+        best_sq = np.full(count, np.inf, dtype=np.float32)
+
+        if self._size == 0 or count == 0:
+            return best_rows, np.sqrt(best_sq)
+        if queries.shape[1] != self.dim:
+            logger.warning(f"Query dimension {queries.shape[1]} does not match gallery dimension {self.dim}")
+            return best_rows, np.sqrt(best_sq)
+
+        query_sq = np.einsum('ij,ij->i', queries, queries)
+        for start in range(0, self._size, self.MATCH_BLOCK_ROWS):
+            end = min(self._size, start + self.MATCH_BLOCK_ROWS)
+            sq = self.squared_distances(queries, start, end, query_sq)
+            block_best = np.argmin(sq, axis=1)
+            block_sq = sq[np.arange(count), block_best]
+            better = block_sq < best_sq
+            best_sq[better] = block_sq[better]
+            best_rows[better] = block_best[better] + start
+
+        return best_rows, np.sqrt(np.maximum(best_sq, 0.0))
+
+    def squared_distances(self, queries: np.ndarray, start: int = 0, end: Optional[int] = None,
+                          query_sq: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return the (m, end - start) matrix of squared distances to a block of rows"""
+        end = self._size if end is None else end
+        if query_sq is None:
+            query_sq = np.einsum('ij,ij->i', queries, queries)
+        sq = self._embeddings[start:end] @ queries.T
+        sq *= -2.0
+        sq += self._sq_norms[start:end, None]
+        sq += query_sq[None, :]
+        return sq.T
+
+    def merge_labels(self, merges: Dict[str, str]) -> int:
+        """
+        Merge several labels into others with one pass over the rows.
+
+        Args:
+            merges: Mapping of label to the label it is merged into; targets
+                must not be merged themselves
+
+        Returns:
+            Number of gallery rows affected
+        """
+        codes = np.arange(len(self._label_names), dtype=np.int32)
+        for old_label, new_label in merges.items():
+            old_code = self._label_codes.get(old_label)
+            if old_code is None or old_label == new_label:
+                continue
+            codes[old_code] = self._code_for(new_label)
+            del self._label_codes[old_label]
+        labels = self.labels
+        alive = labels >= 0
+        merged = alive & (codes[np.where(alive, labels, 0)] != labels)
+        labels[merged] = codes[labels[merged]]
+        return int(np.count_nonzero(merged))
+
+    def rename_label(self, old_label: str, new_label: str) -> int:
+        """
+        Rename a label, merging it into new_label if that label already exists.
+
+        Args:
+            old_label: Current person name
+            new_label: New person name
+
+        Returns:
+            Number of gallery rows affected
+        """
+        old_code = self._label_codes.get(old_label)
+        if old_code is None or old_label == new_label:
+            return 0
+
+        new_code = self._label_codes.get(new_label)
+        if new_code is None:
+            # Plain rename only touches the label table
+            self._label_names[old_code] = new_label
+            self._label_codes[new_label] = self._label_codes.pop(old_label)
+            return int(np.count_nonzero(self.labels == old_code))
+
+        mask = self.labels == old_code
+        self.labels[mask] = new_code
+        del self._label_codes[old_label]
+        return int(np.count_nonzero(mask))
@@ -0,0 +1,304 @@
+import os
+import logging
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils.face_gallery import FaceGallery
+
+logger = logging.getLogger('FaceIndex')
+
+
+class IVFFaceIndex:
+    """
+    Inverted-file approximate nearest neighbour index over a FaceGallery.
+
+    Gallery rows are partitioned by a k-means coarse quantizer. A query only
+    scores the rows of its n_probe closest partitions, so matching cost grows
+    with roughly sqrt(n) instead of n. The index stores row numbers only; the
+    embeddings and labels stay in the gallery, so renames and merges need no
+    index update and removed (tombstoned) gallery rows are skipped naturally.
+    """
+
+    FORMAT_VERSION = 1
+
+    # Vectors assigned to centroids per block, bounds the temporary matrix size
+    ASSIGN_BLOCK_ROWS = 8192
+
+    def __init__(self, gallery: FaceGallery, n_lists: Optional[int] = None, n_probe: int = 8):
+        """
+        Initialize an untrained index.
+
+        Args:
+            gallery: Gallery whose rows are indexed
+            n_lists: Number of partitions, derived from the gallery size if None
+            n_probe: Number of partitions scored per query
+        """
+        self.gallery = gallery
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.centroids: Optional[np.ndarray] = None
+        self._centroid_sq: Optional[np.ndarray] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._lists: List[List[int]] = []
+        self._list_arrays: List[Optional[np.ndarray]] = []
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._assignments >= 0))
+
+    @staticmethod
+    def default_list_count(size: int) -> int:
+        """Return a partition count of about 4 * sqrt(size)"""
+        return int(min(4096, max(16, 4 * np.sqrt(max(size, 1)))))
+
+    def _nearest_lists(self, vectors: np.ndarray, count: int = 1) -> np.ndarray:
+        """Return the indices of the `count` closest centroids for every vector"""
+        result = np.empty((vectors.shape[0], count), dtype=np.int32)
+        for start in range(0, vectors.shape[0], self.ASSIGN_BLOCK_ROWS):
+            block = vectors[start:start + self.ASSIGN_BLOCK_ROWS]
+            # ||v||^2 is constant per row and does not change the ranking
+            scores = self._centroid_sq[None, :] - 2.0 * (block @ self.centroids.T)
+            if count == 1:
+                result[start:start + len(block), 0] = np.argmin(scores, axis=1)
+            else:
+                nearest = np.argpartition(scores, count - 1, axis=1)[:, :count]
+                result[start:start + len(block)] = nearest
+        return result
+
+    def _set_centroids(self, centroids: np.ndarray) -> None:
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._centroid_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self._assignments = np.full(len(self.gallery), -1, dtype=np.int32)
+        self._lists = [[] for _ in range(len(self.centroids))]
+        self._list_arrays = [None] * len(self.centroids)
+
+    def train(self, sample_per_list: int = 64, iterations: int = 10, seed: int = 0,
+              rows: Optional[np.ndarray] = None) -> None:
+        """
+        Train the coarse quantizer on a sample of the gallery and index all rows.
+
+        Args:
+            sample_per_list: Training vectors sampled per partition
+            iterations: Number of k-means iterations
+            seed: Random seed for sampling and initialization
+            rows: Gallery rows to train on and index, every live row if None
+        """
+        rows = self.gallery.alive_rows() if rows is None else np.asarray(rows, dtype=np.int64)
+        if rows.size == 0:
+            raise ValueError("Cannot train an index on an empty gallery")
+
+        rng = np.random.default_rng(seed)
+        n_lists = min(self.n_lists or self.default_list_count(rows.size), rows.size)
+        sample_size = min(rows.size, n_lists * sample_per_list)
+        data = self.gallery.embeddings[np.sort(rng.choice(rows, sample_size, replace=False))]
+        centroids = data[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            self._set_centroids(centroids)
+            assign = self._nearest_lists(data)[:, 0]
+            counts = np.bincount(assign, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, data)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+            # Reseed empty partitions from random training vectors
+            empty = np.flatnonzero(~filled)
+            if empty.size:
+                centroids[empty] = data[rng.choice(sample_size, empty.size, replace=False)]
+
+        self._set_centroids(centroids)
+        self.add(rows)
+        logger.info(f"Trained IVF index with {n_lists} lists on {sample_size} of {rows.size} faces")
+
+    def add(self, rows) -> None:
+        """
+        Index gallery rows that were appended after training.
+
+        Args:
+            rows: Gallery row indices
+        """
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        if rows.size == 0:
+            return
+        if len(self._assignments) < len(self.gallery):
+            grown = np.full(len(self.gallery), -1, dtype=np.int32)
+            grown[:len(self._assignments)] = self._assignments
+            self._assignments = grown
+
+        assign = self._nearest_lists(self.gallery.embeddings[rows])[:, 0]
+        self._assignments[rows] = assign
+        for row, list_id in zip(rows.tolist(), assign.tolist()):
+            self._lists[list_id].append(row)
+            self._list_arrays[list_id] = None
+
+    def remove(self, rows) -> None:
+        """
+        Drop gallery rows from the index.
+
+        Args:
+            rows: Gallery row indices
+        """
+        for row in np.asarray(rows, dtype=np.int64).reshape(-1).tolist():
+            if row >= len(self._assignments):
+                continue
+            list_id = int(self._assignments[row])
+            if list_id >= 0:
+                self._lists[list_id].remove(row)
+                self._list_arrays[list_id] = None
+                self._assignments[row] = -1
+
+    def _list_array(self, list_id: int) -> np.ndarray:
+        array = self._list_arrays[list_id]
+        if array is None:
+            array = np.asarray(self._lists[list_id], dtype=np.int64)
+            self._list_arrays[list_id] = array
+        return array
+
+    def partitions(self, n_probe: Optional[int] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Yield the rows of every partition with the rows of its neighbourhood.
+
+        The neighbourhood is the n_probe partitions whose centroids point
+        closest to the partition's own, itself included, so every row of a
+        partition can be compared with its likely neighbours in one block,
+        e.g. to build a kNN graph. Centroids are compared by angle because
+        partitions mixing many unrelated faces have short centroids, which
+        are close to every other centroid by distance.
+
+        Args:
+            n_probe: Partitions in a neighbourhood, defaults to self.n_probe
+
+        Returns:
+            Iterator of (partition rows, neighbourhood rows), empty partitions skipped
+        """
+        if not self.is_trained:
+            return
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        norms = np.sqrt(self._centroid_sq)
+        directions = self.centroids / np.maximum(norms, 1e-12)[:, None]
+        for list_id in range(len(self.centroids)):
+            rows = self._list_array(list_id)
+            if rows.size == 0:
+                continue
+            similarity = directions @ directions[list_id]
+            similarity[list_id] = np.inf
+            lists = np.argpartition(-similarity, n_probe - 1)[:n_probe]
+            yield rows, np.concatenate([self._list_array(probe) for probe in lists])
+
+    def search(self, queries, n_probe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the approximate closest gallery face for each query.
+
+        Args:
+            queries: Array-like of shape (m, dim)
+            n_probe: Partitions scored per query, defaults to self.n_probe
+
+        Returns:
+            Tuple of (best_rows, best_distances) with the same conventions as
+            FaceGallery.match
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        count = queries.shape[0]
+        best_rows = np.full(count, -1, dtype=np.int64)
+        best_distances = np.full(count, np.inf, dtype=np.float32)
+        if not self.is_trained or count == 0 or queries.shape[1] != self.gallery.dim:
+            return best_rows, best_distances
+
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        probes = self._nearest_lists(queries, n_probe)
+        embeddings = self.gallery.embeddings
+        sq_norms = self.gallery.squared_norms
+
+        for i in range(count):
+            candidates = np.concatenate([self._list_array(list_id) for list_id in probes[i]])
+            if candidates.size == 0:
+                continue
+            query = queries[i]
+            sq = sq_norms[candidates] - 2.0 * (embeddings[candidates] @ query) + query @ query
+            best = int(np.argmin(sq))
+            if np.isfinite(sq[best]):
+                best_rows[i] = candidates[best]
+                best_distances[i] = np.sqrt(max(float(sq[best]), 0.0))
+
+        return best_rows, best_distances
+
+    def save(self, path: str) -> None:
+        """
+        Write the quantizer and row assignments to a sidecar file.
+
+        Rows are stored by database Face id so the file stays valid when the
+        gallery is reloaded in a different order.
+
+        Args:
+            path: Destination .npz file
+        """
+        face_ids = self.gallery.face_ids
+        assignments = self._assignments[:len(face_ids)]
+        keep = (face_ids >= 0) & (assignments >= 0)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f,
+                     version=np.int32(self.FORMAT_VERSION),
+                     centroids=self.centroids,
+                     face_ids=face_ids[keep],
+                     assignments=assignments[keep])
+        os.replace(tmp_path, path)
+        logger.info(f"Saved IVF index with {int(keep.sum())} faces to {path}")
+
+    @classmethod
+    def load(cls, path: str, gallery: FaceGallery, n_probe: int = 8) -> Optional['IVFFaceIndex']:
+        """
+        Load an index sidecar for a gallery.
+
+        Gallery rows missing from the file (faces added since it was written or
+        faces without a database id) are assigned to their nearest partition.
+
+        Args:
+            path: Sidecar .npz file
+            gallery: Gallery the index belongs to
+            n_probe: Partitions scored per query
+
+        Returns:
+            The loaded index, or None if the file is missing or incompatible
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != cls.FORMAT_VERSION or data['centroids'].shape[1] != gallery.dim:
+                    logger.info(f"Ignoring incompatible face index at {path}")
+                    return None
+                centroids = data['centroids']
+                face_ids = data['face_ids']
+                assignments = data['assignments']
+        except Exception as e:
+            logger.warning(f"Failed to load face index from {path}: {str(e)}")
+            return None
+
+        index = cls(gallery, n_lists=len(centroids), n_probe=n_probe)
+        index._set_centroids(centroids)
+
+        # Map stored face ids onto current gallery rows
+        gallery_ids = gallery.face_ids
+        order = np.argsort(face_ids)
+        sorted_ids = face_ids[order]
+        positions = np.clip(np.searchsorted(sorted_ids, gallery_ids), 0, max(len(sorted_ids) - 1, 0))
+        known = np.zeros(len(gallery_ids), dtype=bool)
+        if len(sorted_ids):
+            known = (sorted_ids[positions] == gallery_ids) & (gallery.labels >= 0) & (gallery_ids >= 0)
+
+        rows = np.flatnonzero(known)
+        index._assignments[rows] = assignments[order][positions[rows]]
+        for row, list_id in zip(rows.tolist(), index._assignments[rows].tolist()):
+            index._lists[list_id].append(row)
+
+        missing = np.setdiff1d(gallery.alive_rows(), rows)
+        index.add(missing)
+        logger.info(f"Loaded IVF index from {path} ({rows.size} stored, {missing.size} newly assigned)")
+        return index
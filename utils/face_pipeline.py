@@ -0,0 +1,355 @@
+import time
+import logging
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from insightface.utils import face_align
+from retinaface import RetinaFace
+
+from utils.thumbnail_cache import face_box
+
+logger = logging.getLogger('FacePipeline')
+
+
+class FacePipeline:
+    """
+    Detect, align and embed the faces of an image.
+
+    In 'single_pass' mode every image goes through RetinaFace once. Each face
+    is aligned from the detector's 5-point landmarks and the aligned chips are
+    passed straight to the recognition model. 'crop' mode is the previous
+    behaviour, where InsightFace runs its own detector again on a padded crop
+    of every face. It is kept for comparison.
+
+    With a thumbnail_size, every identity also gets a small RGB crop of its
+    face under 'thumbnail', cut from the image already in memory so the
+    People tab never has to decode the original.
+    """
+
+    MODES = ('single_pass', 'crop')
+
+    def __init__(self, face_analyzer, mode: str = 'single_pass', padding: float = 0.05,
+                 thumbnail_size: int = 0):
+        """
+        Initialize the pipeline.
+
+        Args:
+            face_analyzer: Prepared insightface FaceAnalysis instance
+            mode: 'single_pass' or 'crop'
+            padding: Relative padding around the face box in 'crop' mode
+            thumbnail_size: Longest side of the face thumbnails, 0 for none
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown face pipeline mode: {mode}")
+        self.face_analyzer = face_analyzer
+        self.recognition_model = face_analyzer.models['recognition']
+        self.mode = mode
+        self.padding = padding
+        self.thumbnail_size = thumbnail_size
+        self.timings: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+
+    def reset_timings(self) -> None:
+        self.timings.clear()
+        self.counts.clear()
+
+    def detect(self, img: np.ndarray, source: str = '') -> List[dict]:
+        """
+        Detect faces and drop boxes that fall outside the image.
+
+        Args:
+            img: BGR image
+            source: Image path used in log messages
+
+        Returns:
+            List of RetinaFace identity dicts
+        """
+        start = time.perf_counter()
+        faces = RetinaFace.detect_faces(img)
+        self.timings['detect'] += time.perf_counter() - start
+        self.counts['images'] += 1
+
+        detections = []
+        if not isinstance(faces, dict):
+            return detections
+        height, width = img.shape[:2]
+        for key in faces:
+            identity = faces[key]
+            x1, y1, x2, y2 = identity["facial_area"]
+            if x1 >= x2 or y1 >= y2 or x1 < 0 or y1 < 0 or x2 > width or y2 > height:
+                logger.warning(f"Invalid facial area in {source}: {identity['facial_area']}")
+                continue
+            detections.append(identity)
+        self.counts['detected'] += len(detections)
+        return detections
+
+    @staticmethod
+    def keypoints(identity: dict) -> Optional[np.ndarray]:
+        """
+        Convert RetinaFace landmarks to the 5x2 keypoint order used by ArcFace.
+
+        Eyes and mouth corners are ordered by x coordinate, so the result does
+        not depend on whether the detector names them from the subject's or
+        the viewer's side.
+        """
+        landmarks = identity.get("landmarks")
+        if not landmarks:
+            return None
+        try:
+            eyes = sorted((landmarks["left_eye"], landmarks["right_eye"]), key=lambda p: p[0])
+            mouth = sorted((landmarks["mouth_left"], landmarks["mouth_right"]), key=lambda p: p[0])
+            return np.array([eyes[0], eyes[1], landmarks["nose"], mouth[0], mouth[1]], dtype=np.float32)
+        except KeyError:
+            return None
+
+    @staticmethod
+    def to_original(identity: dict, scale: float) -> dict:
+        """
+        Map a detection on a reduced image back to original image coordinates.
+
+        Args:
+            identity: RetinaFace identity dict
+            scale: Original size divided by the size the image was decoded at
+
+        Returns:
+            Copy of the identity with a scaled facial area and landmarks
+        """
+        if scale == 1.0:
+            return identity
+        identity = dict(identity)
+        identity["facial_area"] = [int(round(v * scale)) for v in identity["facial_area"]]
+        if identity.get("landmarks"):
+            identity["landmarks"] = {name: [float(v) * scale for v in point]
+                                     for name, point in identity["landmarks"].items()}
+        return identity
+
+    def add_thumbnail(self, img: np.ndarray, identity: dict) -> dict:
+        """
+        Crop the face's thumbnail, called while the identity is still in img coordinates.
+
+        Args:
+            img: BGR image
+            identity: RetinaFace identity dict
+
+        Returns:
+            The identity, with the RGB crop under 'thumbnail' if thumbnails are on
+        """
+        if self.thumbnail_size <= 0:
+            return identity
+        height, width = img.shape[:2]
+        left, top, right, bottom = face_box(identity["facial_area"], width, height)
+        crop = img[top:bottom, left:right]
+        if crop.size == 0:
+            return identity
+        side = max(crop.shape[:2])
+        if side > self.thumbnail_size:
+            factor = self.thumbnail_size / side
+            crop = cv2.resize(crop, (max(1, round(crop.shape[1] * factor)), max(1, round(crop.shape[0] * factor))),
+                              interpolation=cv2.INTER_AREA)
+        identity["thumbnail"] = np.ascontiguousarray(crop[:, :, ::-1])
+        return identity
+
+    def align(self, img: np.ndarray, identity: dict) -> Optional[np.ndarray]:
+        """
+        Warp a detected face to the recognition model's input template.
+
+        Args:
+            img: BGR image
+            identity: RetinaFace identity dict
+
+        Returns:
+            Aligned face chip, or None if the face has no landmarks
+        """
+        kps = self.keypoints(identity)
+        if kps is None:
+            return None
+        start = time.perf_counter()
+        chip = face_align.norm_crop(img, landmark=kps, image_size=self.recognition_model.input_size[0])
+        self.timings['align'] += time.perf_counter() - start
+        return chip
+
+    def embed_chips(self, chips: List[np.ndarray]) -> np.ndarray:
+        """
+        Run the recognition model on aligned chips.
+
+        Args:
+            chips: Aligned face chips
+
+        Returns:
+            Array of shape (len(chips), dim)
+        """
+        if not chips:
+            return np.empty((0, 0), dtype=np.float32)
+        start = time.perf_counter()
+        embeddings = self.recognition_model.get_feat(chips)
+        self.timings['embed'] += time.perf_counter() - start
+        self.counts['embedded'] += len(chips)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def crop(self, img: np.ndarray, identity: dict) -> Optional[np.ndarray]:
+        """Extract the padded face box used by 'crop' mode"""
+        x1, y1, x2, y2 = identity["facial_area"]
+        height, width = img.shape[:2]
+        pad_x = int((x2 - x1) * self.padding)
+        pad_y = int((y2 - y1) * self.padding)
+        face_roi = img[max(0, y1 - pad_y):min(height, y2 + pad_y), max(0, x1 - pad_x):min(width, x2 + pad_x)]
+        if face_roi.size == 0:
+            return None
+        return face_roi
+
+    def _embed_crop(self, img: np.ndarray, identity: dict, source: str) -> Optional[np.ndarray]:
+        face_roi = self.crop(img, identity)
+        if face_roi is None:
+            logger.warning(f"Empty face ROI in {source}")
+            return None
+        start = time.perf_counter()
+        face_data = self.face_analyzer.get(face_roi)
+        self.timings['embed'] += time.perf_counter() - start
+        if not face_data or face_data[0].embedding is None:
+            logger.warning(f"No face data returned for detected face in {source}")
+            return None
+        self.counts['embedded'] += 1
+        return np.asarray(face_data[0].embedding, dtype=np.float32)
+
+    def prepare(self, img: np.ndarray, source: str = '', scale: float = 1.0) -> List[Tuple[dict, np.ndarray]]:
+        """
+        Detect and align the faces of an image without embedding them.
+
+        Args:
+            img: BGR image
+            source: Image path used in log messages
+            scale: Original size divided by the size img was decoded at
+
+        Returns:
+            List of (identity, aligned chip) pairs, identities in original
+            image coordinates
+        """
+        prepared = []
+        for identity in self.detect(img, source):
+            chip = self.align(img, identity)
+            if chip is None:
+                logger.warning(f"No landmarks for detected face in {source}")
+                continue
+            prepared.append((self.to_original(self.add_thumbnail(img, identity), scale), chip))
+        return prepared
+
+    def process(self, img: np.ndarray, source: str = '', scale: float = 1.0) -> List[Tuple[dict, np.ndarray]]:
+        """
+        Detect and embed every face of an image.
+
+        Args:
+            img: BGR image
+            source: Image path used in log messages
+            scale: Original size divided by the size img was decoded at
+
+        Returns:
+            List of (identity, embedding) pairs, identities in original image
+            coordinates
+        """
+        if self.mode == 'crop':
+            results = []
+            for identity in self.detect(img, source):
+                try:
+                    encoding = self._embed_crop(img, identity, source)
+                except Exception as e:
+                    logger.warning(f"Error processing face embedding: {str(e)}")
+                    continue
+                if encoding is not None:
+                    results.append((self.to_original(self.add_thumbnail(img, identity), scale), encoding))
+            return results
+
+        prepared = self.prepare(img, source, scale)
+        embeddings = self.embed_chips([chip for _, chip in prepared])
+        return [(identity, embeddings[i]) for i, (identity, _) in enumerate(prepared)]
+
+
+class EmbeddingBatcher:
+    """
+    Collects aligned face chips across images and embeds them together.
+
+    Chips are queued until batch_size chips are pending or the oldest pending
+    image has waited timeout seconds. They then go through the recognition
+    model in forward passes of batch_size chips and the embeddings are handed
+    back per image, in the order the images were added.
+    """
+
+    def __init__(self, pipeline: FacePipeline, batch_size: int = 32, timeout: float = 0.5):
+        """
+        Initialize the batcher.
+
+        Args:
+            pipeline: Pipeline used to prepare and embed faces
+            batch_size: Number of chips per forward pass
+            timeout: Maximum seconds an image waits for its batch to fill up
+        """
+        self.pipeline = pipeline
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+        self._pending: List[Tuple[Any, List[Tuple[dict, np.ndarray]]]] = []
+        self._chip_count = 0
+        self._oldest = 0.0
+
+    def __len__(self) -> int:
+        """Number of images waiting for their embeddings"""
+        return len(self._pending)
+
+    def add(self, item: Any, img: np.ndarray, source: str = '',
+            scale: float = 1.0) -> List[Tuple[Any, List[Tuple[dict, np.ndarray]]]]:
+        """
+        Queue the faces of an image.
+
+        Args:
+            item: Caller's record for the image, returned with its embeddings
+            img: BGR image
+            source: Image path used in log messages
+            scale: Original size divided by the size img was decoded at
+
+        Returns:
+            List of (item, [(identity, embedding), ...]) for every image whose
+            batch completed, possibly empty
+        """
+        if self.pipeline.mode == 'crop':
+            # Crop mode embeds through the full analyzer, nothing to batch
+            return self.flush() + [(item, self.pipeline.process(img, source, scale))]
+
+        faces = self.pipeline.prepare(img, source, scale)
+        if not self._pending:
+            self._oldest = time.monotonic()
+        self._pending.append((item, faces))
+        self._chip_count += len(faces)
+
+        if self._chip_count >= self.batch_size or time.monotonic() - self._oldest >= self.timeout:
+            return self.flush()
+        return []
+
+    def flush(self) -> List[Tuple[Any, List[Tuple[dict, np.ndarray]]]]:
+        """
+        Embed every pending chip.
+
+        Returns:
+            List of (item, [(identity, embedding), ...]) for every pending image,
+            with None in place of the faces if the batch failed to embed
+        """
+        pending = self._pending
+        self._pending = []
+        self._chip_count = 0
+        if not pending:
+            return []
+
+        chips = [chip for _, faces in pending for _, chip in faces]
+        try:
+            batches = [self.pipeline.embed_chips(chips[i:i + self.batch_size])
+                       for i in range(0, len(chips), self.batch_size)]
+        except Exception as e:
+            logger.error(f"Error embedding a batch of {len(chips)} faces: {str(e)}")
+            return [(item, None) for item, _ in pending]
+
+        results = []
+        offset = 0
+        embeddings = np.concatenate(batches) if batches else None
+        for item, faces in pending:
+            results.append((item, [(identity, embeddings[offset + i]) for i, (identity, _) in enumerate(faces)]))
+            offset += len(faces)
+        return results
@@ -1,16 +1,22 @@
 import os
 import json
 import numpy as np
-from PyQt5.QtWidgets import QApplication
-from database.models import Face, Image
 from insightface.app import FaceAnalysis 
-from retinaface import RetinaFace
-import cv2
 import logging
 from typing import Tuple, Dict, List, Optional
 import uuid
 
+from utils.face_clustering import FaceClusterer, UNKNOWN_PREFIX
+from utils.face_gallery import FaceGallery
+from utils.face_index import IVFFaceIndex
+from utils.face_pipeline import FacePipeline, EmbeddingBatcher
+from utils.face_workers import FaceWorkerPool
+from utils.face_writer import FaceWriteBuffer
+from utils.gallery_snapshot import GallerySnapshot
 from utils.helper import generate_random_number
+from utils.image_loader import DecodedImageCache, read_image
+from utils.jobs import JobControl, CompletionWatermark
+from utils.thumbnail_cache import SIZES
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, 
@@ -18,7 +24,22 @@ logging.basicConfig(level=logging.INFO,
 logger = logging.getLogger('FaceRecognitionProcessor')
 
 class FaceRecognitionProcessor:
-    def __init__(self, db_manager, similarity_threshold: float = 0.6, det_size: Tuple[int, int] = (640, 640)):
+    # Suffixes of the sidecars stored next to the SQLite database
+    FACE_INDEX_SUFFIX = '.faceindex.npz'
+    GALLERY_SNAPSHOT_SUFFIX = '.gallery'
+    # Resume point of process_images
+    CHECKPOINT_NAME = 'face_processing'
+    # Last Face id grouped by cluster_unknown_faces
+    CLUSTER_CHECKPOINT_NAME = 'face_clustering'
+    # Matches up to this multiple of the similarity threshold are accepted
+    RELAXED_THRESHOLD_FACTOR = 1.2
+
+    def __init__(self, db_manager, similarity_threshold: float = 0.6, det_size: Tuple[int, int] = (640, 640),
+                 index_mode: str = 'auto', index_min_faces: int = 100000, index_probes: int = 8,
+                 pipeline_mode: str = 'single_pass', embed_batch_size: int = 32,
+                 embed_batch_timeout: float = 0.5, workers: int = 0, write_batch_size: int = 50,
+                 write_batch_delay: float = 2.0, decode_min_side: int = 1024, thumbnail_cache=None,
+                 cluster_neighbours: int = 10, cluster_exact_max_faces: int = 20000):
         """
         Initialize the face recognition processor.
         
@@ -26,229 +47,556 @@ class FaceRecognitionProcessor:
             db_manager: Database manager instance
             similarity_threshold: Threshold for face matching (lower is stricter)
             det_size: Detection size for face analysis
+            index_mode: 'exact' to always scan the whole gallery, 'ivf' to always use
+                the approximate index, 'auto' to use it once the gallery is large
+            index_min_faces: Gallery size at which 'auto' switches to the index
+            index_probes: Number of index partitions scored per face
+            pipeline_mode: 'single_pass' to embed landmark-aligned chips from a single
+                detection, 'crop' to re-detect on padded crops (previous behaviour)
+            embed_batch_size: Number of face chips embedded per forward pass
+            embed_batch_timeout: Maximum seconds an image waits for its batch to fill up
+            workers: Number of detection/embedding processes, 0 or 1 to process
+                faces in the calling thread
+            write_batch_size: Number of processed images saved per transaction
+            write_batch_delay: Maximum seconds a processed image waits to be saved
+            decode_min_side: Images are decoded at a reduced scale whose shorter
+                side is at least this long, 0 to decode at full resolution
+            thumbnail_cache: Optional ThumbnailCache receiving a thumbnail of
+                every saved face, cropped from the image decoded for detection
+            cluster_neighbours: Nearest faces linked to every face when
+                unnamed faces are grouped
+            cluster_exact_max_faces: Unnamed faces up to which grouping compares
+                every pair, larger sets are compared within index partitions
         """
         self.db_manager = db_manager
-        self.known_face_encodings: Dict[str, List[np.ndarray]] = {}
+        self.gallery = FaceGallery()
+        self.face_index: Optional[IVFFaceIndex] = None
+        self.snapshot: Optional[GallerySnapshot] = None
+        self.index_mode = index_mode
+        self.index_min_faces = index_min_faces
+        self.index_probes = index_probes
         self.similarity_threshold = similarity_threshold
         self.det_size = det_size
         self.face_analyzer = None
+        self.pipeline_mode = pipeline_mode
+        self.pipeline: Optional[FacePipeline] = None
+        self.embed_batch_size = embed_batch_size
+        self.embed_batch_timeout = embed_batch_timeout
+        self.workers = workers
+        self.write_batch_size = write_batch_size
+        self.write_batch_delay = write_batch_delay
+        self.decode_min_side = decode_min_side
+        self.thumbnail_cache = thumbnail_cache
+        self.thumbnail_size = max(SIZES) if thumbnail_cache is not None else 0
+        self.cluster_neighbours = cluster_neighbours
+        self.cluster_exact_max_faces = cluster_exact_max_faces
+        self._worker_pool: Optional[FaceWorkerPool] = None
         self.load_known_faces()
         
     def _init_face_analyzer(self):
         """Initialize the face analyzer only when needed to save resources"""
         if self.face_analyzer is None:
             try:
-                self.face_analyzer = FaceAnalysis()
+                self.face_analyzer = FaceAnalysis(allowed_modules=['detection', 'recognition'])
                 self.face_analyzer.prepare(ctx_id=0, det_size=self.det_size)
+                self.pipeline = FacePipeline(self.face_analyzer, mode=self.pipeline_mode,
+                                             thumbnail_size=self.thumbnail_size)
                 logger.info("Face analyzer initialized successfully")
             except Exception as e:
                 logger.error(f"Failed to initialize face analyzer: {str(e)}")
                 raise
     
-    def load_known_faces(self):
-        """Load known face encodings from database"""
+    def load_known_faces(self, use_snapshot: bool = True):
+        """
+        Load known face encodings into the gallery
+        
+        The gallery snapshot next to the database is memory-mapped when its
+        watermark matches the faces table; otherwise every face is loaded from
+        the database and the snapshot is rewritten.
+        
+        Args:
+            use_snapshot: Set to False to force a full database reload
+        """
         try:
-            faces = self.db_manager.session.query(Face).all()
-            face_count = 0
+            path = self.db_manager.get_sidecar_path(self.GALLERY_SNAPSHOT_SUFFIX)
+            self.snapshot = GallerySnapshot(path) if path else None
+            watermark = self.db_manager.get_face_watermark()
             
-            for face in faces:
-                if face.person_name and face.face_encoding:
-                    try:
-                        encoding = np.frombuffer(json.loads(face.face_encoding), dtype=np.float32)
-                        if face.person_name not in self.known_face_encodings:
-                            self.known_face_encodings[face.person_name] = []
-                        self.known_face_encodings[face.person_name].append(encoding)
-                        face_count += 1
-                    except Exception as e:
-                        logger.warning(f"Failed to load face encoding for {face.id}: {str(e)}")
+            gallery = None
+            if self.snapshot is not None and use_snapshot:
+                gallery = self.snapshot.load(watermark)
+            
+            if gallery is None:
+                face_ids, names, embeddings = self.db_manager.load_face_embeddings()
+                gallery = FaceGallery(initial_capacity=max(1024, len(face_ids)))
+                if len(face_ids):
+                    gallery.add_many(embeddings, names, face_ids)
+                if self.snapshot is not None:
+                    self.snapshot.write(gallery, watermark)
+            self.gallery = gallery
             
-            logger.info(f"Loaded {face_count} face encodings for {len(self.known_face_encodings)} unique persons")
+            logger.info(f"Loaded {len(self.gallery)} face encodings for {self.gallery.person_count()} unique persons")
+            self._setup_face_index()
         except Exception as e:
             logger.error(f"Error loading known faces: {str(e)}")
             raise
     
-    def process_images(self, batch_size: int = 50) -> Tuple[int, int]:
+    def _setup_face_index(self):
+        """Load or build the approximate index when the gallery calls for one"""
+        self.face_index = None
+        if self.index_mode == 'exact' or len(self.gallery) == 0:
+            return
+        if self.index_mode != 'ivf' and len(self.gallery) < self.index_min_faces:
+            return
+            
+        try:
+            path = self.db_manager.get_sidecar_path(self.FACE_INDEX_SUFFIX)
+            if path:
+                self.face_index = IVFFaceIndex.load(path, self.gallery, n_probe=self.index_probes)
+            if self.face_index is None:
+                self.face_index = IVFFaceIndex(self.gallery, n_probe=self.index_probes)
+                self.face_index.train()
+            self.save_face_index()
+        except Exception as e:
+            logger.error(f"Failed to set up face index, using exact matching: {str(e)}")
+            self.face_index = None
+    
+    def _begin_gallery_update(self):
+        """Mark the snapshot dirty before the faces table changes"""
+        if self.snapshot is not None:
+            try:
+                self.snapshot.mark_dirty()
+            except Exception as e:
+                logger.warning(f"Failed to mark gallery snapshot dirty: {str(e)}")
+                self.snapshot = None
+    
+    def _save_gallery(self):
+        """Write the snapshot and index after the gallery changed"""
+        if self.snapshot is not None:
+            try:
+                if self.snapshot.gallery is not self.gallery:
+                    # First faces of a new library
+                    self.snapshot.write(self.gallery, self.db_manager.get_face_watermark())
+                else:
+                    self.snapshot.flush(self.db_manager.get_face_watermark())
+            except Exception as e:
+                logger.warning(f"Failed to save gallery snapshot: {str(e)}")
+        self.save_face_index()
+    
+    def save_face_index(self):
+        """Persist the approximate index next to the database, if there is one"""
+        if self.face_index is None:
+            return
+        path = self.db_manager.get_sidecar_path(self.FACE_INDEX_SUFFIX)
+        if not path:
+            return
+        try:
+            self.face_index.save(path)
+        except Exception as e:
+            logger.warning(f"Failed to save face index: {str(e)}")
+    
+    def _add_to_gallery(self, encoding: np.ndarray, person_name: str, face_id: int = -1) -> int:
+        """Append a face to the gallery and the approximate index, returns its row"""
+        row = self.gallery.add(encoding, person_name, face_id)
+        if self.face_index is not None:
+            self.face_index.add(row)
+        return row
+    
+    def _match_encodings(self, encodings: np.ndarray) -> List[Tuple[Optional[str], float]]:
+        """
+        Match a batch of face encodings against the gallery
+        
+        Args:
+            encodings: Array of shape (n, dim) with one row per face
+            
+        Returns:
+            List of (person_name, distance) per face; person_name is None when
+            no gallery face is within the relaxed threshold
+        """
+        if self.face_index is not None:
+            rows, distances = self.face_index.search(encodings)
+        else:
+            rows, distances = self.gallery.match(encodings)
+        relaxed_threshold = self.similarity_threshold * self.RELAXED_THRESHOLD_FACTOR  # 20% more lenient
+        
+        matches = []
+        for row, distance in zip(rows, distances):
+            if row >= 0 and distance < relaxed_threshold:
+                matches.append((self.gallery.label_of(row), float(distance)))
+            else:
+                matches.append((None, float(distance)))
+        return matches
+    
+    def _prepare_image_faces(self, image, faces: List[Tuple[dict, np.ndarray]]) -> Tuple[List[dict], List[int]]:
+        """
+        Match the faces of one image and add them to the gallery
+        
+        The faces are added to the gallery right away, so later faces are
+        matched against them, and get their Face ids once they are written.
+        
+        Args:
+            image: Image row (id, file_path) the faces were detected in
+            faces: List of (identity, embedding) pairs
+            
+        Returns:
+            Tuple of (face records for DatabaseManager.save_processed_images,
+            gallery rows of the faces)
+        """
+        records = []
+        rows = []
+        if not faces:
+            return records, rows
+        
+        # Match every face of the image against the gallery in one batch
+        encodings = np.stack([encoding for _, encoding in faces])
+        matches = self._match_encodings(encodings)
+
+        for (identity, encoding), (person_name, distance) in zip(faces, matches):
+            try:
+                if person_name is None:
+                    # Generate unique person identifier
+                    person_name = f"{UNKNOWN_PREFIX}{uuid.uuid4().hex[:8]}"
+                    logger.info(f"New person detected: {person_name}")
+                elif distance >= self.similarity_threshold:
+                    logger.info(f"Using relaxed threshold match: {person_name} (score: {distance:.3f})")
+
+                # Save landmarks if available
+                landmarks = None
+                if "landmarks" in identity:
+                    landmarks = json.dumps({name: [float(v) for v in point]
+                                            for name, point in identity["landmarks"].items()})
+                    
+                # Save confidence if available
+                confidence = None
+                if "score" in identity:
+                    confidence = float(identity["score"])
+
+                record = {
+                    'person_name': person_name,
+                    'embedding': encoding,
+                    'facial_area': json.dumps([int(v) for v in identity["facial_area"]]),
+                    'landmarks': landmarks,
+                    'confidence': confidence,
+                    'thumbnail': identity.get("thumbnail")
+                }
+                rows.append(self._add_to_gallery(encoding, person_name))
+                records.append(record)
+            except Exception as e:
+                logger.warning(f"Error preparing face in {image.file_path}: {str(e)}")
+        
+        return records, rows
+    
+    def _flush_writes(self, writes: FaceWriteBuffer, watermark: CompletionWatermark) -> Tuple[int, int]:
+        """
+        Save buffered images and give their gallery rows the new Face ids
+        
+        Returns:
+            Tuple of (saved image count, saved face count)
+        """
+        image_ids = writes.image_ids
+        rows = writes.gallery_rows
+        faces = writes.faces
+        saved = (0, 0)
+        try:
+            written_rows, face_ids = writes.flush()
+            self.gallery.set_face_ids(written_rows, face_ids)
+            saved = (len(image_ids), len(face_ids))
+            self._store_thumbnails(faces, face_ids)
+        except Exception as e:
+            logger.error(f"Error saving faces of {len(image_ids)} images: {str(e)}")
+            # The faces are not in the database, so they must not be matched against
+            self.gallery.remove_rows(rows)
+            if self.face_index is not None:
+                self.face_index.remove(rows)
+        for image_id in image_ids:
+            watermark.finished(image_id)
+        return saved
+    
+    def _store_thumbnails(self, faces: List[dict], face_ids: List[int]) -> None:
+        """Hand the face thumbnails cropped by the pipeline to the thumbnail cache once the faces have ids"""
+        if self.thumbnail_cache is None:
+            return
+        for face, face_id in zip(faces, face_ids):
+            if face.get('thumbnail') is None:
+                continue
+            try:
+                self.thumbnail_cache.put_face(face_id, json.loads(face['facial_area']), face['thumbnail'])
+            except Exception as e:
+                logger.warning(f"Error storing the thumbnail of face {face_id}: {str(e)}")
+    
+    def _processable_images(self, images, skipped):
+        """
+        Yield the images that exist on disk and can be searched for faces
+        
+        Args:
+            images: Iterable of image rows
+            skipped: Called with every image that is not yielded
+        """
+        for image in images:
+            if not os.path.exists(image.file_path):
+                logger.warning(f"Image file not found: {image.file_path}")
+                skipped(image)
+                continue
+                
+            # Only process images (not videos)
+            ext = os.path.splitext(image.file_path)[1].lower()
+            if ext not in ['.jpg', '.jpeg', '.png']:
+                logger.debug(f"Skipping non-image file: {image.file_path}")
+                skipped(image)
+                continue
+            yield image
+    
+    def _embed_in_process(self, images, skipped, decoded_images=None):
+        """
+        Detect and embed faces in the calling thread
+        
+        Args:
+            images: Iterable of image rows
+            skipped: Called with every image that is not searched
+            decoded_images: Optional DecodedImageCache with images already
+                decoded at decode_min_side, taken instead of reading the files
+        
+        Yields:
+            (image, faces) in input order, where faces is a list of
+            (identity, embedding) pairs, or None if the image failed
+        """
+        self._init_face_analyzer()
+        batcher = EmbeddingBatcher(self.pipeline, self.embed_batch_size, self.embed_batch_timeout)
+        
+        for image in self._processable_images(images, skipped):
+            try:
+                decoded = decoded_images.pop(image.file_path) if decoded_images is not None else None
+                img, scale = decoded or read_image(image.file_path, self.decode_min_side)
+                if img is None:
+                    logger.warning(f"Failed to read image: {image.file_path}")
+                    yield image, None
+                    continue
+                    
+                # Detect and align faces, embedding happens once the batch is full
+                yield from batcher.add(image, img, image.file_path, scale)
+                    
+            except Exception as e:
+                logger.error(f"Error processing image {image.file_path}: {str(e)}")
+                yield image, None
+        
+        yield from batcher.flush()
+    
+    def _embed_with_workers(self, images, skipped, workers):
+        """
+        Detect and embed faces in a pool of worker processes
+        
+        Yields:
+            (image, faces) in completion order, where faces is None if the
+            image failed
+        """
+        pending = {}
+        
+        def tasks():
+            for image in self._processable_images(images, skipped):
+                pending[image.id] = image
+                yield image.id, image.file_path
+        
+        self._worker_pool = FaceWorkerPool(workers, det_size=self.det_size, pipeline_mode=self.pipeline_mode,
+                                           batch_size=self.embed_batch_size, batch_timeout=self.embed_batch_timeout,
+                                           decode_min_side=self.decode_min_side,
+                                           thumbnail_size=self.thumbnail_size)
+        try:
+            for image_id, faces in self._worker_pool.run(tasks()):
+                image = pending.pop(image_id, None)
+                if image is not None:
+                    yield image, faces
+        finally:
+            self._worker_pool = None
+    
+    def cancel_processing(self):
+        """Stop worker processes of a running process_images call"""
+        if self._worker_pool is not None:
+            self._worker_pool.cancel()
+    
+    def process_images(self, batch_size: int = 50, control: Optional[JobControl] = None,
+                       workers: Optional[int] = None,
+                       decoded_images: Optional[DecodedImageCache] = None,
+                       image_ids: Optional[List[int]] = None) -> Tuple[int, int]:
         """
         Process images in the database to detect faces
         
+        Faces are detected and embedded either in this thread, in batches of
+        embed_batch_size chips, or by a pool of worker processes. Matching
+        always happens here, one image at a time. Faces and processed flags
+        are buffered and saved write_batch_size images per transaction.
+        
+        Unprocessed images are streamed from the database in id order. A
+        checkpoint with the highest id up to which every image has been
+        saved is stored as the run goes, so an interrupted run resumes after
+        it instead of walking again over images that failed or were skipped.
+        A run that reaches the end clears the checkpoint, so those images are
+        retried next time. A run limited to image_ids neither resumes from
+        nor moves that checkpoint.
+        
         Args:
-            batch_size: Number of images to process before yielding to UI
+            batch_size: Number of images between two progress log lines and checkpoints
+            control: Optional JobControl for progress, cancel and pause
+            workers: Overrides the configured number of worker processes, e.g.
+                0 for a handful of images where starting workers costs more
+            decoded_images: Optional DecodedImageCache filled by ingest in the
+                same job, used instead of reading those files again when
+                faces are processed in this thread
+            image_ids: Only process these images, e.g. the files a watched
+                folder import just added, None for every unprocessed image
             
         Returns:
             Tuple of (processed_count, detected_face_count)
         """
         processed = 0
         detected = 0
+        handled = 0
+        skipped = 0
+        watermark = None
+        writes = FaceWriteBuffer(self.db_manager, self.write_batch_size, self.write_batch_delay)
+        
+        def skip(image):
+            # Runs on the feeder thread in worker mode, keep it off the session
+            nonlocal skipped
+            watermark.finished(image.id)
+            skipped += 1
+        
+        def stream():
+            for image in self.db_manager.iter_unprocessed_images(after_id=start_id, image_ids=image_ids):
+                watermark.started(image.id)
+                yield image
         
         try:
-            # Initialize face analyzer when needed
-            self._init_face_analyzer()
+            self._begin_gallery_update()
             
-            # Get all unprocessed images from the database
-            images = self.db_manager.session.query(Image).filter(Image.processed == False).all()
-            total_images = len(images)
+            checkpointed = image_ids is None
+            start_id = self.db_manager.get_job_checkpoint(self.CHECKPOINT_NAME) if checkpointed else 0
+            watermark = CompletionWatermark(start_id)
+            total_images = self.db_manager.count_unprocessed_images(after_id=start_id, image_ids=image_ids)
+            if start_id:
+                logger.info(f"Resuming after image {start_id}")
             logger.info(f"Starting to process {total_images} images")
             
-            for image in images:
-                if not os.path.exists(image.file_path):
-                    logger.warning(f"Image file not found: {image.file_path}")
-                    continue
-                    
-                # Only process images (not videos)
-                ext = os.path.splitext(image.file_path)[1].lower()
-                if ext not in ['.jpg', '.jpeg', '.png']:
-                    logger.debug(f"Skipping non-image file: {image.file_path}")
-                    continue
-                    
-                try:
-                    img = cv2.imread(image.file_path)
-                    if img is None:
-                        logger.warning(f"Failed to read image: {image.file_path}")
-                        continue
-                        
-                    # Process faces in the image
-                    faces = RetinaFace.detect_faces(img)
-                    image_faces_detected = 0
-                    
-                    if faces:
-                        for key in faces:
-                            identity = faces[key]
-                            facial_area = identity["facial_area"]
-                            x1, y1, x2, y2 = facial_area
-                            
-                            # Validate facial area coordinates
-                            if x1 >= x2 or y1 >= y2 or x1 < 0 or y1 < 0 or x2 > img.shape[1] or y2 > img.shape[0]:
-                                logger.warning(f"Invalid facial area in {image.file_path}: {facial_area}")
-                                continue
-
-                            # Extract face ROI with padding
-                            try:
-                                # Add padding (5% on each side)
-                                height, width = img.shape[:2]
-                                pad_x = int((x2 - x1) * 0.05)
-                                pad_y = int((y2 - y1) * 0.05)
-                                
-                                # Ensure padded coordinates are within image bounds
-                                x1_pad = max(0, x1 - pad_x)
-                                y1_pad = max(0, y1 - pad_y)
-                                x2_pad = min(width, x2 + pad_x)
-                                y2_pad = min(height, y2 + pad_y)
-                                
-                                face_roi = img[y1_pad:y2_pad, x1_pad:x2_pad]
-                                # Check if ROI is valid
-                                if face_roi.size == 0 or face_roi.shape[0] == 0 or face_roi.shape[1] == 0:
-                                    logger.warning(f"Empty face ROI in {image.file_path}")
-                                    continue
-                            except Exception as e:
-                                logger.warning(f"Error extracting face ROI: {str(e)}")
-                                continue
-
-                            # Get face embedding using InsightFace
-                            try:
-                                face_data = self.face_analyzer.get(face_roi)
-                                
-                                if face_data and len(face_data) > 0:
-                                    encoding = face_data[0].embedding  # Extract face encoding
-                                    if encoding is None or len(encoding) == 0:
-                                        logger.warning("Empty face embedding returned")
-                                        continue
-                                        
-                                    matched = False
-                                    person_name = None
-                                    best_match_score = float('inf')
-                                    best_match_name = None
-
-                                    # Compare with known faces
-                                    for name, known_encodings in self.known_face_encodings.items():
-                                        for known_encoding in known_encodings:
-                                            # Ensure compatible shapes for comparison
-                                            if known_encoding.shape != encoding.shape:
-                                                continue
-                                                
-                                            # Calculate distance
-                                            distance = np.linalg.norm(known_encoding - encoding)
-                                            
-                                            # Update best match if better
-                                            if distance < best_match_score:
-                                                best_match_score = distance
-                                                best_match_name = name
-                                            
-                                            # Check if match found
-                                            if distance < self.similarity_threshold:
-                                                person_name = name
-                                                matched = True
-                                                break
-                                        
-                                        if matched:
-                                            break
-
-                                    # If no match found but we have a closest match under a relaxed threshold
-                                    if not matched:
-                                        relaxed_threshold = self.similarity_threshold * 1.2  # 20% more lenient
-                                        if best_match_score < relaxed_threshold:
-                                            person_name = best_match_name
-                                            logger.info(f"Using relaxed threshold match: {person_name} (score: {best_match_score:.3f})")
-                                        else:
-                                            # Generate unique person identifier
-                                            person_name = f"Unknown_{uuid.uuid4().hex[:8]}"
-                                            
-                                            # Store new face encoding
-                                            if person_name not in self.known_face_encodings:
-                                                self.known_face_encodings[person_name] = []
-                                            self.known_face_encodings[person_name].append(encoding)
-                                            logger.info(f"New person detected: {person_name}")
-
-                                    # Save landmarks if available
-                                    landmarks = None
-                                    if "landmarks" in identity:
-                                        landmarks = json.dumps(identity["landmarks"])
-                                        
-                                    # Save confidence if available
-                                    confidence = None
-                                    if "score" in identity:
-                                        confidence = float(identity["score"])
-
-                                    # Save face to database
-                                    encoding_json = json.dumps(encoding.tolist())
-                                    facial_area_json = json.dumps(facial_area)
-                                    
-                                    # Call the updated add_face method with new parameters
-                                    self.db_manager.add_face(
-                                        image_id=image.id,
-                                        person_name=person_name,
-                                        face_encoding=encoding_json,
-                                        facial_area=facial_area_json,
-                                        landmarks=landmarks,
-                                        confidence=confidence
-                                    )
-                                    
-                                    detected += 1
-                                    image_faces_detected += 1
-                                else:
-                                    logger.warning(f"No face data returned for detected face in {image.file_path}")
-                            except Exception as e:
-                                logger.warning(f"Error processing face embedding: {str(e)}")
-                    
-                    # Mark image as processed and update face count
-                    self.db_manager.update_image_processed_status(image.id, True, image_faces_detected)
-                    processed += 1
-                    
-                    # Keep UI responsive by processing events every batch_size images
-                    if processed % batch_size == 0:
-                        QApplication.processEvents()
-                        logger.info(f"Processed {processed}/{total_images} images, detected {detected} faces")
-                        
-                except Exception as e:
-                    logger.error(f"Error processing image {image.file_path}: {str(e)}")
-                    # Continue with next image
-            
-            logger.info(f"Processing complete. Processed {processed} images, detected {detected} faces")
+            if workers is None:
+                workers = self.workers
+            if workers > 1:
+                logger.info(f"Using {workers} face worker processes")
+                completed = self._embed_with_workers(stream(), skip, workers)
+            else:
+                completed = self._embed_in_process(stream(), skip, decoded_images)
+            
+            cancelled = False
+            for image, faces in completed:
+                if faces is None:
+                    watermark.finished(image.id)
+                else:
+                    try:
+                        records, rows = self._prepare_image_faces(image, faces)
+                        writes.add(image.id, records, rows)
+                    except Exception as e:
+                        logger.error(f"Error matching faces of {image.file_path}: {str(e)}")
+                        watermark.finished(image.id)
+                handled += 1
+                
+                if writes.due:
+                    saved_images, saved_faces = self._flush_writes(writes, watermark)
+                    processed += saved_images
+                    detected += saved_faces
+                
+                if handled % batch_size == 0:
+                    if checkpointed:
+                        self.db_manager.set_job_checkpoint(self.CHECKPOINT_NAME, watermark.value)
+                    logger.info(f"Processed {processed}/{total_images} images, detected {detected} faces")
+                
+                if control:
+                    control.update(handled + skipped, total_images, f"{detected} faces")
+                    if control.is_paused:
+                        # Do not hold finished images back while paused
+                        saved_images, saved_faces = self._flush_writes(writes, watermark)
+                        processed += saved_images
+                        detected += saved_faces
+                    if not control.wait_if_paused():
+                        logger.info("Face processing cancelled")
+                        self.cancel_processing()
+                        completed.close()
+                        cancelled = True
+                        break
+            
+            saved_images, saved_faces = self._flush_writes(writes, watermark)
+            processed += saved_images
+            detected += saved_faces
+            if checkpointed:
+                self.db_manager.set_job_checkpoint(self.CHECKPOINT_NAME, watermark.value if cancelled else 0)
+            
+            # Build the index once the gallery has grown past the threshold
+            if self.face_index is None:
+                self._setup_face_index()
+            self._save_gallery()
+            
+            logger.info(f"Processing complete. Processed {processed} images, detected {detected} faces "
+                        f"in {writes.transactions} write transactions")
             return processed, detected
             
         except Exception as e:
             logger.error(f"Fatal error in process_images: {str(e)}")
+            if watermark is not None:
+                saved_images, saved_faces = self._flush_writes(writes, watermark)
+                processed += saved_images
+                detected += saved_faces
+            if watermark is not None and image_ids is None:
+                try:
+                    self.db_manager.set_job_checkpoint(self.CHECKPOINT_NAME, watermark.value)
+                except Exception as checkpoint_error:
+                    logger.warning(f"Failed to save checkpoint: {str(checkpoint_error)}")
+            self._save_gallery()
             return processed, detected
             
+    def cluster_unknown_faces(self, full: bool = False, control: Optional[JobControl] = None) -> Tuple[int, int]:
+        """
+        Merge unnamed persons whose faces group together
+        
+        Face processing creates a new Unknown_ person for every face it
+        cannot match, in the order images happen to be processed. This groups
+        the faces of all unnamed persons with FaceClusterer and merges the
+        persons of each group, in the database and in the gallery. Only faces
+        stored since the last run are grouped unless full is set.
+        
+        Args:
+            full: Group every unnamed face again, not only the new ones
+            control: Optional JobControl for progress and cancel
+            
+        Returns:
+            Tuple of (merged_person_count, moved_face_count)
+        """
+        after_id = 0 if full else self.db_manager.get_job_checkpoint(self.CLUSTER_CHECKPOINT_NAME)
+        face_ids = self.gallery.face_ids
+        last_id = int(face_ids.max()) if face_ids.size else 0
+        # Faces that matching would put together are linked
+        clusterer = FaceClusterer(self.gallery, threshold=self.similarity_threshold * self.RELAXED_THRESHOLD_FACTOR,
+                                  neighbours=self.cluster_neighbours,
+                                  exact_max_faces=self.cluster_exact_max_faces,
+                                  face_index=self.face_index, n_probe=self.index_probes)
+        
+        def progress(done, total):
+            control.update(done, total, "Grouping faces")
+            return control.wait_if_paused()
+        
+        merges = clusterer.cluster(after_id, progress if control else None)
+        if control and control.is_cancelled:
+            logger.info("Face grouping cancelled")
+            return 0, 0
+        
+        moved = 0
+        if merges:
+            self._begin_gallery_update()
+            try:
+                moved = self.db_manager.merge_many_persons(merges)
+                self.gallery.merge_labels(merges)
+            finally:
+                self._save_gallery()
+        self.db_manager.set_job_checkpoint(self.CLUSTER_CHECKPOINT_NAME, last_id)
+        logger.info(f"Merged {len(merges)} unnamed persons, moved {moved} faces")
+        return len(merges), moved
+    
     def add_person(self, person_name: str, face_image_path: str) -> bool:
         """
         Add a new person with reference face image
@@ -265,60 +613,24 @@ class FaceRecognitionProcessor:
             self._init_face_analyzer()
             
             # Read the image
-            img = cv2.imread(face_image_path)
+            img, scale = read_image(face_image_path, self.decode_min_side)
             if img is None:
                 logger.error(f"Failed to read image: {face_image_path}")
                 return False
                 
-            # Detect faces
-            faces = RetinaFace.detect_faces(img)
+            # Detect and embed faces
+            faces = self.pipeline.process(img, face_image_path, scale)
             if not faces:
                 logger.error(f"No faces detected in: {face_image_path}")
                 return False
                 
             # Use the face with highest confidence
-            best_face = None
-            best_score = -1
-            
-            for key in faces:
-                identity = faces[key]
-                if "score" in identity and float(identity["score"]) > best_score:
-                    best_score = float(identity["score"])
-                    best_face = identity
-            
-            if best_face is None:
-                logger.error("No valid face found")
-                return False
-                
-            # Extract face area
-            facial_area = best_face["facial_area"]
-            x1, y1, x2, y2 = facial_area
-            
-            # Add padding
-            height, width = img.shape[:2]
-            pad_x = int((x2 - x1) * 0.05)
-            pad_y = int((y2 - y1) * 0.05)
-            
-            # Ensure padded coordinates are within image bounds
-            x1_pad = max(0, x1 - pad_x)
-            y1_pad = max(0, y1 - pad_y)
-            x2_pad = min(width, x2 + pad_x)
-            y2_pad = min(height, y2 + pad_y)
-            
-            face_roi = img[y1_pad:y2_pad, x1_pad:x2_pad]
-            
-            # Get face embedding
-            face_data = self.face_analyzer.get(face_roi)
-            if not face_data or len(face_data) == 0:
-                logger.error("Failed to get face embedding")
-                return False
-                
-            encoding = face_data[0].embedding
+            _, encoding = max(faces, key=lambda face: float(face[0].get("score", 0)))
             
             # Store the face encoding
-            if person_name not in self.known_face_encodings:
-                self.known_face_encodings[person_name] = []
-            self.known_face_encodings[person_name].append(encoding)
+            self._begin_gallery_update()
+            self._add_to_gallery(encoding, person_name)
+            self._save_gallery()
             
             # You might want to save this reference face to the database
             # For now, we'll just keep it in memory
@@ -356,17 +668,57 @@ class FaceRecognitionProcessor:
         """
         try:
             # First update in memory
-            if old_name in self.known_face_encodings:
-                self.known_face_encodings[new_name] = self.known_face_encodings.pop(old_name)
+            self._begin_gallery_update()
+            self.gallery.rename_label(old_name, new_name)
                 
             # Then update in database
             count = self.db_manager.update_person_name(old_name, new_name)
+            self._save_gallery()
             logger.info(f"Renamed person '{old_name}' to '{new_name}' (updated {count} faces)")
             return True
         except Exception as e:
             logger.error(f"Error renaming person: {str(e)}")
             return False
             
+    def merge_persons(self, source_name: str, target_name: str) -> bool:
+        """
+        Merge one person into another both in memory and database
+        
+        Args:
+            source_name: Person to merge from
+            target_name: Person to merge into
+            
+        Returns:
+            bool: Success status
+        """
+        try:
+            self._begin_gallery_update()
+            self.gallery.rename_label(source_name, target_name)
+            count = self.db_manager.merge_persons(source_name, target_name)
+            self._save_gallery()
+            logger.info(f"Merged person '{source_name}' into '{target_name}' (updated {count} faces)")
+            return True
+        except Exception as e:
+            logger.error(f"Error merging persons: {str(e)}")
+            return False
+            
+    def remove_faces(self, face_ids: List[int]) -> int:
+        """
+        Forget faces that were deleted from the database
+        
+        Args:
+            face_ids: Database ids of the deleted faces
+            
+        Returns:
+            Number of gallery faces removed
+        """
+        self._begin_gallery_update()
+        rows = self.gallery.remove_face_ids(face_ids)
+        if self.face_index is not None:
+            self.face_index.remove(rows)
+        self._save_gallery()
+        return len(rows)
+            
     def search_person_by_image(self, image_path: str) -> List[dict]:
         """
         Search for people in an image
@@ -383,78 +735,34 @@ class FaceRecognitionProcessor:
             self._init_face_analyzer()
             
             # Read the image
-            img = cv2.imread(image_path)
+            img, scale = read_image(image_path, self.decode_min_side)
             if img is None:
                 logger.error(f"Failed to read image: {image_path}")
                 return results
                 
-            # Detect faces
-            faces = RetinaFace.detect_faces(img)
+            # Detect and embed faces
+            faces = self.pipeline.process(img, image_path, scale)
             if not faces:
                 logger.info(f"No faces detected in: {image_path}")
                 return results
                 
-            # Process each face
-            for key in faces:
-                identity = faces[key]
-                facial_area = identity["facial_area"]
-                x1, y1, x2, y2 = facial_area
-                
-                # Extract face ROI with padding
-                try:
-                    # Add padding (5% on each side)
-                    height, width = img.shape[:2]
-                    pad_x = int((x2 - x1) * 0.05)
-                    pad_y = int((y2 - y1) * 0.05)
-                    
-                    # Ensure padded coordinates are within image bounds
-                    x1_pad = max(0, x1 - pad_x)
-                    y1_pad = max(0, y1 - pad_y)
-                    x2_pad = min(width, x2 + pad_x)
-                    y2_pad = min(height, y2 + pad_y)
-                    
-                    face_roi = img[y1_pad:y2_pad, x1_pad:x2_pad]
-                except Exception as e:
-                    logger.warning(f"Error extracting face ROI: {str(e)}")
-                    continue
-                    
-                # Get face embedding
-                face_data = self.face_analyzer.get(face_roi)
-                if not face_data or len(face_data) == 0:
-                    continue
-                    
-                encoding = face_data[0].embedding
-                
-                # Find best match
-                best_match = {"name": "Unknown", "distance": float('inf'), "confidence": 0.0}
-                
-                for name, known_encodings in self.known_face_encodings.items():
-                    for known_encoding in known_encodings:
-                        if known_encoding.shape != encoding.shape:
-                            continue
-                            
-                        distance = np.linalg.norm(known_encoding - encoding)
-                        
-                        if distance < best_match["distance"]:
-                            confidence = max(0, min(100, 100 * (1 - distance / 2)))
-                            best_match = {
-                                "name": name,
-                                "distance": distance,
-                                "confidence": confidence
-                            }
-                
+            encodings = [encoding for _, encoding in faces]
+            facial_areas = [[int(v) for v in identity["facial_area"]] for identity, _ in faces]
+            
+            # Find best match for all faces at once
+            for facial_area, (name, distance) in zip(facial_areas, self._match_encodings(np.stack(encodings))):
                 # Only include matches with reasonable confidence
-                if best_match["distance"] < self.similarity_threshold * 1.2:
+                if name is not None:
                     results.append({
-                        "name": best_match["name"],
-                        "confidence": best_match["confidence"],
-                        "facial_area": [int(x1), int(y1), int(x2), int(y2)]
+                        "name": name,
+                        "confidence": max(0, min(100, 100 * (1 - distance / 2))),
+                        "facial_area": facial_area
                     })
                 else:
                     results.append({
                         "name": "Unknown",
                         "confidence": 0.0,
-                        "facial_area": [int(x1), int(y1), int(x2), int(y2)]
+                        "facial_area": facial_area
                     })
                     
             return results
@@ -0,0 +1,209 @@
+import os
+import queue
+import logging
+import threading
+import multiprocessing
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger('FaceWorkerPool')
+
+
+def _put(target, item, cancel_event, timeout: float = 0.5) -> bool:
+    """Put an item on a bounded queue, retrying until it fits or the run is cancelled"""
+    while not cancel_event.is_set():
+        try:
+            target.put(item, timeout=timeout)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _worker_main(worker_id: int, settings: dict, tasks, results, cancel_event) -> None:
+    """
+    Worker process: load the models once, then detect and embed queued images.
+
+    Runs with one math thread so several workers can share the machine
+    without oversubscribing cores.
+    """
+    os.environ['OMP_NUM_THREADS'] = '1'
+    try:
+        import cv2
+        from insightface.app import FaceAnalysis
+        from utils.face_pipeline import FacePipeline, EmbeddingBatcher
+        from utils.image_loader import read_image
+
+        cv2.setNumThreads(1)
+        analyzer = FaceAnalysis(allowed_modules=['detection', 'recognition'])
+        analyzer.prepare(ctx_id=-1 if settings['cpu_only'] else 0, det_size=settings['det_size'])
+        pipeline = FacePipeline(analyzer, mode=settings['pipeline_mode'], thumbnail_size=settings['thumbnail_size'])
+        batcher = EmbeddingBatcher(pipeline, settings['batch_size'], settings['batch_timeout'])
+    except Exception as e:
+        _put(results, ('fatal', worker_id, f"Worker {worker_id} failed to start: {str(e)}"), cancel_event)
+        return
+
+    def send(completed):
+        for key, faces in completed:
+            _put(results, ('result', key, faces), cancel_event)
+
+    try:
+        while not cancel_event.is_set():
+            try:
+                task = tasks.get(timeout=batcher.timeout if len(batcher) else 0.5)
+            except queue.Empty:
+                send(batcher.flush())
+                continue
+            if task is None:
+                break
+
+            key, path = task
+            try:
+                img, scale = read_image(path, settings['decode_min_side'])
+                if img is None:
+                    _put(results, ('error', key, f"Failed to read image: {path}"), cancel_event)
+                    continue
+                send(batcher.add(key, img, path, scale))
+            except Exception as e:
+                _put(results, ('error', key, f"Error processing image {path}: {str(e)}"), cancel_event)
+
+        if not cancel_event.is_set():
+            send(batcher.flush())
+    finally:
+        if cancel_event.is_set():
+            # Nobody may be reading anymore, do not block exit on a full pipe
+            results.cancel_join_thread()
+        _put(results, ('done', worker_id, None), cancel_event)
+
+
+class FaceWorkerPool:
+    """
+    Pool of processes that detect and embed faces in parallel.
+
+    Each worker loads the detector and recognition model once, takes image
+    paths from a bounded task queue and returns (identity, embedding) pairs
+    on a bounded result queue.
+    The caller consumes results from run() on a single thread, which keeps
+    gallery matching and database writes in one place.
+    """
+
+    # Results queued for the writer per queued image path
+    RESULT_QUEUE_FACTOR = 2
+
+    def __init__(self, workers: int, det_size: Tuple[int, int] = (640, 640), pipeline_mode: str = 'single_pass',
+                 batch_size: int = 32, batch_timeout: float = 0.5, queue_size: Optional[int] = None,
+                 cpu_only: bool = True, decode_min_side: int = 1024, thumbnail_size: int = 0):
+        """
+        Initialize the pool.
+
+        Args:
+            workers: Number of worker processes
+            det_size: Detection size for face analysis
+            pipeline_mode: FacePipeline mode used by the workers
+            batch_size: Embedding batch size inside each worker
+            batch_timeout: Embedding batch timeout inside each worker
+            queue_size: Maximum queued image paths, defaults to 4 per worker
+            cpu_only: Run the models on CPU, set to False to let workers use ctx 0
+            decode_min_side: Shorter side images are decoded at, 0 for full resolution
+            thumbnail_size: Longest side of the face thumbnails returned with
+                the identities, 0 for none
+        """
+        self.workers = max(1, workers)
+        self.settings = {
+            'det_size': det_size,
+            'pipeline_mode': pipeline_mode,
+            'batch_size': batch_size,
+            'batch_timeout': batch_timeout,
+            'cpu_only': cpu_only,
+            'decode_min_side': decode_min_side,
+            'thumbnail_size': thumbnail_size,
+        }
+        self.queue_size = queue_size or 4 * self.workers
+        self._context = multiprocessing.get_context('spawn')
+        self._cancel_event = self._context.Event()
+        self._processes: List[multiprocessing.Process] = []
+
+    def cancel(self) -> None:
+        """Stop feeding and processing images; results already queued are discarded"""
+        self._cancel_event.set()
+
+    def run(self, tasks: Iterable[Tuple[Any, str]]) -> Iterator[Tuple[Any, Optional[list]]]:
+        """
+        Detect and embed faces of many images.
+
+        Args:
+            tasks: Iterable of (key, image path)
+
+        Yields:
+            (key, faces) per image as workers finish them, where faces is a
+            list of (identity, embedding) pairs, or None if the image failed
+        """
+        task_queue = self._context.Queue(maxsize=self.queue_size)
+        # Workers wait when the writer falls behind instead of piling up results
+        result_queue = self._context.Queue(maxsize=self.RESULT_QUEUE_FACTOR * self.queue_size)
+        self._cancel_event.clear()
+        self._processes = [
+            self._context.Process(target=_worker_main, name=f"face-worker-{i}",
+                                  args=(i, self.settings, task_queue, result_queue, self._cancel_event),
+                                  daemon=True)
+            for i in range(self.workers)
+        ]
+        for process in self._processes:
+            process.start()
+
+        submitted = 0
+
+        def feed():
+            nonlocal submitted
+            try:
+                for task in tasks:
+                    if not _put(task_queue, task, self._cancel_event):
+                        break
+                    submitted += 1
+            except Exception as e:
+                logger.error(f"Error reading tasks: {str(e)}")
+            finally:
+                # One end marker per worker unless the run was cancelled; a
+                # worker without one never reports done, so wait for room
+                for _ in self._processes:
+                    if not _put(task_queue, None, self._cancel_event):
+                        break
+
+        feeder = threading.Thread(target=feed, name='face-worker-feeder', daemon=True)
+        feeder.start()
+
+        running = len(self._processes)
+        try:
+            while running and not self._cancel_event.is_set():
+                try:
+                    kind, key, payload = result_queue.get(timeout=0.5)
+                except queue.Empty:
+                    if not any(p.is_alive() for p in self._processes):
+                        logger.error("All face workers exited unexpectedly")
+                        break
+                    continue
+
+                if kind == 'result':
+                    yield key, payload
+                elif kind == 'error':
+                    logger.warning(payload)
+                    yield key, None
+                elif kind == 'fatal':
+                    logger.error(payload)
+                    running -= 1
+                elif kind == 'done':
+                    running -= 1
+        finally:
+            # Also reached when the consumer stops iterating early
+            self._cancel_event.set()
+            feeder.join(timeout=5)
+            self._shutdown()
+            logger.info(f"Face workers stopped after {submitted} submitted images")
+
+    def _shutdown(self) -> None:
+        for process in self._processes:
+            process.join(timeout=5)
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout=1)
+        self._processes = []
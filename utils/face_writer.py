@@ -0,0 +1,93 @@
+import time
+import logging
+from typing import Any, Dict, List, Tuple
+
+logger = logging.getLogger('FaceWriteBuffer')
+
+
+class FaceWriteBuffer:
+    """
+    Buffers the faces and processed flags of finished images.
+
+    Images are written together once max_images are pending or the oldest
+    pending image has waited max_delay seconds, in a single transaction per
+    flush. Each image's faces and its processed flag always land in the same
+    transaction.
+    """
+
+    def __init__(self, db_manager, max_images: int = 50, max_delay: float = 2.0):
+        """
+        Initialize the buffer.
+
+        Args:
+            db_manager: Database manager used to write the images
+            max_images: Number of pending images that triggers a flush
+            max_delay: Maximum seconds an image waits before it is written
+        """
+        self.db_manager = db_manager
+        self.max_images = max(1, max_images)
+        self.max_delay = max_delay
+        self._images: List[Tuple[int, List[Dict[str, Any]]]] = []
+        self._rows: List[List[int]] = []
+        self._oldest = 0.0
+        self.transactions = 0
+
+    def __len__(self) -> int:
+        """Number of images waiting to be written"""
+        return len(self._images)
+
+    @property
+    def image_ids(self) -> List[int]:
+        return [image_id for image_id, _ in self._images]
+
+    @property
+    def faces(self) -> List[Dict[str, Any]]:
+        """Pending face dicts, in the order flush returns their Face ids"""
+        return [face for _, faces in self._images for face in faces]
+
+    @property
+    def gallery_rows(self) -> List[int]:
+        """Gallery rows added for the pending faces"""
+        return [row for rows in self._rows for row in rows]
+
+    @property
+    def due(self) -> bool:
+        """Whether the buffer should be flushed now"""
+        if not self._images:
+            return False
+        return len(self._images) >= self.max_images or time.monotonic() - self._oldest >= self.max_delay
+
+    def add(self, image_id: int, faces: List[Dict[str, Any]], rows: List[int]) -> None:
+        """
+        Queue a processed image.
+
+        Args:
+            image_id: Id of the processed image
+            faces: Face dicts as taken by DatabaseManager.save_processed_images
+            rows: Gallery row of each face, to receive its Face id once written
+        """
+        if not self._images:
+            self._oldest = time.monotonic()
+        self._images.append((image_id, faces))
+        self._rows.append(rows)
+
+    def flush(self) -> Tuple[List[int], List[int]]:
+        """
+        Write every pending image.
+
+        The buffer is emptied even if the write fails; the exception is
+        raised after the database transaction was rolled back.
+
+        Returns:
+            Tuple of (gallery rows, Face ids) for the written faces
+        """
+        images, rows = self._images, self._rows
+        self._images, self._rows = [], []
+        if not images:
+            return [], []
+
+        self.transactions += 1
+        face_ids = self.db_manager.save_processed_images(images)
+        flat_rows = [row for image_rows in rows for row in image_rows]
+        flat_ids = [face_id for ids in face_ids for face_id in ids]
+        return flat_rows, flat_ids
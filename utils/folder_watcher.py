@@ -0,0 +1,317 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from utils.library_scanner import MEDIA_EXTENSIONS, iter_media_files
+
+logger = logging.getLogger('FolderWatcher')
+
+
+class _InotifyBackend:
+    """Linux inotify through ctypes, watching every folder of the trees"""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+
+    WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+                  IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+    EVENT = struct.Struct('iIII')
+
+    name = 'inotify'
+
+    def __init__(self, folders: Sequence[str]):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders: Dict[int, str] = {}
+        # Set once a new folder could not be watched because of the watch limit
+        self.watch_limit_reached = False
+        try:
+            for folder in folders:
+                self._watch_tree(folder)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, folder: str) -> None:
+        wd = self._add_watch(self._fd, os.fsencode(folder), self.WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, "inotify watch limit reached, raise fs.inotify.max_user_watches")
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                return  # Removed in the meantime
+            raise OSError(error, f"Cannot watch {folder}")
+        self._folders[wd] = folder
+
+    def _watch_tree(self, folder: str) -> None:
+        stack = [folder]
+        while stack:
+            directory = stack.pop()
+            self._watch(directory)
+            try:
+                with os.scandir(directory) as entries:
+                    stack.extend(entry.path for entry in entries
+                                 if not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False))
+            except OSError:
+                continue
+
+    def poll(self, timeout: float) -> Tuple[List[str], List[str]]:
+        """
+        Wait for events.
+
+        Returns:
+            Tuple of (touched file paths, folders to rescan)
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return [], []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return [], []
+
+        files, rescan = [], []
+        offset = 0
+        while offset + self.EVENT.size <= len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # Events were lost, fall back to scanning everything
+                rescan.extend(set(self._folders.values()))
+                continue
+            if mask & self.IN_IGNORED:
+                self._folders.pop(wd, None)
+                continue
+            folder = self._folders.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, name)
+            if mask & self.IN_ISDIR:
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and not name.startswith('.'):
+                    # Files may land before the new folder is watched, so scan it as well
+                    try:
+                        self._watch_tree(path)
+                    except OSError as e:
+                        # Scanned once, later changes in it are missed
+                        logger.warning(f"Cannot watch new folder {path}: {str(e)}")
+                        if e.errno == errno.ENOSPC:
+                            self.watch_limit_reached = True
+                    rescan.append(path)
+                elif mask & (self.IN_DELETE | self.IN_MOVED_FROM):
+                    rescan.append(path)
+            else:
+                files.append(path)
+        return files, rescan
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class _PollingBackend:
+    """Periodic scandir walk comparing sizes and modification times"""
+
+    name = 'polling'
+
+    def __init__(self, folders: Sequence[str], interval: float):
+        self.folders = list(folders)
+        self.interval = interval
+        self._next_poll = 0.0
+        self._files = self._snapshot()
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        files = {}
+        for folder in self.folders:
+            try:
+                for entry in iter_media_files(folder):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError as e:
+                logger.warning(f"Cannot poll folder {folder}: {str(e)}")
+        return files
+
+    def poll(self, timeout: float) -> Tuple[List[str], List[str]]:
+        wait = self._next_poll - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            return [], []
+        self._next_poll = time.monotonic() + self.interval
+
+        files = self._snapshot()
+        touched = [path for path, stat in files.items() if self._files.get(path) != stat]
+        touched.extend(path for path in self._files if path not in files)
+        self._files = files
+        return touched, []
+
+    def close(self) -> None:
+        self._files = {}
+
+
+class FolderWatcher:
+    """
+    Reports media files that appear, change or disappear under some folders.
+
+    Uses inotify on Linux and falls back to polling elsewhere or when inotify
+    is unavailable (for example when the watch limit is reached), also once
+    it is running; every folder is then scanned once. Files are
+    only reported once they have been quiet for settle_time seconds and their
+    size no longer changes, so files still being copied are not picked up
+    half written. Runs on its own thread; on_change and on_error are called
+    from it.
+    """
+
+    def __init__(self, folders: Sequence[str], on_change: Callable[[List[str]], None],
+                 settle_time: float = 2.0, poll_interval: float = 10.0, backend: str = 'auto',
+                 on_error: Optional[Callable[[str], None]] = None):
+        """
+        Initialize a watcher.
+
+        Args:
+            folders: Folders to watch, with their subfolders
+            on_change: Called with the settled paths; folder paths mean the
+                folder needs a full scan
+            settle_time: Seconds a file must be quiet before it is reported
+            poll_interval: Seconds between two walks of the polling backend
+            backend: 'auto', 'inotify' or 'polling'
+            on_error: Called with a message when watching stopped on an error
+        """
+        self.folders = [os.path.abspath(folder) for folder in folders]
+        self.on_change = on_change
+        self.on_error = on_error
+        self.settle_time = settle_time
+        self.poll_interval = poll_interval
+        self.backend_name = backend
+        self._backend = None
+        self._pending: Dict[str, Tuple[float, Optional[int]]] = {}  # path -> (last event, size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def backend(self) -> Optional[str]:
+        """Name of the backend in use"""
+        return self._backend.name if self._backend else None
+
+    def _create_backend(self):
+        if self.backend_name != 'polling' and sys.platform.startswith('linux'):
+            try:
+                return _InotifyBackend(self.folders)
+            except (OSError, AttributeError) as e:
+                if self.backend_name == 'inotify':
+                    raise
+                logger.warning(f"inotify unavailable, polling instead: {str(e)}")
+        return _PollingBackend(self.folders, self.poll_interval)
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._stop.clear()
+        self._backend = self._create_backend()
+        self._thread = threading.Thread(target=self._run, name='folder-watcher', daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {len(self.folders)} folders with {self._backend.name}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._backend is not None:
+            self._backend.close()
+            self._backend = None
+
+    def _fall_back_to_polling(self, reason: str) -> bool:
+        """Replace a failed inotify backend, returns False if watching cannot go on"""
+        if self._backend.name == 'polling' or self.backend_name == 'inotify':
+            return False
+        logger.warning(f"{reason}, polling instead")
+        self._backend.close()
+        try:
+            self._backend = _PollingBackend(self.folders, self.poll_interval)
+        except Exception as e:
+            logger.error(f"Cannot poll folders: {str(e)}")
+            return False
+        # Changes may have been missed before the switch
+        now = time.monotonic()
+        for folder in self.folders:
+            self._pending[folder] = (now, self._size(folder))
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                files, rescan = self._backend.poll(timeout=min(0.5, self.settle_time))
+            except Exception as e:
+                if self._fall_back_to_polling(f"{self._backend.name} failed: {str(e)}"):
+                    continue
+                logger.error(f"Folder watcher failed: {str(e)}")
+                if self.on_error:
+                    self.on_error(str(e))
+                break
+            now = time.monotonic()
+            for path in files:
+                if os.path.splitext(path)[1].lower() in MEDIA_EXTENSIONS:
+                    self._pending[path] = (now, self._size(path))
+            for path in rescan:
+                self._pending[path] = (now, self._size(path))
+            if getattr(self._backend, 'watch_limit_reached', False):
+                self._fall_back_to_polling("inotify watch limit reached")
+            self._report(now)
+
+    @staticmethod
+    def _size(path: str) -> Optional[int]:
+        try:
+            return os.stat(path).st_size
+        except OSError:
+            return None
+
+    def _report(self, now: float) -> None:
+        ready = []
+        for path, (last_event, size) in list(self._pending.items()):
+            if now - last_event < self.settle_time:
+                continue
+            current = self._size(path)
+            if current != size:
+                # Still growing without events, e.g. on a network share
+                self._pending[path] = (now, current)
+                continue
+            ready.append(path)
+            del self._pending[path]
+
+        if ready:
+            try:
+                self.on_change(ready)
+            except Exception as e:
+                logger.error(f"Error handling changed files: {str(e)}")
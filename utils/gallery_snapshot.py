@@ -0,0 +1,191 @@
+import os
+import json
+import glob
+import logging
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.face_gallery import FaceGallery
+
+logger = logging.getLogger('GallerySnapshot')
+
+
+class GallerySnapshot:
+    """
+    Versioned on-disk copy of a FaceGallery that is memory-mapped at startup.
+
+    The snapshot directory holds one .npy file per gallery array, sized to the
+    gallery capacity, a labels.json label table and a manifest.json with the
+    number of rows in use and the database watermark the snapshot matches.
+    A gallery opened from the snapshot writes appends, merges and removals
+    straight into the mapped files; flush() then records the new row count
+    and watermark. The manifest is marked dirty before any change, so a crash
+    between a database write and the next flush forces a full reload.
+
+    Faces without a database row, such as the reference faces of add_person,
+    share the mapped files with the stored ones but are not part of the
+    snapshot: load() drops them, so the mapped gallery always holds what a
+    database reload would.
+    """
+
+    FORMAT_VERSION = 1
+    ARRAYS = ('embeddings', 'sq_norms', 'labels', 'face_ids')
+
+    def __init__(self, directory: str):
+        """
+        Initialize a snapshot stored in a directory.
+
+        Args:
+            directory: Snapshot directory, created on first write
+        """
+        self.directory = directory
+        self.gallery: Optional[FaceGallery] = None
+        self._generation = 0
+        self._watermark: Sequence[int] = ()
+        self._dirty = False
+
+    def _path(self, name: str, generation: Optional[int] = None) -> str:
+        if generation is None:
+            return os.path.join(self.directory, name)
+        return os.path.join(self.directory, f"{name}-{generation}.npy")
+
+    def _read_manifest(self) -> Optional[dict]:
+        try:
+            with open(self._path('manifest.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, name: str, data) -> None:
+        path = self._path(name)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _write_manifest(self, clean: bool) -> None:
+        gallery = self.gallery
+        self._write_json('manifest.json', {
+            'version': self.FORMAT_VERSION,
+            'generation': self._generation,
+            'dim': gallery.dim,
+            'count': len(gallery),
+            'watermark': list(self._watermark),
+            'clean': clean,
+        })
+
+    def _allocate(self, capacity: int, dim: int) -> Tuple[np.ndarray, ...]:
+        """Create a new generation of mapped arrays for a gallery that outgrew the old one"""
+        self._generation += 1
+        shapes = {
+            'embeddings': ((capacity, dim), np.float32),
+            'sq_norms': ((capacity,), np.float32),
+            'labels': ((capacity,), np.int32),
+            'face_ids': ((capacity,), np.int64),
+        }
+        return tuple(
+            np.lib.format.open_memmap(self._path(name, self._generation), mode='w+',
+                                      dtype=shapes[name][1], shape=shapes[name][0])
+            for name in self.ARRAYS
+        )
+
+    def load(self, watermark: Sequence[int]) -> Optional[FaceGallery]:
+        """
+        Memory-map the snapshot if it matches the database.
+
+        Args:
+            watermark: Current database watermark
+
+        Returns:
+            The mapped gallery, or None if the snapshot is missing, dirty,
+            from another format version or behind the database
+        """
+        manifest = self._read_manifest()
+        if not manifest:
+            return None
+        if manifest.get('version') != self.FORMAT_VERSION or not manifest.get('clean'):
+            logger.info("Gallery snapshot is outdated or was not closed cleanly")
+            return None
+        if list(manifest.get('watermark', [])) != list(watermark):
+            logger.info(f"Gallery snapshot watermark {manifest.get('watermark')} does not match database {list(watermark)}")
+            return None
+
+        try:
+            generation = manifest['generation']
+            arrays = [np.load(self._path(name, generation), mmap_mode='r+') for name in self.ARRAYS]
+            with open(self._path('labels.json')) as f:
+                label_table = json.load(f)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Failed to open gallery snapshot: {str(e)}")
+            return None
+
+        self._generation = generation
+        self._watermark = list(watermark)
+        self.gallery = FaceGallery.from_arrays(
+            *arrays, size=manifest['count'],
+            label_names=label_table['names'], label_codes=label_table['codes'],
+            allocator=self._allocate)
+        unsaved = np.flatnonzero((self.gallery.face_ids < 0) & (self.gallery.labels >= 0))
+        if unsaved.size:
+            self.gallery.remove_rows(unsaved)
+            logger.info(f"Dropped {unsaved.size} faces that are not stored in the database")
+        self._dirty = False
+        logger.info(f"Mapped gallery snapshot with {manifest['count']} faces")
+        return self.gallery
+
+    def write(self, gallery: FaceGallery, watermark: Sequence[int]) -> None:
+        """
+        Replace the snapshot with the contents of a gallery.
+
+        The gallery is moved onto the new snapshot files in place, so objects
+        holding a reference to it (such as an index) stay valid. Empty
+        galleries are not written.
+
+        Args:
+            gallery: Gallery to snapshot
+            watermark: Database watermark the gallery corresponds to
+        """
+        if gallery.dim is None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        # Invalidate whatever snapshot is on disk until the new one is complete
+        self.gallery = gallery
+        self._dirty = False
+        self.mark_dirty()
+        gallery.attach_storage(self._allocate)
+        self.flush(watermark)
+
+    def mark_dirty(self) -> None:
+        """Record in the manifest that the database is about to change"""
+        if self.gallery is None or self._dirty:
+            return
+        self._write_manifest(clean=False)
+        self._dirty = True
+
+    def flush(self, watermark: Sequence[int]) -> None:
+        """
+        Write pending changes and mark the snapshot clean.
+
+        Args:
+            watermark: Database watermark after the changes
+        """
+        gallery = self.gallery
+        if gallery is None:
+            return
+        gallery.flush()
+        names, codes = gallery.label_table()
+        self._write_json('labels.json', {'names': names, 'codes': codes})
+        self._watermark = list(watermark)
+        self._write_manifest(clean=True)
+        self._dirty = False
+        self._remove_stale_generations()
+
+    def _remove_stale_generations(self) -> None:
+        current = f"-{self._generation}.npy"
+        for path in glob.glob(os.path.join(self.directory, '*-*.npy')):
+            if not path.endswith(current):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
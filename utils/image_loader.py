@@ -0,0 +1,150 @@
+import io
+import logging
+import threading
+from collections import OrderedDict
+from typing import BinaryIO, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger('ImageLoader')
+
+# Scales libjpeg decodes at directly in the DCT domain, largest first
+REDUCED_READ_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def image_size(source: Union[str, BinaryIO]) -> Optional[Tuple[int, int]]:
+    """
+    Get the stored pixel size of an image from its header.
+
+    Args:
+        source: File path or binary file object
+
+    Returns:
+        (width, height), None if the file cannot be identified
+    """
+    try:
+        with Image.open(source) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def reduction_factor(width: int, height: int, min_side: int) -> int:
+    """
+    Pick the largest decode reduction that keeps the shorter side at least min_side.
+
+    Returns:
+        8, 4, 2 or 1
+    """
+    if min_side <= 0:
+        return 1
+    shorter = min(width, height)
+    for factor, _ in REDUCED_READ_FLAGS:
+        if shorter // factor >= min_side:
+            return factor
+    return 1
+
+
+def read_image(file_path: str, min_side: int = 0) -> Tuple[Optional[np.ndarray], float]:
+    """
+    Decode an image as BGR at the smallest scale that still serves min_side.
+
+    JPEGs are decoded at 1/2, 1/4 or 1/8 scale by libjpeg, which skips most
+    of the inverse DCT work and never allocates the full-size image. Other
+    formats are decoded fully and then scaled down. EXIF orientation is
+    applied like a plain cv2.imread.
+
+    Args:
+        file_path: Image to read
+        min_side: Minimum length of the shorter side, 0 for full resolution
+
+    Returns:
+        Tuple of (image, scale) where scale maps decoded pixel coordinates
+        to original ones; image is None if the file cannot be decoded
+    """
+    size = image_size(file_path) if min_side > 0 else None
+    return _decoded(lambda flag: cv2.imread(file_path, flag), size, min_side)
+
+
+def decode_image(data: bytes, min_side: int = 0) -> Tuple[Optional[np.ndarray], float]:
+    """
+    Like read_image, for a file already read into memory.
+
+    Args:
+        data: Encoded image bytes
+        min_side: Minimum length of the shorter side, 0 for full resolution
+
+    Returns:
+        Tuple of (image, scale), image is None if the data cannot be decoded
+    """
+    size = image_size(io.BytesIO(data)) if min_side > 0 else None
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    return _decoded(lambda flag: cv2.imdecode(buffer, flag), size, min_side)
+
+
+def _decoded(decode, size, min_side):
+    factor = reduction_factor(*size, min_side) if size else 1
+    img = decode(dict(REDUCED_READ_FLAGS).get(factor, cv2.IMREAD_COLOR))
+    if img is None:
+        return None, 1.0
+    if factor == 1:
+        return img, 1.0
+    # Longer sides are compared, EXIF orientation may have swapped width and height
+    return img, max(size) / max(img.shape[:2])
+
+
+class DecodedImageCache:
+    """
+    Hands decoded images from one stage of a job to a later one.
+
+    Ingest decodes the images it reads for face detection and face
+    processing takes them from here instead of reading the files again.
+    Images are kept up to budget bytes; the oldest are dropped beyond it and
+    simply read again by whoever needs them. Thread safe.
+    """
+
+    def __init__(self, budget: int = 256 * 1024 * 1024):
+        """
+        Args:
+            budget: Bytes of decoded pixels kept
+        """
+        self.budget = budget
+        self._images: 'OrderedDict[str, Tuple[np.ndarray, float]]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def put(self, file_path: str, img: np.ndarray, scale: float) -> None:
+        if img.nbytes > self.budget:
+            return
+        with self._lock:
+            self._discard(file_path)
+            self._images[file_path] = (img, scale)
+            self._bytes += img.nbytes
+            while self._bytes > self.budget:
+                self._discard(next(iter(self._images)))
+
+    def pop(self, file_path: str) -> Optional[Tuple[np.ndarray, float]]:
+        """Take an image out of the cache, None if it is not there"""
+        with self._lock:
+            entry = self._images.get(file_path)
+            self._discard(file_path)
+            return entry
+
+    def _discard(self, file_path: str) -> None:
+        entry = self._images.pop(file_path, None)
+        if entry is not None:
+            self._bytes -= entry[0].nbytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._images.clear()
+            self._bytes = 0
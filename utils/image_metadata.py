@@ -0,0 +1,186 @@
+import io
+import os
+import struct
+import logging
+import datetime
+from typing import Any, BinaryIO, Callable, NamedTuple, Optional, Tuple
+
+import exifread
+
+logger = logging.getLogger('ImageMetadata')
+
+# JPEG start-of-frame markers, which carry the image size
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+_PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class ImageMetadata(NamedTuple):
+    """Capture details stored with an image"""
+    timestamp: Optional[datetime.datetime]
+    location: str            # "lat,lon" in decimal degrees, empty if unknown
+    width: Optional[int]
+    height: Optional[int]
+    orientation: Optional[int]  # EXIF orientation, 1 is upright
+
+
+def _read_jpeg(f: BinaryIO) -> Tuple[Optional[bytes], Optional[int], Optional[int]]:
+    """Walk the JPEG markers up to the scan data, reading only the EXIF segment and the frame header"""
+    if f.read(2) != b'\xff\xd8':
+        return None, None, None
+    exif = None
+    while True:
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            break
+        marker = header[1]
+        if marker == 0xFF:
+            # Fill byte, the marker starts one byte later
+            f.seek(-3, io.SEEK_CUR)
+            continue
+        length = struct.unpack('>H', header[2:])[0]
+        if marker == 0xDA or length < 2:
+            break  # Start of scan, no more headers
+        if marker == 0xE1 and exif is None:
+            segment = f.read(length - 2)
+            if segment.startswith(b'Exif\x00\x00'):
+                exif = segment[6:]
+            continue
+        if marker in _SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) == 5:
+                height, width = struct.unpack('>HH', frame[1:5])
+                return exif, width, height
+            break
+        f.seek(length - 2, io.SEEK_CUR)
+    return exif, None, None
+
+
+def _read_png(f: BinaryIO) -> Tuple[Optional[bytes], Optional[int], Optional[int]]:
+    """Read the PNG size from IHDR and the eXIf chunk, skipping all other chunk data"""
+    if f.read(8) != _PNG_SIGNATURE:
+        return None, None, None
+    width = height = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, kind = struct.unpack('>I4s', header)
+        if kind == b'IHDR':
+            width, height = struct.unpack('>II', f.read(8))
+            f.seek(length - 8 + 4, io.SEEK_CUR)
+        elif kind == b'eXIf':
+            return f.read(length), width, height
+        elif kind in (b'IDAT', b'IEND'):
+            break  # eXIf has to come before the image data
+        else:
+            f.seek(length + 4, io.SEEK_CUR)
+    return None, width, height
+
+
+def _read_gif(f: BinaryIO) -> Tuple[Optional[bytes], Optional[int], Optional[int]]:
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b'GIF':
+        return None, None, None
+    width, height = struct.unpack('<HH', header[6:10])
+    return None, width, height
+
+
+def _read_bmp(f: BinaryIO) -> Tuple[Optional[bytes], Optional[int], Optional[int]]:
+    header = f.read(26)
+    if len(header) < 26 or header[:2] != b'BM':
+        return None, None, None
+    width, height = struct.unpack('<ii', header[18:26])
+    return None, width, abs(height)  # Negative height means top-down rows
+
+
+_READERS = {
+    '.jpg': _read_jpeg,
+    '.jpeg': _read_jpeg,
+    '.png': _read_png,
+    '.gif': _read_gif,
+    '.bmp': _read_bmp,
+}
+
+
+def _degrees(tag, ref) -> Optional[float]:
+    """Convert an EXIF degrees/minutes/seconds GPS tag to signed decimal degrees"""
+    try:
+        values = [float(v.num) / float(v.den) if hasattr(v, 'num') else float(v) for v in tag.values]
+    except (ZeroDivisionError, TypeError, ValueError):
+        return None
+    values += [0.0] * (3 - len(values))
+    degrees = values[0] + values[1] / 60 + values[2] / 3600
+    if ref is not None and str(ref).strip().upper() in ('S', 'W'):
+        degrees = -degrees
+    return degrees
+
+
+def _parse_exif(tiff: bytes) -> dict:
+    """Parse a raw EXIF (TIFF) block without maker notes or thumbnails"""
+    try:
+        return exifread.process_file(io.BytesIO(tiff), details=False, extract_thumbnail=False)
+    except TypeError:
+        # exifread before 3.0 has no extract_thumbnail argument
+        return exifread.process_file(io.BytesIO(tiff), details=False)
+
+
+def read_metadata(file_path: str, fallback_time: Optional[datetime.datetime] = None,
+                  opener: Callable[..., Any] = open) -> ImageMetadata:
+    """
+    Read capture time, GPS position, orientation and size from an image header.
+
+    Only the container headers and the EXIF block are read. JPEG markers and
+    PNG chunks are skipped with seeks, and maker notes and embedded
+    thumbnails are never parsed. Formats without EXIF, including videos,
+    get the fallback time.
+
+    Args:
+        file_path: Image path
+        fallback_time: Timestamp used when the file has no capture time
+        opener: Function opening the file for binary reading
+
+    Returns:
+        ImageMetadata
+    """
+    reader = _READERS.get(os.path.splitext(file_path)[1].lower())
+    if reader is None:
+        return ImageMetadata(fallback_time, "", None, None, None)
+
+    try:
+        with opener(file_path, 'rb') as f:
+            exif, width, height = reader(f)
+    except (OSError, struct.error) as e:
+        logger.debug(f"Cannot read header of {file_path}: {str(e)}")
+        return ImageMetadata(fallback_time, "", None, None, None)
+
+    timestamp = fallback_time
+    location = ""
+    orientation = None
+    if exif:
+        try:
+            tags = _parse_exif(exif)
+        except Exception as e:
+            logger.debug(f"Cannot parse EXIF of {file_path}: {str(e)}")
+            tags = {}
+
+        date_tag = tags.get('EXIF DateTimeOriginal') or tags.get('Image DateTime')
+        if date_tag is not None:
+            try:
+                timestamp = datetime.datetime.strptime(str(date_tag).strip(), '%Y:%m:%d %H:%M:%S')
+            except ValueError:
+                pass
+
+        if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
+            lat = _degrees(tags['GPS GPSLatitude'], tags.get('GPS GPSLatitudeRef'))
+            lon = _degrees(tags['GPS GPSLongitude'], tags.get('GPS GPSLongitudeRef'))
+            if lat is not None and lon is not None:
+                location = f"{lat:.6f},{lon:.6f}"
+
+        if 'Image Orientation' in tags:
+            try:
+                orientation = int(tags['Image Orientation'].values[0])
+            except (IndexError, TypeError, ValueError):
+                pass
+
+    return ImageMetadata(timestamp, location, width, height, orientation)
+
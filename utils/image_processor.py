@@ -1,80 +1,262 @@
 import os
-import datetime
-import exifread
-from PyQt5.QtWidgets import QApplication
+import logging
+
+from utils.image_loader import DecodedImageCache
+from utils.ingest_pipeline import IngestPipeline
+from utils.library_scanner import LibraryScanner, FileFingerprint, KnownFile, iter_media_files
+
+logger = logging.getLogger('ImageProcessor')
 
 class ImageProcessor:
-    def __init__(self, db_manager):
+    # Number of files written to the database in one transaction
+    BATCH_SIZE = 500
+
+    def __init__(self, db_manager, on_faces_removed=None, metadata_workers=8,
+                 thumbnail_cache=None, thumbnail_workers=4, ingest_buffer=256 * 1024 * 1024,
+                 decoded_buffer=256 * 1024 * 1024):
+        """
+        Initialize the image processor.
+
+        Args:
+            db_manager: Database manager instance
+            on_faces_removed: Called with the ids of faces deleted because
+                their file changed or disappeared
+            metadata_workers: Number of threads reading and ingesting files
+            thumbnail_cache: Optional ThumbnailCache filled with the
+                thumbnails of imported files
+            thumbnail_workers: Number of threads creating thumbnails of
+                moved files, which are not read by ingest
+            ingest_buffer: Bytes of file contents held in memory during ingest
+            decoded_buffer: Bytes of images decoded for face detection kept
+                in decoded_images
+        """
         self.db_manager = db_manager
-    
-    def process_folders(self, folders):
-        """Process all files in given folders and add to database"""
-        # Define supported formats
-        img_extensions = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
-        video_extensions = ('.mp4', '.mov', '.avi')
-        total_files = 0
-        added_files = 0
-        
+        self.on_faces_removed = on_faces_removed
+        self.scanner = LibraryScanner()
+        self.ingest = IngestPipeline(metadata_workers, ingest_buffer, thumbnail_cache)
+        self.thumbnail_cache = thumbnail_cache
+        self.thumbnail_workers = thumbnail_workers
+        # Filled by process_paths for a face processing run in the same job
+        self.decoded_images = DecodedImageCache(decoded_buffer)
+
+    def _read_metadata(self, files, face_min_side=None):
+        """
+        Ingest files on the ingest threads, reading each of them once
+
+        Args:
+            files: List of (key, file path, fingerprint)
+            face_min_side: Also decode images for face detection at this
+                shorter side into decoded_images
+
+        Yields:
+            (key, metadata columns) in input order
+        """
+        decoded_images = self.decoded_images if face_min_side is not None else None
+        for key, result in self.ingest.run(files, decoded_images, face_min_side or 0):
+            metadata = result.metadata
+            yield key, {
+                'timestamp': metadata.timestamp,
+                'location': metadata.location,
+                'width': metadata.width,
+                'height': metadata.height,
+                'orientation': metadata.orientation,
+                'content_hash': result.content_hash
+            }
+
+    def _known_files(self, folders=(), paths=()):
+        """Load the stored fingerprints of the files under the folders or at the paths"""
+        known = {}
+        for image_id, file_path, size, mtime, inode in self.db_manager.get_known_files(folders, paths):
+            fingerprint = None
+            if size is not None and mtime is not None:
+                fingerprint = FileFingerprint(size, mtime, inode or 0)
+            known[file_path] = KnownFile(image_id, fingerprint)
+        return known
+
+    def _faces_removed(self, face_ids):
+        if face_ids and self.on_faces_removed:
+            self.on_faces_removed(face_ids)
+
+    def process_folders(self, folders, control=None):
+        """
+        Process all files in given folders and add to database
+
+        Folders are walked recursively and compared with the fingerprints
+        stored for their files, so only new and changed files are read.
+        Moved files keep their database entry and faces; files that changed
+        or disappeared lose their faces. New files are written in batches of
+        BATCH_SIZE records.
+
+        Args:
+            folders: Folders to scan
+            control: Optional JobControl for progress, cancel and pause
+
+        Returns:
+            Tuple of (total_files, added_files)
+        """
+        folders = [folder for folder in folders if os.path.isdir(folder)]
+        scan = self.scanner.scan(folders, self._known_files(folders), control)
+        return scan.total, self._apply_scan(scan, control)
+
+    def process_paths(self, paths, control=None, face_min_side=None):
+        """
+        Bring single files in line with the database, e.g. files reported by a watcher
+
+        All paths are compared in one pass, so a file or folder that was
+        moved between two of them keeps its database entries.
+
+        Args:
+            paths: Paths of new, changed or removed files, or of folders to
+                scan, including removed ones
+            control: Optional JobControl for progress, cancel and pause
+            face_min_side: Keep new and changed images decoded for face
+                detection at this shorter side in decoded_images, for a face
+                processing run that follows in the same job
+
+        Returns:
+            Tuple of (total_files, added_files, image_ids), image_ids being
+            the new and changed images, which await face processing
+        """
+        files = []
+        folders = []
+        for path in paths:
+            if os.path.isdir(path):
+                folders.append(path)
+                files.extend(entry.path for entry in iter_media_files(path))
+            else:
+                if not os.path.exists(path):
+                    # May have been a folder
+                    folders.append(path)
+                files.append(path)
+
+        # Known files that are no longer on disk are deleted or moved
+        known = self._known_files(folders, files)
+        scan = self.scanner.scan_files(files + list(known), known)
+        added = self._apply_scan(scan, control, face_min_side)
+        added_paths = [file_path for file_path, _ in scan.new]
+        image_ids = [image_id for image_id, _, _ in scan.changed]
+        image_ids += [known_file.image_id for known_file in self._known_files(paths=added_paths).values()]
+        return scan.total, added, sorted(image_ids)
+
+    def _apply_scan(self, scan, control=None, face_min_side=None):
+        """
+        Write the differences found by a scan to the database
+
+        Returns:
+            Number of files added
+        """
+        logger.info(f"Scanned {scan.total} files: {len(scan.new)} new, {len(scan.changed)} changed, "
+                    f"{len(scan.moved)} moved, {len(scan.deleted)} deleted")
+
         # Get default album ID
         default_album_id = self.db_manager.get_default_album_id()
         if not default_album_id:
-            return 0, 0
-        
-        for folder in folders:
+            return 0
+
+        # Bookkeeping for files that do not need to be read
+        self.db_manager.update_file_fingerprints([
+            self._fingerprint_params(image_id, fingerprint) for image_id, fingerprint in scan.fingerprinted
+        ])
+        self.db_manager.move_images([
+            dict(self._fingerprint_params(image_id, fingerprint), file_path=path)
+            for image_id, path, fingerprint in scan.moved
+        ])
+        if scan.deleted:
+            self._faces_removed(self.db_manager.delete_images(scan.deleted))
+
+        added_files = 0
+        done = 0
+        total = len(scan.new) + len(scan.changed)
+
+        # Changed files are read again and go back to face processing
+        self.ingest.reset_timings()
+        changes = []
+        changed = self._read_metadata(
+            (((image_id, fingerprint), file_path, fingerprint) for image_id, file_path, fingerprint in scan.changed),
+            face_min_side)
+        for (image_id, fingerprint), metadata in changed:
+            if control and not control.wait_if_paused():
+                changed.close()
+                break
+            changes.append(dict(self._fingerprint_params(image_id, fingerprint), **metadata))
+            done += 1
+            if control:
+                control.update(done, total, "Reading changed files")
+        if changes:
+            self._faces_removed(self.db_manager.reset_images(changes))
+
+        # Files are read ahead on the ingest threads while batches are written
+        pending = []
+        new = self._read_metadata(
+            (((file_path, fingerprint), file_path, fingerprint) for file_path, fingerprint in scan.new),
+            face_min_side)
+        for (file_path, fingerprint), metadata in new:
+            if control and not control.wait_if_paused():
+                new.close()
+                break
+            try:
+                pending.append(dict({
+                    'file_path': file_path,
+                    'has_text': 0,
+                    'album_id': default_album_id,
+                    'file_size': fingerprint.size,
+                    'file_mtime': fingerprint.mtime_ns,
+                    'file_inode': fingerprint.inode
+                }, **metadata))
+                if len(pending) >= self.BATCH_SIZE:
+                    added_files += self.db_manager.add_images(pending)
+                    pending = []
+            except Exception as e:
+                logger.error(f"Error processing file {file_path}: {str(e)}")
+
+            done += 1
+            if control:
+                control.update(done, total, os.path.dirname(file_path))
+
+        # Files already read are saved even if the job was cancelled
+        if pending:
             try:
-                if os.path.exists(folder) and os.path.isdir(folder):
-                    files = []
-                    for file in os.listdir(folder):
-                        file_path = os.path.join(folder, file)
-                        if os.path.isfile(file_path):
-                            ext = os.path.splitext(file)[1].lower()
-                            if ext in img_extensions or ext in video_extensions:
-                                files.append(file_path)
-                    
-                    total_files += len(files)
-                    
-                    for file_path in files:
-                        # Get timestamp
-                        timestamp = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
-                        location = ""
-                        has_text = 0
-                        
-                        # Try to extract EXIF data for images
-                        ext = os.path.splitext(file_path)[1].lower()
-                        if ext in img_extensions:
-                            try:
-                                with open(file_path, 'rb') as f:
-                                    tags = exifread.process_file(f)
-                                    if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-                                        lat = tags['GPS GPSLatitude'].values
-                                        lon = tags['GPS GPSLongitude'].values
-                                        location = f"{lat[0]:.6f},{lon[0]:.6f}"
-                                    if 'EXIF DateTimeOriginal' in tags:
-                                        date_str = str(tags['EXIF DateTimeOriginal'])
-                                        try:
-                                            timestamp = datetime.datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
-                                        except:
-                                            pass
-                            except:
-                                pass
-                        
-                        # Add to database
-                        image = self.db_manager.add_image(
-                            file_path=file_path,
-                            timestamp=timestamp,
-                            location=location,
-                            has_text=has_text,
-                            album_id=default_album_id
-                        )
-                        
-                        if image.id:  # If image was added (not already in DB)
-                            added_files += 1
-                        
-                        # Keep UI responsive
-                        if added_files % 20 == 0:
-                            QApplication.processEvents()
-                            
+                added_files += self.db_manager.add_images(pending)
             except Exception as e:
-                print(f"Error processing folder {folder}: {str(e)}")
-                
-        return total_files, added_files
\ No newline at end of file
+                logger.error(f"Error saving files: {str(e)}")
+
+        self.ingest.log_timings()
+
+        if not (control and control.is_cancelled):
+            # Moved files need thumbnails, they are keyed by path. Ingest made
+            # those of the files it read, they are found without reading again
+            self._create_thumbnails(
+                [(file_path, fingerprint) for file_path, fingerprint in scan.new] +
+                [(file_path, fingerprint) for _, file_path, fingerprint in scan.changed + scan.moved],
+                control)
+
+        return added_files
+
+    def _create_thumbnails(self, files, control=None):
+        """
+        Fill the thumbnail cache, so the views never decode the originals
+
+        Args:
+            files: List of (file path, fingerprint)
+            control: Optional JobControl for progress, cancel and pause
+        """
+        if self.thumbnail_cache is None:
+            return
+        files = [(file_path, fingerprint) for file_path, fingerprint in files
+                 if self.thumbnail_cache.supports(file_path)]
+        created = self.thumbnail_cache.ensure_many(files, self.thumbnail_workers)
+        for done, (file_path, _) in enumerate(created, 1):
+            if control:
+                if not control.wait_if_paused():
+                    created.close()
+                    break
+                control.update(done, len(files), "Creating thumbnails")
+
+    @staticmethod
+    def _fingerprint_params(image_id, fingerprint):
+        return {
+            'image_id': image_id,
+            'file_size': fingerprint.size,
+            'file_mtime': fingerprint.mtime_ns,
+            'file_inode': fingerprint.inode
+        }
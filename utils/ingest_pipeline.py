@@ -0,0 +1,178 @@
+import io
+import os
+import time
+import hashlib
+import logging
+import datetime
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from utils.image_loader import DecodedImageCache, decode_image
+from utils.image_metadata import ImageMetadata, read_metadata
+from utils.library_scanner import FileFingerprint, IMAGE_EXTENSIONS
+
+logger = logging.getLogger('IngestPipeline')
+
+
+class IngestResult(NamedTuple):
+    """What ingest learned about one file"""
+    metadata: ImageMetadata
+    content_hash: Optional[str]  # None for files that are not read whole, e.g. videos
+    thumbnails: bool             # Thumbnails are in the cache
+
+
+class IngestPipeline:
+    """
+    Reads every imported file once and fans its bytes out to the ingest stages.
+
+    Images are read whole into memory on a pool thread, which is the only
+    disk access ingest makes for them. The buffer is hashed, its headers are
+    parsed for metadata and, with a thumbnail cache, its thumbnails are
+    rendered. When face inputs are requested the image is also decoded at the
+    face detection scale and left in a DecodedImageCache for face processing.
+    Thumbnails are still rendered from the buffer, a draft decode at 1/8
+    scale is cheaper than scaling down the face detection decode.
+
+    Videos and images larger than max_bytes only get their headers read. Files
+    in flight are bounded by count and by their total size, so memory stays
+    bounded for any input. Seconds spent in every stage add up in timings.
+    """
+
+    STAGES = ('read', 'hash', 'metadata', 'decode', 'thumbnails')
+
+    def __init__(self, workers: int = 8, max_bytes: int = 256 * 1024 * 1024, thumbnail_cache=None,
+                 opener: Callable[..., Any] = open):
+        """
+        Initialize the pipeline.
+
+        Args:
+            workers: Number of threads reading and processing files, 0 or 1 to
+                work in the calling thread
+            max_bytes: Total size of the files read into memory at once
+            thumbnail_cache: Optional ThumbnailCache filled from the buffers
+            opener: Function opening files for binary reading
+        """
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.thumbnail_cache = thumbnail_cache
+        self.opener = opener
+        self.timings: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def reset_timings(self) -> None:
+        with self._lock:
+            self.timings.clear()
+            self.counts.clear()
+
+    def _timed(self, stage: str, start: float) -> float:
+        now = time.perf_counter()
+        with self._lock:
+            self.timings[stage] += now - start
+            self.counts[stage] += 1
+        return now
+
+    def _reads_whole(self, file_path: str, fingerprint: FileFingerprint) -> bool:
+        return (os.path.splitext(file_path)[1].lower() in IMAGE_EXTENSIONS
+                and fingerprint.size <= self.max_bytes)
+
+    def ingest(self, file_path: str, fingerprint: FileFingerprint,
+               decoded_images: Optional[DecodedImageCache] = None, face_min_side: int = 0) -> IngestResult:
+        """
+        Read one file and run every stage on it.
+
+        Args:
+            file_path: File to ingest
+            fingerprint: Fingerprint from the scan
+            decoded_images: Receives the image decoded for face detection
+            face_min_side: Shorter side of that decode, see read_image
+
+        Returns:
+            IngestResult
+        """
+        # Fall back to the modification time
+        fallback_time = datetime.datetime.fromtimestamp(fingerprint.mtime_ns / 1e9)
+        start = time.perf_counter()
+        if not self._reads_whole(file_path, fingerprint):
+            metadata = read_metadata(file_path, fallback_time, self.opener)
+            self._timed('metadata', start)
+            return IngestResult(metadata, None, False)
+
+        try:
+            with self.opener(file_path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            logger.debug(f"Cannot read {file_path}: {str(e)}")
+            return IngestResult(ImageMetadata(fallback_time, "", None, None, None), None, False)
+        start = self._timed('read', start)
+
+        content_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+        start = self._timed('hash', start)
+
+        metadata = read_metadata(file_path, fallback_time, lambda *args: io.BytesIO(data))
+        start = self._timed('metadata', start)
+
+        if decoded_images is not None:
+            decoded, scale = decode_image(data, face_min_side)
+            start = self._timed('decode', start)
+            if decoded is not None:
+                decoded_images.put(file_path, decoded, scale)
+
+        thumbnails = False
+        if self.thumbnail_cache is not None:
+            thumbnails = self.thumbnail_cache.ensure(file_path, fingerprint, data=data)
+            self._timed('thumbnails', start)
+
+        return IngestResult(metadata, content_hash, thumbnails)
+
+    def run(self, items: Iterable[Tuple[Any, str, FileFingerprint]],
+            decoded_images: Optional[DecodedImageCache] = None,
+            face_min_side: int = 0) -> Iterator[Tuple[Any, IngestResult]]:
+        """
+        Ingest many files on the thread pool.
+
+        Args:
+            items: Iterable of (key, file path, fingerprint)
+            decoded_images: Receives images decoded for face detection, None
+                to skip that stage
+            face_min_side: Shorter side of those decodes, see read_image
+
+        Yields:
+            (key, IngestResult) in input order
+        """
+        if self.workers <= 1:
+            for key, file_path, fingerprint in items:
+                yield key, self.ingest(file_path, fingerprint, decoded_images, face_min_side)
+            return
+
+        window = deque()
+        in_flight = 0
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ingest') as pool:
+            try:
+                for key, file_path, fingerprint in items:
+                    size = fingerprint.size if self._reads_whole(file_path, fingerprint) else 0
+                    # Hand back finished files before reading more than the budget
+                    while window and (len(window) >= 4 * self.workers or in_flight + size > self.max_bytes):
+                        done_key, done_size, future = window.popleft()
+                        in_flight -= done_size
+                        yield done_key, future.result()
+                    window.append((key, size, pool.submit(self.ingest, file_path, fingerprint,
+                                                          decoded_images, face_min_side)))
+                    in_flight += size
+                while window:
+                    key, _, future = window.popleft()
+                    yield key, future.result()
+            finally:
+                # The consumer stopped early, drop files that have not started
+                for _, _, future in window:
+                    future.cancel()
+
+    def log_timings(self) -> None:
+        """Log the seconds spent per stage since the last reset"""
+        with self._lock:
+            stages = [f"{stage} {self.timings[stage]:.1f}s/{self.counts[stage]}"
+                      for stage in self.STAGES if self.counts[stage]]
+        if stages:
+            logger.info("Ingest stages: " + ", ".join(stages))
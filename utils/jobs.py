@@ -0,0 +1,143 @@
+import time
+import threading
+from typing import Callable, NamedTuple, Optional, Set
+
+
+class JobProgress(NamedTuple):
+    """Snapshot of a running job's progress"""
+    done: int
+    total: int
+    rate: float           # Items per second since the job started
+    eta: Optional[float]  # Seconds left, None while unknown
+    message: str
+
+
+class JobControl:
+    """
+    Progress reporting, cancel and pause for long running jobs.
+
+    Jobs call update() as they go and check wait_if_paused() between items.
+    The caller (usually a UI worker thread) receives throttled JobProgress
+    reports through the progress callback and may cancel, pause or resume
+    the job from any thread.
+    """
+
+    def __init__(self, progress_callback: Optional[Callable[[JobProgress], None]] = None,
+                 report_interval: float = 0.25):
+        """
+        Initialize a job control.
+
+        Args:
+            progress_callback: Called with a JobProgress, from the job's thread
+            report_interval: Minimum seconds between two progress reports
+        """
+        self.progress_callback = progress_callback
+        self.report_interval = report_interval
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+        self._started = time.monotonic()
+        self._paused_time = 0.0
+        self._paused_at: Optional[float] = None
+        self._last_report = 0.0
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+        # Wake up a paused job so it can stop
+        self._running.set()
+
+    def pause(self) -> None:
+        if self._running.is_set():
+            self._paused_at = time.monotonic()
+            self._running.clear()
+
+    def resume(self) -> None:
+        if not self._running.is_set():
+            if self._paused_at is not None:
+                self._paused_time += time.monotonic() - self._paused_at
+                self._paused_at = None
+            self._running.set()
+
+    @property
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def is_paused(self) -> bool:
+        return not self._running.is_set()
+
+    def wait_if_paused(self) -> bool:
+        """
+        Block while the job is paused.
+
+        Returns:
+            False if the job has been cancelled and should stop
+        """
+        self._running.wait()
+        return not self._cancelled.is_set()
+
+    def start(self) -> None:
+        """Reset the clock used for throughput and ETA"""
+        self._started = time.monotonic()
+        self._paused_time = 0.0
+        self._last_report = 0.0
+
+    def update(self, done: int, total: int, message: str = '', force: bool = False) -> None:
+        """
+        Report progress, at most once per report_interval unless forced.
+
+        Args:
+            done: Items finished so far
+            total: Total number of items, 0 if unknown
+            message: Short description of the current step
+            force: Report even if the last report was very recent
+        """
+        if self.progress_callback is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+
+        elapsed = max(now - self._started - self._paused_time, 1e-6)
+        rate = done / elapsed
+        eta = (total - done) / rate if total and rate > 0 else None
+        self.progress_callback(JobProgress(done, total, rate, eta, message))
+
+
+class CompletionWatermark:
+    """
+    Highest id up to which every item of an id-ordered job has finished.
+
+    Items are started in ascending id order but may finish in any order, for
+    example when worker processes return results as they complete. The
+    watermark only moves past an id once it and every id before it are done,
+    which makes it safe to save as a resume point. Thread safe.
+    """
+
+    def __init__(self, start: int = 0):
+        """
+        Initialize a watermark.
+
+        Args:
+            start: Id everything up to which is already done
+        """
+        self._lock = threading.Lock()
+        self._in_flight: Set[int] = set()
+        self._last_started = start
+
+    def started(self, item_id: int) -> None:
+        with self._lock:
+            self._in_flight.add(item_id)
+            self._last_started = max(self._last_started, item_id)
+
+    def finished(self, item_id: int) -> None:
+        with self._lock:
+            self._in_flight.discard(item_id)
+
+    @property
+    def value(self) -> int:
+        with self._lock:
+            if self._in_flight:
+                return min(self._in_flight) - 1
+            return self._last_started
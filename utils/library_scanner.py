@@ -0,0 +1,245 @@
+import os
+import logging
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+from utils.jobs import JobControl
+
+logger = logging.getLogger('LibraryScanner')
+
+# Supported media formats
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi')
+MEDIA_EXTENSIONS = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
+
+
+class FileFingerprint(NamedTuple):
+    """Cheap identity of a file's content, taken from a single stat"""
+    size: int
+    mtime_ns: int
+    inode: int
+
+
+class KnownFile(NamedTuple):
+    """A file as recorded in the database"""
+    image_id: int
+    fingerprint: Optional[FileFingerprint]  # None for rows from before fingerprints
+
+
+class ScanResult:
+    """Differences between folders on disk and the files known to the database"""
+
+    def __init__(self):
+        self.new: List[Tuple[str, FileFingerprint]] = []
+        self.changed: List[Tuple[int, str, FileFingerprint]] = []
+        self.moved: List[Tuple[int, str, FileFingerprint]] = []  # (image id, new path, fingerprint)
+        self.deleted: List[int] = []
+        self.fingerprinted: List[Tuple[int, FileFingerprint]] = []  # Unchanged files with a new fingerprint
+        self.unchanged = 0
+        self.complete = True  # False if the walk was cancelled or a folder could not be read
+
+    @property
+    def total(self) -> int:
+        """Number of media files found on disk"""
+        return len(self.new) + len(self.changed) + len(self.moved) + self.unchanged
+
+    def __repr__(self) -> str:
+        return (f"ScanResult(new={len(self.new)}, changed={len(self.changed)}, moved={len(self.moved)}, "
+                f"deleted={len(self.deleted)}, unchanged={self.unchanged})")
+
+
+def iter_media_files(folder: str, recursive: bool = True) -> Iterator[os.DirEntry]:
+    """
+    Walk a folder with os.scandir and yield its media files.
+
+    Hidden folders are skipped and symlinked folders are not followed, so a
+    link cannot make the walk loop.
+
+    Args:
+        folder: Folder to walk
+        recursive: Descend into subfolders
+
+    Yields:
+        DirEntry of every media file
+    """
+    stack = [folder]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                subfolders = []
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith('.'):
+                                subfolders.append(entry.path)
+                        elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in MEDIA_EXTENSIONS:
+                            yield entry
+                    except OSError:
+                        continue
+        except OSError as e:
+            if directory == folder:
+                raise
+            logger.warning(f"Cannot read folder {directory}: {str(e)}")
+            continue
+        if recursive:
+            # Reversed so subfolders are walked in directory order
+            stack.extend(reversed(subfolders))
+
+
+def fingerprint(entry: os.DirEntry) -> FileFingerprint:
+    """Fingerprint a file from its DirEntry, reusing the entry's cached stat"""
+    stat = entry.stat()
+    # st_ino from a DirEntry stat is 0 on Windows, inode() always has it
+    return FileFingerprint(stat.st_size, stat.st_mtime_ns, entry.inode())
+
+
+class LibraryScanner:
+    """
+    Finds new, changed, moved and deleted media files under a set of folders.
+
+    Every file is fingerprinted by size, modification time and inode. A file
+    whose path is known and whose fingerprint matches is unchanged and costs
+    nothing beyond its stat; a known path with a different fingerprint has
+    changed. Known files that disappeared are matched to new paths by inode
+    and size to detect moves and renames; the rest are deleted.
+    """
+
+    def __init__(self, recursive: bool = True):
+        """
+        Initialize a scanner.
+
+        Args:
+            recursive: Descend into subfolders
+        """
+        self.recursive = recursive
+
+    def scan(self, folders: Sequence[str], known: Dict[str, KnownFile],
+             control: Optional[JobControl] = None) -> ScanResult:
+        """
+        Compare folders on disk with the files known to the database.
+
+        Deleted files are only reported for folders that were walked
+        completely, so a cancelled or failed walk never looks like a mass
+        deletion.
+
+        Args:
+            folders: Root folders to walk
+            known: Known files under the folders, by path
+            control: Optional JobControl for progress, cancel and pause
+
+        Returns:
+            ScanResult
+        """
+        result = ScanResult()
+        seen = set()
+        complete_roots = []
+        scanned = 0
+
+        for folder in folders:
+            root_complete = True
+            try:
+                for entry in iter_media_files(folder, self.recursive):
+                    if control and not control.wait_if_paused():
+                        root_complete = False
+                        break
+                    path = entry.path
+                    try:
+                        current = fingerprint(entry)
+                    except OSError:
+                        # Vanished during the walk, a later scan picks it up
+                        continue
+                    seen.add(path)
+                    self._classify(result, path, current, known.get(path))
+
+                    scanned += 1
+                    if control:
+                        control.update(scanned, 0, f"Scanning {folder}")
+            except OSError as e:
+                logger.error(f"Error scanning folder {folder}: {str(e)}")
+                root_complete = False
+
+            if root_complete:
+                complete_roots.append(os.path.abspath(folder))
+            else:
+                result.complete = False
+                if control and control.is_cancelled:
+                    break
+
+        self._match_moves(result, [
+            known_file for path, known_file in known.items()
+            if path not in seen and any(self._contains(root, path) for root in complete_roots)
+        ])
+        return result
+
+    def scan_files(self, paths: Sequence[str], known: Dict[str, KnownFile]) -> ScanResult:
+        """
+        Compare single files with the database, e.g. paths reported by a watcher.
+
+        Args:
+            paths: File paths, existing or not
+            known: Known files among the paths, by path
+
+        Returns:
+            ScanResult, where known paths that no longer exist are deleted
+            unless they were moved to another of the paths
+        """
+        result = ScanResult()
+        missing = []
+        for path in dict.fromkeys(paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if path in known:
+                    missing.append(known[path])
+                continue
+            if not os.path.isfile(path) or os.path.splitext(path)[1].lower() not in MEDIA_EXTENSIONS:
+                continue
+            current = FileFingerprint(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+            self._classify(result, path, current, known.get(path))
+        self._match_moves(result, missing)
+        return result
+
+    @staticmethod
+    def _classify(result: ScanResult, path: str, current: FileFingerprint, known_file: Optional[KnownFile]) -> None:
+        if known_file is None:
+            result.new.append((path, current))
+        elif known_file.fingerprint == current:
+            result.unchanged += 1
+        elif known_file.fingerprint is None or known_file.fingerprint[:2] == current[:2]:
+            # Added before fingerprints were stored, or same content under a new inode
+            result.fingerprinted.append((known_file.image_id, current))
+            result.unchanged += 1
+        else:
+            result.changed.append((known_file.image_id, path, current))
+
+    def _contains(self, root: str, path: str) -> bool:
+        """Whether a walk of root would have found path"""
+        path = os.path.abspath(path)
+        if not self.recursive:
+            return os.path.dirname(path) == root
+        return path.startswith(os.path.join(root, ''))
+
+    @staticmethod
+    def _match_moves(result: ScanResult, missing: List[KnownFile]) -> None:
+        """Split known files that were not found into moved and deleted ones"""
+        if not missing:
+            return
+
+        by_identity = {}
+        for known_file in missing:
+            fp = known_file.fingerprint
+            if fp is not None and fp.inode:
+                by_identity.setdefault((fp.inode, fp.size), []).append(known_file)
+
+        still_new = []
+        moved_ids = set()
+        for path, current in result.new:
+            candidates = by_identity.get((current.inode, current.size))
+            if candidates:
+                known_file = candidates.pop()
+                moved_ids.add(known_file.image_id)
+                result.moved.append((known_file.image_id, path, current))
+            else:
+                still_new.append((path, current))
+        result.new = still_new
+        result.deleted = [known_file.image_id for known_file in missing if known_file.image_id not in moved_ids]
@@ -0,0 +1,423 @@
+import io
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+from PIL import Image, ImageOps, features
+
+from utils.library_scanner import FileFingerprint, IMAGE_EXTENSIONS
+
+logger = logging.getLogger('ThumbnailCache')
+
+# Thumbnail edge lengths in pixels, small for the file list and large for albums and people
+SIZES = (64, 200)
+# Folder of the face thumbnails, which have a single size of max(SIZES)
+FACES = 'faces'
+# Margin around the face box on every side, relative to the box's longer side
+FACE_MARGIN = 0.25
+
+
+def face_box(facial_area: Sequence[float], width: int, height: int) -> Tuple[int, int, int, int]:
+    """
+    Square crop of a face with FACE_MARGIN around it, moved inside the image.
+
+    Args:
+        facial_area: Face box (x1, y1, x2, y2) in the image's coordinates
+        width: Image width
+        height: Image height
+
+    Returns:
+        (left, top, right, bottom)
+    """
+    x1, y1, x2, y2 = facial_area
+    side = min(max(x2 - x1, y2 - y1) * (1 + 2 * FACE_MARGIN), width, height)
+    left = min(max(0, (x1 + x2 - side) / 2), width - side)
+    top = min(max(0, (y1 + y2 - side) / 2), height - side)
+    return int(left), int(top), int(round(left + side)), int(round(top + side))
+
+
+class ThumbnailCache:
+    """
+    Persistent thumbnail store shared by all views.
+
+    Thumbnails are keyed by file path, size and modification time, so an edited
+    or replaced file gets new thumbnails while its old ones age out. Faces
+    get thumbnails of their own, cropped around the face and keyed by Face id
+    and box. Each
+    original is decoded once for all SIZES (JPEGs at a reduced DCT scale) and
+    the results are written as compact JPEG or WebP files under folder. Recently
+    used thumbnails are also kept in memory up to memory_budget bytes. Files
+    on disk are evicted least recently used first once they exceed
+    disk_budget bytes.
+
+    All methods are thread safe.
+    """
+
+    def __init__(self, folder: str, memory_budget: int = 64 * 1024 * 1024,
+                 disk_budget: int = 1024 * 1024 * 1024, image_format: str = 'jpeg', quality: int = 80):
+        """
+        Initialize the cache.
+
+        Args:
+            folder: Cache folder, created when missing
+            memory_budget: Bytes of encoded thumbnails kept in memory
+            disk_budget: Bytes of thumbnail files kept on disk, 0 for no limit
+            image_format: 'jpeg' or 'webp', WebP falls back to JPEG when
+                Pillow is built without it
+            quality: Encoder quality between 1 and 100
+        """
+        self.folder = os.path.abspath(folder)
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.quality = quality
+        self.format = image_format.lower()
+        if self.format == 'webp' and not features.check('webp'):
+            logger.warning("Pillow has no WebP support, storing thumbnails as JPEG")
+            self.format = 'jpeg'
+        if self.format not in ('jpeg', 'webp'):
+            raise ValueError(f"Unsupported thumbnail format: {image_format}")
+        self.extension = '.webp' if self.format == 'webp' else '.jpg'
+
+        self._lock = threading.Lock()
+        self._memory: 'OrderedDict[Tuple[str, Union[int, str]], bytes]' = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None  # Counted on the first write
+        # Counters for benchmarks and the status bar
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.decodes = 0
+
+    @staticmethod
+    def key(file_path: str, fingerprint: FileFingerprint) -> str:
+        """Cache key of a file version"""
+        name = f"{os.path.abspath(file_path)}\0{fingerprint.size}\0{fingerprint.mtime_ns}"
+        return hashlib.sha1(name.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    @staticmethod
+    def supports(file_path: str) -> bool:
+        """Whether thumbnails can be made of a file"""
+        return os.path.splitext(file_path)[1].lower() in IMAGE_EXTENSIONS
+
+    @staticmethod
+    def face_key(face_id: int, facial_area: Sequence[int]) -> str:
+        """Cache key of a face thumbnail, the box tells apart faces that reuse a deleted Face id"""
+        name = f"face\0{face_id}\0{','.join(str(int(v)) for v in facial_area)}"
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str, size: Union[int, str]) -> str:
+        return os.path.join(self.folder, str(size), key[:2], key + self.extension)
+
+    def _fingerprint(self, file_path: str, fingerprint: Optional[FileFingerprint]) -> Optional[FileFingerprint]:
+        if fingerprint is not None and fingerprint.size is not None and fingerprint.mtime_ns is not None:
+            return fingerprint
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return FileFingerprint(stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+    def get(self, file_path: str, size: int, fingerprint: Optional[FileFingerprint] = None,
+            create: bool = True) -> Optional[bytes]:
+        """
+        Get an encoded thumbnail.
+
+        Args:
+            file_path: Original image
+            size: One of SIZES
+            fingerprint: Size and modification time of the file if known,
+                saves a stat call
+            create: Decode the original when the thumbnail is not cached
+
+        Returns:
+            Encoded image bytes, None if the file cannot be read or is not
+            cached and create is False
+        """
+        if not self.supports(file_path):
+            return None
+        fingerprint = self._fingerprint(file_path, fingerprint)
+        if fingerprint is None:
+            return None
+        key = self.key(file_path, fingerprint)
+
+        data = self._memory_get(key, size)
+        if data is not None:
+            return data
+        data = self._disk_get(key, size)
+        if data is not None:
+            return data
+        if not create:
+            return None
+        return self._create(file_path, key).get(size)
+
+    def ensure(self, file_path: str, fingerprint: Optional[FileFingerprint] = None,
+               data: Optional[bytes] = None) -> bool:
+        """
+        Create the missing thumbnails of a file, e.g. during import.
+
+        Args:
+            file_path: Original image
+            fingerprint: Size and modification time of the file if known
+            data: Contents of the file if already read, saves reading it again
+
+        Returns:
+            False if the file cannot be decoded
+        """
+        if not self.supports(file_path):
+            return False
+        fingerprint = self._fingerprint(file_path, fingerprint)
+        if fingerprint is None:
+            return False
+        key = self.key(file_path, fingerprint)
+        if all(os.path.exists(self._path(key, size)) for size in SIZES):
+            return True
+        return bool(self._create(file_path, key, keep=False, data=data))
+
+    def ensure_many(self, items: Iterable[Tuple[str, Optional[FileFingerprint]]],
+                    workers: int = 4) -> Iterator[Tuple[str, bool]]:
+        """
+        Create the missing thumbnails of many files on a thread pool.
+
+        Pillow releases the GIL while decoding and resizing, so threads scale
+        with the number of cores.
+
+        Args:
+            items: Iterable of (file path, fingerprint or None)
+            workers: Number of threads, 0 or 1 to work in the calling thread
+
+        Yields:
+            (file path, success) in input order
+        """
+        if workers <= 1:
+            for file_path, fingerprint in items:
+                yield file_path, self.ensure(file_path, fingerprint)
+            return
+
+        window = deque()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails') as pool:
+            try:
+                for file_path, fingerprint in items:
+                    window.append((file_path, pool.submit(self.ensure, file_path, fingerprint)))
+                    if len(window) >= 4 * workers:
+                        file_path, future = window.popleft()
+                        yield file_path, future.result()
+                while window:
+                    file_path, future = window.popleft()
+                    yield file_path, future.result()
+            finally:
+                for _, future in window:
+                    future.cancel()
+
+    def get_face(self, face_id: int, facial_area: Sequence[int], file_path: str,
+                 create: bool = True) -> Optional[bytes]:
+        """
+        Get the encoded thumbnail of a face.
+
+        Face thumbnails are normally stored by face processing from the image
+        it decoded anyway. Faces found before that, or evicted since, are
+        cropped from the original once, decoded only as finely as the face
+        needs.
+
+        Args:
+            face_id: Face id
+            facial_area: Face box (x1, y1, x2, y2) in original image coordinates
+            file_path: Image the face was found in
+            create: Crop the face from the original when it is not cached
+
+        Returns:
+            Encoded image bytes, None if the file cannot be read or is not
+            cached and create is False
+        """
+        key = self.face_key(face_id, facial_area)
+        data = self._memory_get(key, FACES)
+        if data is None:
+            data = self._disk_get(key, FACES)
+        if data is not None or not create:
+            return data
+        try:
+            data = self._save(self._render_face(file_path, facial_area))
+        except Exception as e:
+            logger.debug(f"Cannot create face thumbnail of {file_path}: {str(e)}")
+            return None
+        with self._lock:
+            self.decodes += 1
+        self._account(self._write(key, FACES, data, keep=True))
+        return data
+
+    def put_face(self, face_id: int, facial_area: Sequence[int], pixels) -> None:
+        """
+        Store the thumbnail of a face cropped by face processing.
+
+        Args:
+            face_id: Face id
+            facial_area: Face box (x1, y1, x2, y2) in original image coordinates
+            pixels: RGB array of the crop, see face_box
+        """
+        image = Image.fromarray(pixels)
+        image.thumbnail((max(SIZES), max(SIZES)), Image.LANCZOS)
+        self._account(self._write(self.face_key(face_id, facial_area), FACES, self._save(image), keep=False))
+
+    def _memory_get(self, key: str, size: Union[int, str]) -> Optional[bytes]:
+        with self._lock:
+            data = self._memory.get((key, size))
+            if data is not None:
+                self._memory.move_to_end((key, size))
+                self.memory_hits += 1
+            return data
+
+    def _memory_put(self, key: str, size: Union[int, str], data: bytes) -> None:
+        if len(data) > self.memory_budget:
+            return
+        with self._lock:
+            previous = self._memory.pop((key, size), None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+            self._memory[(key, size)] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_budget:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _disk_get(self, key: str, size: Union[int, str]) -> Optional[bytes]:
+        path = self._path(key, size)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            # Eviction goes by modification time, mark the file as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.disk_hits += 1
+        self._memory_put(key, size, data)
+        return data
+
+    def _create(self, file_path: str, key: str, keep: bool = True,
+                data: Optional[bytes] = None) -> Dict[int, bytes]:
+        """Decode the original once and store every size, returns the encoded thumbnails"""
+        try:
+            thumbnails = self._render(io.BytesIO(data) if data is not None else file_path)
+        except Exception as e:
+            logger.debug(f"Cannot create thumbnail of {file_path}: {str(e)}")
+            return {}
+        with self._lock:
+            self.decodes += 1
+
+        self._account(sum(self._write(key, size, data, keep) for size, data in thumbnails.items()))
+        return thumbnails
+
+    def _write(self, key: str, size: Union[int, str], data: bytes, keep: bool) -> int:
+        """Store one thumbnail file, returns the bytes written"""
+        path = self._path(key, size)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        written = 0
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            written = len(data)
+        except OSError as e:
+            logger.warning(f"Cannot write thumbnail {path}: {str(e)}")
+        if keep:
+            self._memory_put(key, size, data)
+        return written
+
+    def _render(self, source) -> Dict[int, bytes]:
+        largest = max(SIZES)
+        with Image.open(source) as image:
+            # Lets the JPEG decoder skip detail at 1/2 to 1/8 scale
+            image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            return self._encode(image)
+
+    def _render_face(self, file_path: str, facial_area: Sequence[int]) -> Image.Image:
+        largest = max(SIZES)
+        x1, y1, x2, y2 = facial_area
+        # Decode just finely enough for the crop to fill the largest size
+        factor = min(1.0, largest / (max(x2 - x1, y2 - y1, 1) * (1 + 2 * FACE_MARGIN)))
+        with Image.open(file_path) as image:
+            width = image.width
+            image.draft('RGB', (int(image.width * factor) + 1, int(image.height * factor) + 1))
+            ratio = image.width / width
+            # Face boxes are in upright coordinates, like cv2 decodes
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            face = image.crop(face_box([v * ratio for v in facial_area], image.width, image.height))
+        face.thumbnail((largest, largest), Image.LANCZOS)
+        return face
+
+    def _encode(self, image: Image.Image) -> Dict[int, bytes]:
+        thumbnails = {}
+        for size in sorted(SIZES, reverse=True):
+            # Each size is scaled down from the previous, larger one
+            image.thumbnail((size, size), Image.LANCZOS)
+            thumbnails[size] = self._save(image)
+        return thumbnails
+
+    def _save(self, image: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, self.format.upper(), quality=self.quality)
+        return buffer.getvalue()
+
+    def _account(self, written: int) -> None:
+        """Track the disk usage and evict old thumbnails when over budget"""
+        if not self.disk_budget:
+            return
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._disk_files())
+            else:
+                self._disk_bytes += written
+            if self._disk_bytes > self.disk_budget:
+                self._evict()
+
+    def _disk_files(self) -> Iterator[Tuple[str, float, int]]:
+        """Yields (path, modification time, size) of all thumbnail files"""
+        stack = [self.folder]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith(('.jpg', '.webp')):
+                            try:
+                                stat = entry.stat(follow_symlinks=False)
+                            except OSError:
+                                continue
+                            yield entry.path, stat.st_mtime, stat.st_size
+            except OSError:
+                continue
+
+    def _evict(self) -> None:
+        """Delete the least recently used files down to 90% of the disk budget, called with the lock held"""
+        target = int(self.disk_budget * 0.9)
+        files = sorted(self._disk_files(), key=lambda item: item[1])
+        total = sum(size for _, _, size in files)
+        removed = 0
+        for path, _, size in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        self._disk_bytes = total
+        logger.info(f"Evicted {removed} thumbnails, {total / 1024 / 1024:.1f} MB left on disk")
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0